@@ -0,0 +1,55 @@
+"""Measures the memory used for each user tracked by an IRCBot, with
+tracemalloc: made up users (see pyrclib.fakeserver.synthetic_members) are
+loaded into channels through NAMES and WHO replies.
+
+    python benchmarks/memory.py [--users 200000] [--channels 20]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from pyrclib.bot import IRCBot
+from pyrclib.fakeserver import synthetic_members
+from pyrclib.tests.helpers import FakeSender
+
+
+def load(bot, users, channels):
+    per_channel = users // channels
+    for c in range(channels):
+        channel = '#chan{0}'.format(c)
+        bot.line_received(':pybot!bot@my.host JOIN {0}'.format(channel))
+        members = synthetic_members(per_channel, start=c * per_channel)
+        for i in range(0, len(members), 50):
+            names = ' '.join(m.split('!', 1)[0] for m in members[i:i + 50])
+            bot.line_received(':srv 353 pybot = {0} :{1}'.format(channel,
+                                                                  names))
+        for i, member in enumerate(members):
+            nick = member.lstrip('+').split('!', 1)[0]
+            # Shared idents and hosts, as with cloaks
+            bot.line_received(
+                ':srv 352 pybot {0} ~user{1} host{2}.example.net srv {3} H '
+                ':0 Real Name'.format(channel, i % 50, i % 1000, nick))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--channels', type=int, default=20)
+    args = parser.parse_args()
+
+    bot = IRCBot('pybot', 'bot', 'Test Bot')
+    bot.sender = FakeSender()
+    bot.line_received(':srv 005 pybot PREFIX=(ov)@+ CHANTYPES=# '
+                      'CHANMODES=b,k,l,imnpst :are supported')
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    load(bot, args.users, args.channels)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    print('{0} users in {1} channels: {2} bytes/user'.format(
+        len(bot.users), len(bot.channels), used // len(bot.users)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Times the parsing of server lines: the old parser (decoding every line,
+then splitting it into prefix, command and arguments) against
+pyrclib.message.parse, alone (what a line without handlers costs) and
+followed by decode() and split_params() (what a handled line costs).
+The corpus is made up and always the same: PRIVMSG, NOTICE, WHO replies,
+MOTD and unknown lines.
+
+    python benchmarks/parse.py [--lines 1000000] [--repeat 3]
+"""
+import argparse
+import time
+
+from pyrclib.message import decode, parse, split_params
+
+TEMPLATES = [
+    ':user{0}!ident{0}@host{1}.example.net PRIVMSG #chan{2} :hello there, '
+    'this is message number {0}',
+    ':user{0}!ident{0}@host{1}.example.net PRIVMSG pybot :private {0}',
+    ':user{0}!ident{0}@host{1}.example.net NOTICE #chan{2} :notice {0}',
+    ':srv.example.net 352 pybot #chan{2} ~ident{0} host{1}.example.net '
+    'srv.example.net user{0} H :0 Real Name {0}',
+    ':srv.example.net 372 pybot :- Message of the day, line {0}',
+    ':srv.example.net 999 pybot some unknown numeric :{0}',
+]
+
+
+def corpus(count):
+    """Returns count lines, as received (bytes, without CR/LF).
+    """
+    return [TEMPLATES[i % len(TEMPLATES)].format(i, i % 1000,
+                                                 i % 20).encode()
+            for i in range(count)]
+
+
+def old_parse(line):
+    """The parser used before lines were kept as bytes: the whole line is
+    decoded, then split.
+    """
+    s = decode(line)
+    prefix = ''
+    if s[0] == ':':
+        prefix, s = s[1:].split(' ', 1)
+    if s.find(' :') != -1:
+        s, trailing = s.split(' :', 1)
+        args = s.split()
+        args.append(trailing)
+    else:
+        args = s.split()
+    command = args.pop(0)
+    return prefix, command, args
+
+
+def new_parse(line):
+    return parse(line)
+
+
+def new_parse_split(line):
+    prefix, command, rest = parse(line)
+    return decode(prefix), command, split_params(rest)
+
+
+def timeit(func, lines, repeat):
+    """Returns the best CPU time of repeat runs of func over lines.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.process_time()
+        for line in lines:
+            func(line)
+        elapsed = time.process_time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    lines = corpus(args.lines)
+    base = timeit(old_parse, lines, args.repeat)
+    print('{0} lines'.format(len(lines)))
+    for name, func in (('old parse', old_parse),
+                       ('parse', new_parse),
+                       ('parse + split_params', new_parse_split)):
+        elapsed = base if func is old_parse else \
+            timeit(func, lines, args.repeat)
+        print('{0:<22} {1:.3f}s  {2:.2f}x'.format(name, elapsed,
+                                                  base / elapsed))
+
+
+if __name__ == '__main__':
+    main()
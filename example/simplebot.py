@@ -1,3 +1,5 @@
+import logging
+
 from pyrclib.bot import IRCBot
 
 
@@ -9,6 +11,10 @@ class NiceBot(IRCBot):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)8s] %(name)12s - %(message)s',
+        level=logging.INFO,
+    )
     p = NiceBot('NiceBot', 'nicebot', 'Nice Bot')
     p.connect('irc.eu.rizon.net', 6667)
     p.join('#mychannel')
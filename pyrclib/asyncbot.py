@@ -0,0 +1,17 @@
+from pyrclib.asyncconnection import AsyncIRCConnection
+from pyrclib.bot import IRCBot
+
+
+class AsyncIRCBot(AsyncIRCConnection, IRCBot):
+    """IRCBot running on an asyncio event loop.
+    Events, state tracking and commands are the same as IRCBot, only
+    connect() is a coroutine:
+
+        bot = MyBot('nick', 'user', 'realname')
+        await bot.connect('irc.example.net')
+        bot.join('#channel')
+        await bot.wait_closed()
+
+    Events are called from the event loop thread and must not block.
+    """
+    pass
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+from collections import deque
+
+from pyrclib.connection import IRCConnection, AlreadyConnectedException, \
+    ConnectException, SSLNotAvailableException
+from pyrclib.linereceiver import LineBuffer
+from pyrclib.sendqueue import NORMAL, SendQueue
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncLineReceiver(object):
+    """Coroutine counterpart of LineReceiver.
+    Reads up to bufsize bytes at a time from an asyncio StreamReader and
+    hands every complete line to the bot in one batch.
+    """
+
+    def __init__(self, bot, reader, bufsize=16384):
+        self._bot = bot
+        self._reader = reader
+        self._bufsize = bufsize
+        self._linebuffer = LineBuffer()
+        self._lines = deque()
+
+    async def _recv(self):
+        """Read from the stream until at least a complete line is received.
+        Returns the list of lines, or None if the connection was closed.
+        """
+        while True:
+            try:
+                data = await self._reader.read(self._bufsize)
+            except ConnectionError:
+                return None
+
+            if not data:
+                return None
+
+            lines = self._linebuffer.feed(data)
+            if lines:
+                return lines
+
+    async def _read(self):
+        """Read a single line of bytes from the stream, without CR/LF.
+        Used while registering, lines received after it are kept for run().
+        """
+        if not self._lines:
+            lines = await self._recv()
+            if lines is None:
+                return None
+            self._lines.extend(lines)
+
+        return self._lines.popleft()
+
+    def disconnect(self):
+        self._bot.sender.stop()
+        self._bot.is_connected = False
+        self._bot.on_disconnect()
+        logger.info('Disconnected from %s', self._bot.server)
+
+    async def run(self):
+        if self._lines:
+            self._handle(list(self._lines))
+            self._lines.clear()
+
+        while self._bot.is_connected:
+            lines = await self._recv()
+            if lines is None:
+                # Connection was dropped, disconnect
+                if self._bot.is_connected:
+                    self.disconnect()
+                break
+
+            self._handle(lines)
+
+    def _handle(self, lines):
+        if self._bot.metrics is not None:
+            self._bot.metrics.incr('lines_received', len(lines))
+        self._bot.traffic.received(lines)
+        self._bot.lines_received(lines)
+
+
+class AsyncLineSender(object):
+    """Coroutine counterpart of LineSender.
+    Waits until a new element is added to the queue and then sends it as
+    fast as the rate limiter allows, to avoid getting disconnected from the
+    server for excess flood, highest priority first.
+    Must only be used from the event loop thread.
+    """
+
+    def __init__(self, bot, writer, limiter):
+        self._bot = bot
+        self._writer = writer
+        self._wakeup = asyncio.Event()
+        self._CRLF = '\r\n'
+        self.limiter = limiter
+        self.queue = SendQueue()
+        self.alive = True
+
+    def raw_line(self, line):
+        """Writes line right away, bypassing the queue.
+        Only used for registration and QUIT, use add() otherwise.
+        """
+        self._writer.write((line + self._CRLF).encode())
+        self.limiter.sent(line)
+        self._bot.traffic.sent(line)
+        if self._bot.metrics is not None:
+            self._bot.metrics.incr('lines_sent')
+
+    async def run(self):
+        try:
+            while self.alive:
+                self._wakeup.clear()
+                if not self.queue:
+                    await self._wakeup.wait()
+                    continue
+
+                wait = self.limiter.delay_for(self.queue.peek())
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                self.raw_line(self.queue.pop())
+        finally:
+            # Also when cancelled, not to leak the transport
+            self._writer.close()
+
+    def add(self, msg, priority=NORMAL):
+        """Queues a line with the given priority.
+        """
+        if self.queue.push(msg, priority):
+            self._wakeup.set()
+
+    def add_many(self, msgs, priority=NORMAL):
+        """Queues several lines with the given priority at once.
+        """
+        for msg in msgs:
+            self.queue.push(msg, priority)
+        self._wakeup.set()
+
+    def set_casemapping(self, casemapping):
+        self.queue.set_casemapping(casemapping)
+
+    def is_empty(self):
+        if self.queue:
+            return False
+        else:
+            return True
+
+    def pop(self):
+        return self.queue.pop()
+
+    def stop(self):
+        self.alive = False
+        self._wakeup.set()
+
+
+class AsyncIRCConnection(IRCConnection):
+    """Represent a low level connection to an IRC server driven by an asyncio
+    event loop instead of a receiver and a sender thread.
+    Every connection costs two coroutines, so a single loop can drive
+    thousands of them.
+    """
+
+    def __init__(self, nick, user, realname):
+        super().__init__(nick, user, realname)
+        self._tasks = []
+        self._loop = None
+
+    async def connect(self, address, port=6667, password=None, useSSL=False):
+        """Connect to the specified IRC server.
+        Returns when the server accepted our registration, reading and
+        sending then continue in the background.
+        - address: the address of the server
+        - port: port of the server, defaults to 6667
+        - password: if a password is required to connect
+        - useSSL: use a secure connection with SSL
+        """
+        if self.is_connected:
+            logger.error('Trying to connect to %s:%s while already connected'
+                         'to %s', address, port, self.server)
+            raise AlreadyConnectedException()
+
+        self.server = address
+        self._loop = asyncio.get_event_loop()
+        logger.info('Connecting to server %s:%s', address, port)
+
+        context = None
+        if useSSL:
+            try:
+                import ssl
+            except ImportError:
+                logger.exception('SSL not available')
+                raise SSLNotAvailableException()
+            context = ssl.create_default_context()
+
+        reader, writer = await asyncio.open_connection(address, port,
+                                                       ssl=context)
+        logger.debug('Stream initialized and connected')
+
+        self.receiver = AsyncLineReceiver(self, reader, self.recv_bufsize)
+        self.sender = AsyncLineSender(self, writer, self._make_limiter())
+
+        self._register(password)
+
+        while True:
+            line = await self.receiver._read()
+            if line is None:
+                break
+
+            if self._handshake_line(line):
+                break  # Successful connection
+
+        if not self.is_connected:
+            writer.close()
+            raise ConnectException('Connection closed during registration.')
+
+        self._tasks = [asyncio.ensure_future(self.receiver.run()),
+                       asyncio.ensure_future(self.sender.run())]
+        logger.debug('Started receiver and sender coroutines')
+        self.on_connect()
+
+    def call_later(self, delay, callback, *args):
+        """Calls callback(*args) after delay seconds on the event loop,
+        returns an object with a cancel() method.
+        """
+        if self.scheduler is not None:
+            return self.scheduler.call_later(delay, callback, *args)
+
+        return asyncio.get_event_loop().call_later(delay, callback, *args)
+
+    def call_from_thread(self, callback, *args):
+        """Calls callback(*args) on the event loop, from any thread.
+        """
+        if self._loop is None:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    async def wait_closed(self, timeout=None):
+        """Wait until both the receiver and the sender coroutines finished,
+        or at most timeout seconds if given.
+        """
+        if not self._tasks:
+            return
+        if timeout is None:
+            await asyncio.gather(*self._tasks)
+        else:
+            await asyncio.wait(self._tasks, timeout=timeout)
@@ -1,36 +1,87 @@
 import logging
-import re
+import sys
 import time
-from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from operator import itemgetter
 
 import pyrclib
-from pyrclib.channels import Channel
+from pyrclib import isupport
+from pyrclib.casemap import DEFAULT_CASEMAPPING, IRCDict
+from pyrclib.channels import Channel, MembershipIndex, PrefixTable
 from pyrclib.connection import IRCConnection
-from pyrclib.events import EventDispatcher
+from pyrclib.events import DEFAULT_PRIORITY, EventDispatcher, noop
+from pyrclib.message import parse, split_text
+from pyrclib.modes import ModeBatcher
+from pyrclib.ratelimit import PenaltyLimiter
+from pyrclib.sendqueue import BULK, CONTROL, URGENT
 from pyrclib.user import User
+from pyrclib.userinfo import UserInfoCache
+from pyrclib.who import WHOX_FIELDS, WhoSync
+from pyrclib.workers import OrderedWorkers
+
+logger = logging.getLogger(__name__)
 
 
 class IRCBot(IRCConnection):
 
     def __init__(self, nick, user, realname):
-        logging.basicConfig(
-            format='%(asctime)s [%(levelname)8s] %(name)12s - %(message)s',
-            level=logging.INFO,
-        )
         IRCConnection.__init__(self, nick, user, realname)
         self.version = pyrclib.__version__
-        self.delay = 1000
+        # Milliseconds between two lines sent. If set (and limiter isn't), a
+        # FixedDelay is used instead of a PenaltyLimiter.
+        self.delay = None
+        self.limiter = None
+        # Runs the public events away from the receiving thread, see
+        # use_workers
+        self.workers = None
+        # Runs the CPU bound handlers, see use_processes
+        self.processes = None
         self.dispatcher = EventDispatcher(self)
         self.protocol = {}
+        # Raw RPL_ISUPPORT tokens, see raw_005
+        self.isupport = {}
+        self.network = None
+        # Channel membership prefixes, shared by every Channel
+        self.prefixes = PrefixTable()
+        # Channel modes by CHANMODES class
+        self.chanmodes = isupport.ModeClasses()
 
         # Used to queue /WHO requests
-        self.pending_who = deque()
-
-        # User and channel lists
-        self.channels = {}
-        self.users = {}
+        self.who = WhoSync()
+        # Expires the WHO requests left unanswered, see _send_who
+        self._who_timer = None
+        # When to request ident/host/realname of the users in our channels:
+        # - 'join': WHO every channel we join
+        # - 'background': the same, but WHOs only go out when no other line
+        #   is waiting to be sent
+        # - 'lazy': only WHO a user when its ident, host or realname is read
+        #   for the first time (see User.resolver)
+        self.user_info = 'join'
+        # Details of users we lost track of, reused when they are seen again
+        self.user_cache = UserInfoCache()
+
+        # Used to batch mode changes, see queue_mode
+        self.mode_batcher = ModeBatcher()
+        self.mode_delay = 0.2
+
+        # User and channel lists, keyed according to the server CASEMAPPING
+        self.channels = IRCDict()
+        self.users = IRCDict()
+        # Names of the channels we share with each nick, see _add_member
+        self.user_channels = MembershipIndex()
+
+        # IRCv3 capabilities we know how to use:
+        # - multi-prefix: every prefix of a user is shown in NAMES replies,
+        #   not only the highest one
+        # - userhost-in-names: NAMES replies have full nick!user@host masks,
+        #   no WHO is needed on join to learn them
+        # - extended-join: JOINs have the account and realname of the user
+        # - away-notify: AWAY changes of users in our channels are sent to
+        #   us, instead of having to poll them with WHO
+        # - batch: netsplits and netjoins come as a single BATCH, handled
+        #   all at once (see on_netsplit and on_netjoin)
+        self.wanted_caps = ('multi-prefix', 'userhost-in-names',
+                            'extended-join', 'away-notify', 'batch')
 
         self.reply_clientinfo = 'CLIENTINFO FINGER PING SOURCE TIME ' \
                                 'USERINFO VERSION'
@@ -40,169 +91,167 @@ class IRCBot(IRCConnection):
         self.reply_version = 'pyrclib v%s' % self.version
 
     def line_received(self, line):
-        """Called on every line received from the server.
+        """Called on every line received from the server, as a tuple returned
+        by parse() or as a raw line to parse.
         This method must not be overridden.
         """
-        if line.startswith('PING '):
+        if line.__class__ is not tuple:
+            line = parse(line)
+
+        if line[1] == 'PING':
             self.on_serverping()
             return
 
         self.dispatcher.dispatch(line)
 
+    def _make_limiter(self):
+        if self.limiter is None and self.delay is None:
+            return PenaltyLimiter()
+        return IRCConnection._make_limiter(self)
+
+    def _reset_state(self):
+        """Forgets every channel and user, used before reconnecting.
+        """
+        self.who.clear()
+        if self._who_timer is not None:
+            self._who_timer.cancel()
+            self._who_timer = None
+        self.dispatcher.batches.clear()
+        for nick in list(self.users):
+            self._forget_user(nick)
+        self.channels.clear()
+        self.users.clear()
+        self.user_channels.clear()
+
     # ==========================================================================
     # Raw events
     # Raw numerics documentation from: http://www.mirc.net/raws/
     # ==========================================================================
 
+    # Methods called with the parsed value of these RPL_ISUPPORT tokens, to
+    # update the lookup structures derived from them.
+    _isupport_hooks = {
+        'CASEMAPPING': '_set_casemapping',
+        'CHANMODES': '_set_chanmodes',
+        'NETWORK': '_set_network',
+        'PREFIX': '_set_prefixes',
+    }
+
     def raw_005(self, *params):
         """Parse RPL_ISUPPORT (numeric 005) to understand this IRCd's protocol
         implementation. Otherwise, our client would fail to interpret server
         replies or modes changes.
+        Every token is kept as received in self.isupport, the ones known by
+        pyrclib.isupport are parsed into self.protocol too.
+        """
+        protocol = self.protocol
+        for token, raw, key, value in isupport.parse(params[:-1]):
+            if raw is None:
+                self.isupport.pop(token, None)
+            else:
+                self.isupport[token] = raw
+
+            if key is None:
+                continue
+            keys = key if isinstance(key, tuple) else (key,)
+            if raw is None:
+                for k in keys:
+                    protocol.pop(k, None)
+                continue
+
+            if isinstance(key, tuple):
+                protocol.update(zip(key, value))
+            else:
+                protocol[key] = value
+
+            hook = self._isupport_hooks.get(token)
+            if hook is not None:
+                getattr(self, hook)(value)
 
-        Referenced document: http://www.irc.org/tech_docs/005.html
-        """
-        for par in params[:-1]:
-            param, sep, value = par.partition('=')
-            if param == 'PREFIX':
-                # A list of channel modes a person can get and the respective
-                # prefix a channel or nickname will get in case the person
-                # has it.
-                # The order of the modes goes from most powerful to least
-                # powerful.
-                # Those prefixes are shown in the output of the WHOIS, WHO and
-                # NAMES command.
-                regex = re.compile('\((\w+)\)(.*)')
-                r = regex.search(value)
-                modes, symbols = r.groups()
-                zipped = zip(modes, symbols)
-                self.protocol['prefixes'] = list(zipped)
-            elif param == 'CHANTYPES':
-                # The supported channel prefixes.
-                self.protocol['chantypes'] = value
-            elif param == 'CHANMODES':
-                # This is a list of channel modes according to 4 types.
-                #  modes_target
-                #    Mode that adds or removes a nick or address to a list.
-                #    Always has a parameter.
-                #  modes_param
-                #    Mode that changes a setting and always has a parameter.
-                #  modes_setparam
-                #    Mode that changes a setting and only has a parameter
-                #    when set.
-                #  modes_noparam
-                #    Mode that changes a setting and never has a parameter.
-                (self.protocol['modes_target'], self.protocol['modes_param'],
-                 self.protocol['modes_setparam'],
-                 self.protocol['modes_noparam']) = value.split(',')
-            elif param == 'MODES':
-                # Maximum number of channel modes with parameter allowed per
-                # MODE command.
-                self.protocol['maxmodes'] = int(value)
-            elif param == 'NICKLEN':
-                # Maximum nickname length.
-                self.protocol['maxnicklength'] = int(value)
-            elif param == 'NETWORK':
-                # The IRC network name.
-                self.network = value
-            elif param == 'EXCEPTS':
-                # The server support ban exceptions (e mode).
-                # See RFC 2811 for more information.
-                self.protocol['supports_excepts'] = True
-            elif param == 'INVEX':
-                # The server support invite exceptions (+I mode).
-                # See RFC 2811 for more information.
-                self.protocol['supports_invex'] = True
-            elif param == 'WALLCHOPS':
-                # The server supports messaging channel operators
-                self.protocol['wallchops'] = True
-            elif param == 'WALLVOICES':
-                # Notice to +#channel goes to all voiced persons.
-                self.protocol['wallvoices'] = True
-            elif param == 'STATUSMSG':
-                # The server supports messaging channel member
-                # who have a certain status or higher.
-                # The status is one of the letters from PREFIX.
-                self.protocol['statusmsg'] = value
-            elif param == 'CASEMAPPING':
-                # Case mapping used for nick- and channel name comparing.
-                self.protocol['casemapping'] = value
-            elif param == 'ELIST':
-                # The server supports extentions for the LIST command.
-                # The tokens specify which extention are supported.
-                self.protocol['elist'] = value
-            elif param == 'TOPICLEN':
-                # Maximum topic length.
-                self.protocol['topiclen'] = int(value)
-            elif param == 'KICKLEN':
-                # Maximum kick comment length.
-                self.protocol['kicklen'] = int(value)
-            elif param == 'CHANNELLEN':
-                # Maximum channel name length.
-                self.protocol['channellen'] = int(value)
-            elif param == 'SILENCE':
-                # The server support the SILENCE command.
-                # The number is the maximum number of allowed entries in the
-                # list.
-                self.protocol['max_silencelist'] = int(value)
-            elif param == 'RFC2812':
-                # Server supports RFC 2812 features.
-                self.protocol['rfc2812'] = True
-            elif param == 'PENALTY':
-                # Server gives extra penalty to some commands instead of the
-                # normal
-                # 2 seconds per message and 1 second for every 120 bytes in a
-                # message.
-                self.protocol['penalty'] = True
-            elif param == 'FNC':
-                # Forced nick changes: The server may change the nickname
-                # without the client sending a NICK message.
-                self.protocol['fnc'] = True
-            elif param == 'SAFELIST':
-                # The LIST is sent in multiple iterations so send queue won't
-                # fill and kill the client connection.
-                self.protocol['safelist'] = True
-            elif param == 'AWAYLEN':
-                # The max length of an away message.
-                self.protocol['awaylen'] = int(value)
-            elif param == 'USERIP':
-                # The USERIP command exists.
-                self.protocol['userip'] = True
-            elif param == 'CPRIVMSG':
-                # The CPRIVMSG command exists, used for mass messaging people in
-                # specified channel (CPRIVMSG channel nick,nick2,... :text)
-                self.protocol['cprivmsg'] = True
-            elif param == 'CNOTICE':
-                # The CNOTICE command exists, just like CPRIVMSG.
-                self.protocol['cnotice'] = True
-            elif param == 'MAXNICKLEN':
-                # Maximum length of nicks the server will send to the client?
-                self.protocol['maxnicklen'] = int(value)
-            elif param == 'MAXTARGETS':
-                # Maximum targets allowed for PRIVMSG and NOTICE commands.
-                self.protocol['maxtargets'] = int(value)
-            elif param == 'KNOCK':
-                # The KNOCK command exists.
-                self.protocol['knock'] = True
-            elif param == 'WHOX':
-                # The WHO command uses WHOX protocol.
-                self.protocol['whox'] = True
-            elif param == 'CALLERID':
-                # The server supports server side ignores via the +g user mode.
-                self.protocol['callerid'] = True
+    def _set_prefixes(self, prefixes):
+        """Updates the prefix table, converting the status of the users we
+        already know to the new bits.
+        """
+        table = self.prefixes
+        old = table.by_mode
+        table.update(''.join(m for m, s in prefixes),
+                     ''.join(s for m, s in prefixes))
+        if table.by_mode == old:
+            return
+
+        converted = {0: 0}
+        for chan in self.channels.values():
+            users = chan.users
+            for nick, status in list(users.items()):
+                new = converted.get(status)
+                if new is None:
+                    new = converted[status] = table.translate(status, old)
+                if new != status:
+                    users[nick] = new
+
+    def _set_chanmodes(self, classes):
+        self.chanmodes.update(classes)
+
+    def _set_network(self, network):
+        self.network = network
+
+    def _set_casemapping(self, casemapping):
+        """Rekeys the user and channel lists for a new casemapping.
+        """
+        self.users.set_casemapping(casemapping)
+        self.channels.set_casemapping(casemapping)
+        self.user_channels.set_casemapping(casemapping)
+        if self.sender is not None:
+            self.sender.set_casemapping(casemapping)
+        for chan in self.channels.values():
+            chan.users.set_casemapping(casemapping)
+            chan.modes.set_casemapping(casemapping)
 
     def raw_315(self, channel, endofwho):
         """This is sent at the end of a WHO request.
         """
-        self.pending_who.popleft()  # Oldest /WHO done, remove it
-        if len(self.pending_who) > 0:
-            # Other /WHO request(s) waiting, send the oldest one
-            self.sender.raw_line('WHO {0}'.format(self.pending_who[0]))
+        if self.who.done(channel):
+            self._send_who()
 
-    def raw_324(self, channel, modes, args=None):
+    def raw_324(self, channel, modes, *args):
         """This is returned for a MODE request.
         """
-        # TEMPORARY: we are currently ignoring modes parameters!
-        self.channels[channel].modes = modes[1:]
+        chanmodes = self.channels[channel].modes
+        chanmodes.reset()
+        takes_param = self.chanmodes.takes_param
+        args = list(args)
+        for mode in modes[1:]:
+            if takes_param(mode, True):
+                # Keys are only shown to people on the channel, some
+                # servers don't send them at all.
+                chanmodes.set(mode, args.pop(0) if args else '')
+            else:
+                chanmodes.set(mode)
+
+    def _list_entry(self, mode, channel, mask, set_by=None, time=None):
+        chan = self.channels.get(channel)
+        if chan is None:
+            return  # Not one of our channels
+        date = datetime.fromtimestamp(float(time)) if time else None
+        chan.modes.masks(mode).add(mask, set_by, date)
+
+    def raw_346(self, channel, mask, *args):
+        """This is returned for each invite exception (+I) of a channel when
+        requesting the list.
+        """
+        self._list_entry('I', channel, mask, *args[:2])
+
+    def raw_348(self, channel, mask, *args):
+        """This is returned for each ban exception (+e) of a channel when
+        requesting the list.
+        """
+        self._list_entry('e', channel, mask, *args[:2])
+
+    def raw_367(self, channel, mask, *args):
+        """This is returned for each ban (+b) of a channel when requesting
+        the list.
+        """
+        self._list_entry('b', channel, mask, *args[:2])
 
     def raw_329(self, channel, time):
         """This is returned as part of a MODE request,
@@ -237,12 +286,34 @@ class IRCBot(IRCConnection):
         """This is returned by a WHO request, one line for each user that is
         matched.
         """
-        hops, realname = hopsname.split(' ', 1)
-        self.users[nick].ident = ident
-        self.users[nick].host = host
-        self.users[nick].realname = realname
+        hops, sep, realname = hopsname.partition(' ')
+        self._who_reply(nick, ident, host, status, realname)
+
+    def raw_354(self, token, *fields):
+        """This is returned by a WHOX request, with the fields requested.
+        Only replies to our own requests (see WhoSync) are handled here.
+        """
+        if token != self.who.token or len(fields) != len(WHOX_FIELDS) - 1:
+            return self.raw_unknown('354', token, *fields)
+
+        chan, ident, host, nick, status, realname = fields
+        self._who_reply(nick, ident, host, status, realname)
+
+    def _who_reply(self, nick, ident, host, status, realname):
+        user = self.users.get(nick)
+        if user is None:
+            return  # Not someone we share a channel with
+        # Idents and hosts are repeated a lot (cloaks, shared hosts): intern
+        # them so that every user refers to the same string.
+        user.ident = sys.intern(ident)
+        user.host = sys.intern(host)
+        user.realname = realname
+        if status[:1] == 'G':
+            if user.away is None:
+                user.away = ''  # Away, but the message is unknown
+        else:
+            user.away = None
         # TODO: parse flags:
-        # - away status
         # - ircop status
 
     def raw_353(self, bla, channel, names):
@@ -250,24 +321,25 @@ class IRCBot(IRCConnection):
         initially join a channel.
         It contains a list of every user on the channel.
         """
-        prefixes = list(map(itemgetter(1), self.protocol['prefixes']))
+        split_name = self.prefixes.split_name
+        users = self.users
         for name in names.split(' '):
-            if name[0] not in prefixes:
-                mode = ''
-            else:
-                mode = name[0]
-                st = 1
-                for c in name[1:]:
-                    if c in prefixes:
-                        mode += c
-                        st += 1
-                    else:
-                        break
-
-                name = name[st:]
-
-            self.users[name] = User(name)
-            self.channels[channel].users[name] = mode
+            status, name = split_name(name)
+            if '!' in name:
+                # userhost-in-names
+                user = User.from_mask(name)
+                name = user.nick
+                known = users.get(name)
+                if known is None:
+                    users[name] = user
+                    if self.user_info == 'lazy':
+                        # Only the realname is missing
+                        user.resolver = self._resolve_user
+                elif known._ident is None:
+                    known.ident, known.host = user.ident, user.host
+            elif name not in users:
+                users[name] = self._new_user(name)
+            self._add_member(channel, name, status)
 
     def raw_366(self, channel, msg):
         """This is returned at the end of a NAMES list, after all
@@ -275,6 +347,15 @@ class IRCBot(IRCConnection):
         """
         pass
 
+    def raw_396(self, host, msg):
+        """This is returned when our displayed host changes, for example when
+        a vhost or cloak is applied.
+        """
+        me = self.users.get(self.nick)
+        if me is not None:
+            me.host = host
+
+    @noop
     def raw_unknown(self, numeric, *args):
         pass
 
@@ -283,76 +364,212 @@ class IRCBot(IRCConnection):
     #
     # ==========================================================================
 
-    def _pre_join(self, user, channel):
+    def _pre_join(self, user, channel, account=None, realname=None):
         """Adds the user to the channel user list.
         If we are joining a channel, add this channel to ours, send a MODE
         request to get the channel modes and a WHO request to get ident/host
         of unknown users.
+        account and realname are only sent with extended-join.
         """
+        if realname is not None:
+            user.realname = realname
+            user.account = account if account != '*' else None
         self.users[user.nick] = user
-        if user.nick == self.nick:
-            self.channels[channel] = Channel(channel)
-            self.sender.raw_line('MODE {0}'.format(channel))
-            self.request_who(channel)
-
-        self.channels[channel].users[user.nick] = ''
-        self.on_join(user, channel)
+        if self._is_me(user.nick):
+            self.channels[channel] = Channel(
+                channel,
+                self.protocol.get('casemapping', DEFAULT_CASEMAPPING),
+                self.prefixes)
+            self.sender.add('MODE {0}'.format(channel), CONTROL)
+            if self.user_info != 'lazy' and \
+                    'userhost-in-names' not in self.caps:
+                self.request_who(channel)
+
+        self._add_member(channel, user.nick, 0)
+        self._emit(channel, self.on_join, user, channel)
 
     def _pre_part(self, user, channel, reason=None):
         """Removes the user from the channel user list.
         """
-        if user.nick == self.nick:
-            del self.channels[channel]
+        if self._is_me(user.nick):
+            self._forget_channel(channel)
         else:
-            del self.channels[channel].users[user.nick]
-            # remove him from global user list only if we don't share any chan.
-            if self.get_comchans(user.nick) == []:
-                del self.users[user.nick]
+            self._remove_member(channel, user.nick)
 
-        self.on_part(user, channel, reason)
+        self._emit(channel, self.on_part, user, channel, reason)
 
     def _pre_nick(self, user, newnick):
         """Changes a user's nick.
         """
         oldnick = user.nick
-        if oldnick == self.nick:
+        if self._is_me(oldnick):
             self.nick = newnick
 
-        for chan in self.get_comchans(user.nick):
-            chan.renameuser(oldnick, newnick)
+        for name in self.user_channels.rename(oldnick, newnick):
+            self.channels[name].renameuser(oldnick, newnick)
 
-        del self.users[oldnick]
+        self.users.pop(oldnick, None)
         user.nick = newnick
         self.users[newnick] = user
-        self.on_nickchange(oldnick, newnick)
+        self._emit(oldnick, self.on_nickchange, oldnick, newnick)
 
     def _pre_kick(self, sender, channel, nick, reason=None):
         """Removes a user from a channel's user list when he gets kicked.
         """
-        del self.channels[channel].users[nick]
-        if self.get_comchans(nick) == []:
-            del self.users[nick]
+        if self._is_me(nick):
+            self._forget_channel(channel)
+        else:
+            self._remove_member(channel, nick)
 
-        self.on_kick(sender, nick, channel, reason)
+        self._emit(channel, self.on_kick, sender, nick, channel, reason)
 
     def _pre_kill(self, killer, victim, message):
         """We were killed by someone, disconnect.
         """
-        if victim == self.nick:  # is this really needed?
+        if self._is_me(victim):  # is this really needed?
             self.receiver.disconnect()
 
-        self.on_kill(killer, victim, message)
+        self._emit(victim, self.on_kill, killer, victim, message)
 
     def _pre_quit(self, user, reason=None):
         """Removes a user from list when he quits.
         """
         nick = user.nick
-        del self.users[nick]
+        self._forget_user(nick)
+
+        for name in self.user_channels.pop(nick, ()):
+            del self.channels[name].users[nick]
+
+        self._emit(nick, self.on_quit, user, reason)
+
+    def _pre_netsplit(self, servers, quits):
+        """Removes every user lost in a netsplit (a BATCH of QUITs).
+        quits is a list of (user, reason) tuples.
+        """
+        users = []
+        for quit in quits:
+            nick = quit[0].nick
+            self._forget_user(nick)
+            for name in self.user_channels.pop(nick, ()):
+                self.channels[name].users.pop(nick, None)
+            users.append(quit[0])
+
+        self._emit(None, self.on_netsplit, servers, users)
+
+    def _pre_netjoin(self, servers, joins):
+        """Adds back every user of a netjoin (a BATCH of JOINs).
+        joins is a list of (user, channel[, account, realname]) tuples.
+        """
+        joined = []
+        for join in joins:
+            user, channel = join[:2]
+            if channel not in self.channels:
+                continue
+            known = self.users.get(user.nick)
+            if known is None:
+                self.users[user.nick] = user
+            else:
+                user = known  # Already seen in another JOIN of the batch
+            if len(join) == 4:
+                user.account = join[2] if join[2] != '*' else None
+                user.realname = join[3]
+            self._add_member(channel, user.nick, 0)
+            joined.append((user, channel))
+
+        self._emit(None, self.on_netjoin, servers, joined)
+
+    def _emit(self, key, callback, *args):
+        """Calls a public event, on the worker handling key (a channel or nick)
+        if workers are used.
+        """
+        workers = self.workers
+        if workers is None:
+            callback(*args)
+            return
 
-        for chan in self.get_comchans(user.nick):
-            del chan.users[nick]
+        if getattr(callback, 'noop', False):
+            return
+        if key is not None:
+            key = self.users.normalize(key)
+        workers.submit(key, callback, *args)
+        if self.metrics is not None:
+            self.metrics.gauge('worker_queue', len(workers))
+
+    def _is_me(self, nick):
+        """True if nick is our nick, according to the server casemapping.
+        """
+        me = self.nick
+        if nick == me:
+            return True
+        if len(nick) != len(me):
+            return False
+        users = self.users
+        return users.normalize(nick) == users.normalize(me)
+
+    def _add_member(self, channel, nick, status):
+        """Adds nick to a channel's user list and to the membership index.
+        """
+        chan = self.channels[channel]
+        chan.users[nick] = status
+        self.user_channels.add(nick, chan.name)
+
+    def _remove_member(self, channel, nick):
+        """Removes nick from a channel's user list, and from the global user
+        list too if we don't share any other channel.
+        """
+        chan = self.channels[channel]
+        chan.users.pop(nick, None)
+        self._unlink(nick, chan.name)
+
+    def _forget_channel(self, channel):
+        """We left a channel: drop it and every user we don't see anymore.
+        """
+        chan = self.channels.pop(channel, None)
+        if chan is None:
+            return
 
-        self.on_quit(user, reason)
+        for nick in chan.users:
+            self._unlink(nick, chan.name)
+
+    def _unlink(self, nick, name):
+        """Removes channel name from the membership index of nick, and nick
+        from the user list if it was the last channel we shared.
+        """
+        if self.user_channels.discard(nick, name) and not self._is_me(nick):
+            self._forget_user(nick)
+
+    def _new_user(self, nick):
+        """Returns a User for a nick seen without its ident and host, filled
+        from the user cache if possible.
+        """
+        user = User(nick)
+        info = self.user_cache.get(self.users.normalize(nick))
+        if info is not None:
+            user.ident, user.host, user.realname = info
+        elif self.user_info == 'lazy':
+            user.resolver = self._resolve_user
+        return user
+
+    def _resolve_user(self, user):
+        """Requests the details of a user, see User.resolver.
+        """
+        self.request_who(user.nick)
+
+    def _forget_user(self, nick):
+        """Removes nick from the user list, keeping its details in the user
+        cache.
+        """
+        user = self.users.pop(nick, None)
+        if user is not None and user._ident is not None:
+            self.user_cache.put(self.users.normalize(nick), user._ident,
+                                user._host, user._realname)
+
+    def _pre_away(self, user, message=None):
+        """A user in one of our channels went away or came back
+        (away-notify).
+        """
+        user.away = message
+        self._emit(user.nick, self.on_away, user, message)
 
     def _pre_topic(self, sender, channel, newtopic):
         """Topic tracking.
@@ -361,43 +578,52 @@ class IRCBot(IRCConnection):
         self.channels[channel].topic.set_by = sender
         self.channels[channel].topic.date = datetime.now()
 
-        self.on_topicchange(sender, channel, newtopic)
+        self._emit(channel, self.on_topicchange, sender, channel, newtopic)
 
     def _set_prefix(self, channel, m, target):
         """Adds a prefix (like op, voice etc.) to a user in a channel.
         """
-        s = dict(self.protocol['prefixes'])[m]
-        self.channels[channel].users[target] += s
+        users = self.channels[channel].users
+        users[target] = users.get(target, 0) | self.prefixes.by_mode[m]
 
     def _unset_prefix(self, channel, m, target):
         """Removes a prefix (like op, voice etc.) from a user in a channel.
         """
-        s = dict(self.protocol['prefixes'])[m]
-        current = self.channels[channel].users[target]
-        self.channels[channel].users[target] = current.replace(s, '')
+        users = self.channels[channel].users
+        users[target] = users.get(target, 0) & ~self.prefixes.by_mode[m]
 
     def _pre_set_mode(self, user, channel, mode, target=None):
         """Syncs channels modes with mode changes.
         """
-        if mode not in map(itemgetter(0), self.protocol['prefixes']):
-            self.channels[channel].modes += mode
+        if mode not in self.prefixes.by_mode:
+            chanmodes = self.channels[channel].modes
+            if mode in self.chanmodes.lists:
+                chanmodes.masks(mode).add(str(target), user.nick,
+                                          datetime.now())
+            else:
+                chanmodes.set(mode, target)
 
-        self.on_set_mode(user, channel, mode, target)
+        self._emit(channel, self.on_set_mode, user, channel, mode, target)
 
     def _pre_unset_mode(self, user, channel, mode, target=None):
         """Syncs channels modes with mode changes.
         """
-        if mode not in map(itemgetter(0), self.protocol['prefixes']):
-            current = self.channels[channel].modes
-            self.channels[channel].modes = current.replace(mode, '')
+        if mode not in self.prefixes.by_mode:
+            chanmodes = self.channels[channel].modes
+            if mode in self.chanmodes.lists:
+                chanmodes.masks(mode).remove(str(target))
+            else:
+                chanmodes.unset(mode)
 
-        self.on_unset_mode(user, channel, mode, target)
+        self._emit(channel, self.on_unset_mode, user, channel, mode,
+                   target)
 
     # ==========================================================================
     # Public events
     #
     # ==========================================================================
 
+    @noop
     def on_disconnect(self):
         """Called on disconnection from a server, can be overridden as required.
         """
@@ -407,84 +633,210 @@ class IRCBot(IRCConnection):
         """Called on a PING request from the IRC server.
         Shouldn't be overridden...
         """
-        self.sender.raw_line('PONG ' + self.nick)
+        self.sender.add('PONG ' + self.nick, URGENT)
 
+    @noop
     def on_privmsg(self, sender, channel, message):
         """Called when a message is received.
         DON'T USE, USE on_channel_message or on_private_message
         """
         pass
 
+    @noop
     def on_channel_message(self, sender, channel, message):
         """Called when a channel message is received.
         """
         pass
 
+    @noop
     def on_private_message(self, sender, message):
         """Called when a private message is received.
         """
         pass
 
+    @noop
     def on_action(self, sender, channel, message):
         """Called when an action is received (/me does something).
         """
         pass
 
+    @noop
     def on_join(self, user, channel):
         """Called when someone (our bot included) joins a channel.
         """
         pass
 
+    @noop
     def on_part(self, user, channel, reason=None):
         """Called when someone (out bot included) parts from a channel.
         """
         pass
 
+    @noop
     def on_nickchange(self, oldnick, newnick):
         """Called when someone (our bot included) changes nick.
         """
         pass
 
+    @noop
     def on_notice(self, sender, target, message):
         """Called when a notice is received. Target can be a channel or our bot's nick.
         """
         pass
 
+    @noop
     def on_quit(self, user, reason):
         """Called when someone (our bot included) quits from IRC.
         """
         pass
 
+    @noop
     def on_kick(self, sender, target, channel, reason):
         """Called when someone (our bot included) gets kicked from a channel.
         """
         pass
 
+    @noop
     def on_topicchange(self, sender, channel, newtopic):
         """Called when someone changes channel topic.
         """
         pass
 
+    @noop
     def on_invite(self, sender, target, channel):
         """TODO
         """
         pass
 
+    @noop
     def on_kill(self, killer, victim, message):
         """Some evil user killed us.
         """
         pass
 
+    @noop
+    def on_netsplit(self, servers, users):
+        """Called once for a whole netsplit, with the list of the users that
+        quit, instead of calling on_quit for each of them.
+        Only received if the server supports batch.
+        """
+        pass
+
+    @noop
+    def on_netjoin(self, servers, joins):
+        """Called once when the servers of a netsplit are back, with a list
+        of (user, channel) for each JOIN, instead of calling on_join for
+        each of them.
+        Only received if the server supports batch.
+        """
+        pass
+
+    def on_batch(self, type, params, lines):
+        """Called at the end of a BATCH of a type not handled by pyrclib (like
+        chathistory), with the lines it contained as parsed tuples.
+        By default they are dispatched one by one like any other line.
+        """
+        for line in lines:
+            self.dispatcher.dispatch(line)
+
+    def __setattr__(self, name, value):
+        """Rebuilds the dispatch tables when an event method is replaced on
+        the instance (bot.on_join = ...), see EventDispatcher.
+        """
+        object.__setattr__(self, name, value)
+        if name.startswith(('on_', 'raw_')) and 'dispatcher' in self.__dict__:
+            self.dispatcher.build()
+
+    def tags(self):
+        """Returns the IRCv3 tags of the line being handled, as a dict.
+        """
+        return self.dispatcher.tags()
+
+    def subscribe(self, command, callback, priority=DEFAULT_PRIORITY,
+                  process=False):
+        """Calls callback for every command (e.g. 'PRIVMSG') or numeric
+        (e.g. '352') received, after the handlers with a lower priority.
+        Commands are called with (sender, *params), numerics with their
+        params but our nick. See also pyrclib.events.handler.
+        """
+        self.dispatcher.subscribe(command, callback, priority, process)
+
+    def unsubscribe(self, command, callback):
+        self.dispatcher.unsubscribe(command, callback)
+
+    def use_workers(self, threads=4, maxsize=1000):
+        """Runs the public events (on_join, on_channel_message... and the
+        handlers added with pyrclib.events.handler or subscribe) on a pool of
+        threads, so that a slow handler doesn't stop the bot from reading
+        lines, answering PINGs and tracking users and channels.
+        Events of the same channel, or of the same nick when not about a
+        channel, keep their order. When maxsize events are waiting on a
+        thread the receiving thread waits too.
+        State is still updated as lines are read: handlers may see channels
+        and users as they are some lines later, and tags() is not available.
+        Only for the threaded IRCBot, AsyncIRCBot events must not block.
+        """
+        if self.workers is not None:
+            self.workers.stop(wait=False)
+        self.workers = OrderedWorkers(threads, maxsize) if threads else None
+        self.dispatcher.build()
+
+    def use_processes(self, processes=None):
+        """Runs the handlers registered with process=True (see
+        pyrclib.events.handler) on a pool of processes, as many as the CPUs
+        if processes is None, so that CPU bound handlers don't compete for
+        the GIL with the receiving and sending threads.
+        The lines they return are queued for sending when they are done.
+        use_processes(0) runs them in the receiving thread again.
+        """
+        if self.processes is not None:
+            self.processes.shutdown(wait=False)
+        self.processes = ProcessPoolExecutor(processes) \
+            if processes != 0 else None
+
+    def _offload_done(self, future):
+        """Called when a handler run on the process pool is done.
+        """
+        if future.cancelled():
+            return
+        try:
+            lines = future.result()
+        except Exception:
+            logger.exception('Unhandled exception in process handler')
+            return
+
+        self.call_from_thread(self._send_lines, lines)
+
+    def _send_lines(self, lines):
+        """Queues what a process handler returned.
+        """
+        if not lines:
+            return
+        if isinstance(lines, str):
+            self.sender.add(lines)
+        else:
+            self.sender.add_many(lines)
+
+    @noop
+    def on_away(self, user, message=None):
+        """Called when a user goes away, or comes back if message is None.
+        Only received if the server supports away-notify.
+        """
+        pass
+
+    @noop
     def on_set_mode(self, user, channel, mode, target=None):
         """Called when a mode is set.
         """
         pass
 
+    @noop
     def on_unset_mode(self, user, channel, mode, target=None):
         """Called when a mode is unset.
         """
         pass
 
+    @noop
     def on_unknown(self, *args):
         """An unknown event happened! We don't know how to process it.
         """
@@ -544,6 +896,7 @@ class IRCBot(IRCConnection):
         """
         self.ctcpreply(sender.nick, 'VERSION', self.reply_version)
 
+    @noop
     def on_CTCPREPLY_ping(self, sender, target, arg):
         """Triggered when someone replies to our CTCP ping query.
         """
@@ -559,7 +912,7 @@ class IRCBot(IRCConnection):
         if key:
             s += ' ' + key
 
-        self.sender.raw_line(s)
+        self.sender.add(s, CONTROL)
 
     def part(self, channel, reason=None):
         """Parts from a channel with an optional reason.
@@ -569,7 +922,7 @@ class IRCBot(IRCConnection):
         if reason:
             s += ' :' + reason
 
-        self.sender.raw_line(s)
+        self.sender.add(s, CONTROL)
 
     def ctcpreply(self, target, type, reply=None):
         """Sends a reply (a notice) to a CTCP request.
@@ -594,26 +947,129 @@ class IRCBot(IRCConnection):
 
     def notice(self, target, msg):
         """Sends a notice to a channel or a user.
+        Messages too long for a single line are split.
         This method must not be overridden.
         """
-        self.sender.add('NOTICE {0} :{1}'.format(target, msg))
+        self._send_text('NOTICE', target, msg)
 
     def privmsg(self, target, msg):
         """Sends a message to a channel or a user.
+        Messages too long for a single line are split.
+        This method must not be overridden.
+        """
+        self._send_text('PRIVMSG', target, msg)
+
+    def _send_text(self, command, target, msg):
+        """Queues a PRIVMSG or NOTICE, split in as many lines as needed to
+        fit in 512 bytes once the server adds our prefix. Each part of a
+        CTCP message is a CTCP message too.
+        """
+        head = '{0} {1} :'.format(command, target)
+        limit = 510 - self._prefix_length() - len(head.encode())
+        if len(msg) * 4 <= limit:  # Fits whatever the encoding
+            self.sender.add(head + msg)
+            return
+
+        tail = ''
+        if len(msg) > 1 and msg[0] == '\x01' and msg[-1] == '\x01':
+            # CTCP (ACTION...): split the text and wrap every part again
+            tag, sep, msg = msg[1:-1].partition(' ')
+            head += '\x01' + tag + sep
+            tail = '\x01'
+            limit -= len(tag.encode()) + len(sep) + 2
+        self.sender.add_many([head + chunk + tail
+                              for chunk in split_text(msg, limit)])
+
+    def broadcast(self, targets, msg, notice=False, cmsg=False):
+        """Sends the same message (or notice) to many channels and/or users
+        using as few lines as possible: targets are grouped in
+        comma-separated lists of up to MAXTARGETS (or TARGMAX). Long messages are split
+        as privmsg() does, every group getting all the parts.
+        With cmsg=True, if the server supports CPRIVMSG/CNOTICE, users
+        sharing a channel where we are voiced or opped are messaged through
+        it instead, one line each, as it isn't subject to the server's target
+        change limits.
         This method must not be overridden.
         """
-        self.sender.add('PRIVMSG {0} :{1}'.format(target, msg))
+        command = 'NOTICE' if notice else 'PRIVMSG'
+        ccommand = 'C' + command
+        use_cmsg = cmsg and self.protocol.get(ccommand.lower(), False)
+        chantypes = self.protocol.get('chantypes', '#&')
+        if 'maxtargets' in self.protocol:
+            maxtargets = self.protocol['maxtargets']
+        else:
+            maxtargets = self.protocol.get('targmax', {}).get(command, 1)
+
+        names = []
+        for target in targets:
+            if use_cmsg and target[0] not in chantypes:
+                channel = self._cmsg_channel(target)
+                if channel is not None:
+                    self._send_text(ccommand,
+                                    '{0} {1}'.format(target, channel), msg)
+                    continue
+            names.append(target)
+        if not names:
+            return
+
+        # Room left for the targets and the text in 'COMMAND targets :text'
+        room = 510 - self._prefix_length() - len(command) - 3
+        sizes = [len(target.encode()) for target in names]
+        # Keep room for the longest target, or for up to half of the line
+        reserved = max(max(sizes),
+                       min(sum(sizes) + len(sizes) - 1, room // 2))
+        chunks = split_text(msg, room - reserved)
+        budget = room - max(len(chunk.encode()) for chunk in chunks)
+
+        lines = []
+        group = []
+        length = -1
+        for target, size in zip(names, sizes):
+            if group and ((maxtargets is not None and
+                           len(group) >= maxtargets) or
+                          length + size + 1 > budget):
+                lines.extend('{0} {1} :{2}'.format(command, ','.join(group),
+                                                   chunk) for chunk in chunks)
+                group = []
+                length = -1
+
+            group.append(target)
+            length += size + 1
+
+        lines.extend('{0} {1} :{2}'.format(command, ','.join(group), chunk)
+                     for chunk in chunks)
+        self.sender.add_many(lines)
+
+    def _cmsg_channel(self, nick):
+        """Returns a channel we share with nick where we are voiced or
+        opped, as required by CPRIVMSG/CNOTICE, or None.
+        """
+        for chan in self.get_comchans(nick):
+            if chan.is_voiced(self.nick):
+                return chan.name
+        return None
+
+    def _prefix_length(self):
+        """Returns the length of the ':nick!user@host ' prefix the server
+        adds to our lines when relaying them to other clients.
+        """
+        me = self.users.get(self.nick)
+        if me is not None and me.ident and me.host:
+            return len(str(me).encode()) + 2
+        # Unknown host, assume the longest allowed one (63 bytes) and a ~ in
+        # front of the ident.
+        return len(self.nick) + len(self.user) + 63 + 5
 
     def identify(self, password):
         """Identifies the bot to NickServ.
         This method must not be overridden.
         """
-        self.sender.raw_line('NICKSERV IDENTIFY {0}'.format(password))
+        self.sender.add('NICKSERV IDENTIFY {0}'.format(password), CONTROL)
 
     def invite(self, channel, user):
         """Used to invite someone in a channel.
         """
-        self.sender.raw_line('INVITE {0} {1}'.format(user, channel))
+        self.sender.add('INVITE {0} {1}'.format(user, channel), CONTROL)
 
     def kick(self, channel, user, reason=None):
         """Used to kick a user out of a channel with an optional reason.
@@ -622,34 +1078,62 @@ class IRCBot(IRCConnection):
         if reason:
             s += ' :' + reason
 
-        self.sender.raw_line(s)
+        self.sender.add(s, CONTROL)
 
     def voice(self, channel, user):
         """Voices a user (or more, if user is a list) in a channel.
         """
-        m = 'v'
-        if isinstance(user, list):
-            m *= len(user)
-        else:
-            user = [user]
-        self.set_mode(channel, m, user)
+        self._queue_modes(channel, '+v', user)
+
+    def devoice(self, channel, user):
+        """Devoices a user (or more, if user is a list) in a channel.
+        """
+        self._queue_modes(channel, '-v', user)
 
     def op(self, channel, user):
         """Ops a user (or more, if user is a list) in a channel.
         """
-        m = 'o'
-        if isinstance(user, list):
-            m *= len(user)
+        self._queue_modes(channel, '+o', user)
+
+    def deop(self, channel, user):
+        """Deops a user (or more, if user is a list) in a channel.
+        """
+        self._queue_modes(channel, '-o', user)
+
+    def _queue_modes(self, channel, mode, users):
+        if not isinstance(users, list):
+            users = [users]
+        for user in users:
+            self.queue_mode(channel, mode, user)
+
+    def queue_mode(self, channel, mode, arg=None):
+        """Queues a mode change like '+o', 'nick' or '-m' for a channel.
+        Changes queued within mode_delay seconds are sent together, in as
+        few MODE lines as the server MODES limit allows.
+        """
+        if self.mode_batcher.add(channel, mode, arg):
+            self.call_later(self.mode_delay, self.flush_modes, channel)
+
+    def flush_modes(self, channel=None):
+        """Sends the mode changes queued for a channel (or every channel)
+        right away.
+        """
+        if channel is None:
+            channels = list(self.mode_batcher.pending)
         else:
-            user = [user]
-        self.set_mode(channel, m, user)
+            channels = [channel]
+
+        maxmodes = self.protocol.get('maxmodes', 3)
+        for chan in channels:
+            for line in self.mode_batcher.pop_lines(chan, maxmodes):
+                self.sender.add(line, CONTROL)
 
     def nickchange(self, newnick):
         """This method changes our bot's nick. It could fail, for example
         if the new nickname is not available.
         This method must not be overridden.
         """
-        self.sender.raw_line('NICK {0}'.format(newnick))
+        self.sender.add('NICK {0}'.format(newnick), CONTROL)
 
     def topic(self, channel, newtopic=None):
         """This method is used to change a channel's topic.
@@ -660,7 +1144,7 @@ class IRCBot(IRCConnection):
         if newtopic:
             s += ' :' + newtopic
 
-        self.sender.raw_line(s)
+        self.sender.add(s, CONTROL)
 
     def set_mode(self, channel, mode, args=None):
         """Set a mode (or more than one) in a channel with optional arguments.
@@ -670,7 +1154,7 @@ class IRCBot(IRCConnection):
         if args:
             s += ' ' + ' '.join(args)
 
-        self.sender.raw_line(s)
+        self.sender.add(s, CONTROL)
 
     def unset_mode(self, channel, mode, args=None):
         """Removes a mode (or more than one) from a channel with optional
@@ -681,21 +1165,43 @@ class IRCBot(IRCConnection):
         if args:
             s += ' ' + ' '.join(args)
 
-        self.sender.raw_line(s)
+        self.sender.add(s, CONTROL)
 
     def request_who(self, target):
-        """Puts a /WHO request in a queue. Sends it if the queue is empty.
-        """
-        self.pending_who.append(target)
-        if len(self.pending_who) == 1:
-            self.sender.raw_line('WHO {0}'.format(target))
+        """Puts a /WHO request in a queue, see WhoSync.
+        """
+        self.who.add(target)
+        self._send_who()
+
+    def _send_who(self):
+        """Sends as many queued WHO requests as allowed.
+        """
+        whox = self.protocol.get('whox', False)
+        maxtargets = self.protocol.get('targmax', {}).get('WHO', 1) or 20
+        lines = self.who.pop_lines(whox, maxtargets)
+        if lines:
+            self.sender.add_many(
+                lines, BULK if self.user_info == 'background' else CONTROL)
+        # Check again later, if replies are lost nothing else would
+        if self.who.inflight and self._who_timer is None:
+            self._who_timer = self.call_later(self.who.timeout,
+                                              self._who_timeout)
+
+    def _who_timeout(self):
+        self._who_timer = None
+        self._send_who()
+
+    def banned_in(self, user):
+        """Returns the names of the channels where user (a User or a
+        nick!user@host string) matches a ban, see Channel.is_banned.
+        Only bans we know of are checked: ban lists are only received from
+        mode changes and when requested (MODE #channel +b).
+        """
+        return [chan.name for chan in self.channels.values()
+                if chan.is_banned(user)]
 
     def get_comchans(self, nick):
         """Returns a list of channels our bot and this user are in.
-            """
-        comchans = []
-        for bla, chan in self.channels.items():
-            if nick in chan.users:
-                comchans.append(chan)
-
-        return comchans
+        """
+        return [self.channels[name]
+                for name in self.user_channels.get(nick, ())]
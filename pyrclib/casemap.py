@@ -0,0 +1,111 @@
+from collections.abc import MutableMapping
+from sys import intern
+
+_UPPER = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_LOWER = b'abcdefghijklmnopqrstuvwxyz'
+
+# Translation tables for the CASEMAPPING values of RPL_ISUPPORT.
+# In rfc1459 []\~ are the uppercase versions of {}|^, strict-rfc1459
+# leaves out ~ and ^.
+# Tables work on the UTF-8 encoded name: bytes.translate() is several times
+# faster than str.translate() and casemappings only touch ASCII, which never
+# appears inside a multibyte UTF-8 sequence.
+CASEMAPPINGS = {
+    'ascii': bytes.maketrans(_UPPER, _LOWER),
+    'rfc1459': bytes.maketrans(_UPPER + b'[]\\~', _LOWER + b'{}|^'),
+    'strict-rfc1459': bytes.maketrans(_UPPER + b'[]\\', _LOWER + b'{}|'),
+}
+
+DEFAULT_CASEMAPPING = 'rfc1459'
+
+
+def irc_lower(s, casemapping=DEFAULT_CASEMAPPING):
+    """Returns the lowercase version of a nick or channel name according to
+    the casemapping. Unknown casemappings are handled as rfc1459.
+    """
+    table = CASEMAPPINGS.get(casemapping, CASEMAPPINGS[DEFAULT_CASEMAPPING])
+    return s.encode().translate(table).decode()
+
+
+class IRCDict(MutableMapping):
+    """A dictionary with nicks or channel names as keys, compared according
+    to the server's casemapping: d['Foo[]'] and d['foo{}'] are the same item.
+    Keys are normalized once when stored or looked up, iterating yields them
+    as they were first stored.
+    Normalized keys are interned, so that the many IRCDicts keyed by the same
+    nick share a single copy of it.
+    """
+
+    def __init__(self, casemapping=DEFAULT_CASEMAPPING, data=None):
+        self._table = CASEMAPPINGS.get(casemapping,
+                                       CASEMAPPINGS[DEFAULT_CASEMAPPING])
+        self._data = {}  # normalized key -> value
+        # normalized key -> original key, only for keys that differ
+        self._keys = {}
+        if data is not None:
+            self.update(data)
+
+    def set_casemapping(self, casemapping):
+        """Changes the casemapping, normalizing the existing keys again.
+        """
+        table = CASEMAPPINGS.get(casemapping,
+                                 CASEMAPPINGS[DEFAULT_CASEMAPPING])
+        if table is self._table:
+            return
+
+        items = list(self.items())
+        self._table = table
+        self.clear()
+        self.update(items)
+
+    def normalize(self, key):
+        """Returns key as it is stored internally.
+        """
+        return key.encode().translate(self._table).decode()
+
+    def __getitem__(self, key):
+        return self._data[key.encode().translate(self._table).decode()]
+
+    def __setitem__(self, key, value):
+        k = key.encode().translate(self._table).decode()
+        data = self._data
+        if k not in data:
+            k = intern(k)
+            if k != key:
+                self._keys[k] = key
+        data[k] = value
+
+    def __delitem__(self, key):
+        k = key.encode().translate(self._table).decode()
+        del self._data[k]
+        self._keys.pop(k, None)
+
+    def __contains__(self, key):
+        return key.encode().translate(self._table).decode() in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key.encode().translate(self._table).decode(),
+                              default)
+
+    def pop(self, key, *default):
+        k = key.encode().translate(self._table).decode()
+        if k in self._data:
+            self._keys.pop(k, None)
+            return self._data.pop(k)
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def clear(self):
+        self._data.clear()
+        self._keys.clear()
+
+    def __iter__(self):
+        # keys.get(k, k) for every normalized key k
+        return map(self._keys.get, self._data, self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, dict(self.items()))
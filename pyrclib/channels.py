@@ -1,17 +1,308 @@
+import re
+from collections import OrderedDict
+
+from pyrclib.casemap import DEFAULT_CASEMAPPING, IRCDict, irc_lower
 from pyrclib.user import User
 
 
+class PrefixTable(object):
+    """The channel membership prefixes supported by the server (PREFIX in
+    RPL_ISUPPORT), e.g. (ov)@+.
+    A user's status in a channel is an int where every prefix is a bit, the
+    most powerful prefix being the highest bit: statuses compare by rank
+    and status >= table.bit('o') means "op or higher".
+    """
+
+    __slots__ = ('modes', 'symbols', 'by_mode', 'by_symbol')
+
+    def __init__(self, modes='ov', symbols='@+'):
+        self.update(modes, symbols)
+
+    def update(self, modes, symbols):
+        """Sets the prefixes, most powerful first.
+        Changed in place, so that every Channel sees the new values: statuses
+        already stored must be converted with translate().
+        """
+        n = len(modes)
+        self.modes = modes
+        self.symbols = symbols
+        self.by_mode = dict((m, 1 << (n - i - 1)) for i, m in enumerate(modes))
+        self.by_symbol = dict((s, 1 << (n - i - 1))
+                              for i, s in enumerate(symbols))
+
+    def translate(self, status, old_by_mode):
+        """Returns status, made of the bits of an older table (its by_mode),
+        with the bits of this one. Prefixes no longer supported are lost.
+        """
+        new = 0
+        for mode, bit in old_by_mode.items():
+            if status & bit:
+                new |= self.by_mode.get(mode, 0)
+        return new
+
+    def bit(self, mode):
+        """Returns the status bit for a prefix mode letter (o, v...), 0 if the
+        server doesn't support it.
+        """
+        return self.by_mode.get(mode, 0)
+
+    def split_name(self, name):
+        """Splits a name from a NAMES reply (e.g. @+nick) into its status
+        bits and nick.
+        """
+        by_symbol = self.by_symbol
+        status = 0
+        i = 0
+        for c in name:
+            bit = by_symbol.get(c)
+            if bit is None:
+                break
+            status |= bit
+            i += 1
+        return status, name[i:]
+
+    def highest(self, status):
+        """Returns the symbol of the most powerful prefix in status, or an
+        empty string.
+        """
+        if not status:
+            return ''
+        return self.symbols[len(self.symbols) - status.bit_length()]
+
+    def to_symbols(self, status):
+        """Returns every prefix symbol in status, most powerful first.
+        """
+        n = len(self.symbols)
+        return ''.join(s for i, s in enumerate(self.symbols)
+                       if status & 1 << (n - i - 1))
+
+
+class MembershipIndex(object):
+    """The names of the channels we share with each nick.
+    A single channel is stored as the channel name itself (shared with the
+    Channel), a few of them as a tuple and more than SET_SIZE as a set: most
+    users cost no more than a dict entry, and a nick in thousands of
+    channels (like ours) is still added and removed in constant time.
+    """
+
+    SET_SIZE = 8
+
+    def __init__(self, casemapping=DEFAULT_CASEMAPPING):
+        self._index = IRCDict(casemapping)
+
+    @staticmethod
+    def _names(value):
+        if value.__class__ is str:
+            return (value,)
+        return tuple(value)
+
+    def add(self, nick, name):
+        index = self._index
+        value = index.get(nick)
+        if value is None:
+            index[nick] = name
+        elif value.__class__ is str:
+            if value != name:
+                index[nick] = (value, name)
+        elif value.__class__ is tuple:
+            if name not in value:
+                if len(value) < self.SET_SIZE:
+                    index[nick] = value + (name,)
+                else:
+                    index[nick] = set(value + (name,))
+        else:
+            value.add(name)
+
+    def discard(self, nick, name):
+        """Removes channel name from the channels of nick, returns True if
+        nick doesn't share any channel with us anymore.
+        """
+        index = self._index
+        value = index.get(nick)
+        if value is None:
+            return False
+        if value.__class__ is str:
+            if value != name:
+                return False
+            del index[nick]
+            return True
+        if value.__class__ is tuple:
+            names = tuple(n for n in value if n != name)
+            index[nick] = names[0] if len(names) == 1 else names
+        else:
+            value.discard(name)
+            if not value:
+                del index[nick]
+                return True
+        return False
+
+    def get(self, nick, default=()):
+        value = self._index.get(nick)
+        return default if value is None else self._names(value)
+
+    def pop(self, nick, default=()):
+        value = self._index.pop(nick, None)
+        return default if value is None else self._names(value)
+
+    def rename(self, oldnick, newnick):
+        """Moves the channels of oldnick to newnick, returns them.
+        """
+        value = self._index.pop(oldnick, None)
+        if value is None:
+            return ()
+        self._index[newnick] = value
+        return self._names(value)
+
+    def set_casemapping(self, casemapping):
+        self._index.set_casemapping(casemapping)
+
+    def clear(self):
+        self._index.clear()
+
+    def __getitem__(self, nick):
+        return self._names(self._index[nick])
+
+    def __contains__(self, nick):
+        return nick in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+
+class MaskList(object):
+    """A list mode of a channel (bans, ban exceptions, invite exceptions...)
+    Masks are matched against nick!user@host strings through a single regex,
+    compiled the first time it's needed after a change.
+    """
+
+    __slots__ = ('casemapping', 'entries', '_regex')
+
+    def __init__(self, casemapping=DEFAULT_CASEMAPPING):
+        self.casemapping = casemapping
+        # normalized mask -> (mask, set_by, date)
+        self.entries = OrderedDict()
+        self._regex = None
+
+    def add(self, mask, set_by=None, date=None):
+        self.entries[irc_lower(mask, self.casemapping)] = (mask, set_by, date)
+        self._regex = None
+
+    def remove(self, mask):
+        if self.entries.pop(irc_lower(mask, self.casemapping), None):
+            self._regex = None
+
+    def clear(self):
+        self.entries.clear()
+        self._regex = None
+
+    def set_casemapping(self, casemapping):
+        """Changes the casemapping, normalizing the masks again.
+        """
+        if casemapping == self.casemapping:
+            return
+        entries = list(self.entries.values())
+        self.casemapping = casemapping
+        self.clear()
+        for entry in entries:
+            self.entries[irc_lower(entry[0], casemapping)] = entry
+
+    def matches(self, hostmask):
+        """True if any mask matches hostmask (a User or nick!user@host).
+        Extended bans (like $a:account or ~q:mask) never match.
+        """
+        if not self.entries:
+            return False
+
+        if self._regex is None:
+            self._regex = re.compile(r'(?:{0})\Z'.format('|'.join(
+                re.escape(k).replace('\\*', '.*').replace('\\?', '.')
+                for k in self.entries)), re.DOTALL)
+
+        return self._regex.match(
+            irc_lower(str(hostmask), self.casemapping)) is not None
+
+    def __contains__(self, mask):
+        return irc_lower(mask, self.casemapping) in self.entries
+
+    def __iter__(self):
+        return (entry[0] for entry in self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ChannelModes(object):
+    """The modes of a channel, by CHANMODES class:
+    - lists: list modes (modes_target), letter -> MaskList
+    - params: modes with a parameter (modes_param, modes_setparam),
+      letter -> parameter
+    - flags: set of modes without parameter (modes_noparam)
+    str() gives the letters of the modes set, lists excluded.
+    """
+
+    __slots__ = ('casemapping', 'lists', 'params', 'flags')
+
+    def __init__(self, casemapping=DEFAULT_CASEMAPPING):
+        self.casemapping = casemapping
+        self.lists = {}
+        self.params = {}
+        self.flags = set()
+
+    def set_casemapping(self, casemapping):
+        self.casemapping = casemapping
+        for masklist in self.lists.values():
+            masklist.set_casemapping(casemapping)
+
+    def masks(self, mode):
+        """Returns the MaskList of a list mode, e.g. masks('b') for bans.
+        """
+        masklist = self.lists.get(mode)
+        if masklist is None:
+            masklist = self.lists[mode] = MaskList(self.casemapping)
+        return masklist
+
+    def set(self, mode, param=None):
+        """Sets a non-list mode.
+        """
+        if param is None:
+            self.flags.add(mode)
+        else:
+            self.params[mode] = param
+
+    def unset(self, mode):
+        """Unsets a non-list mode.
+        """
+        self.flags.discard(mode)
+        self.params.pop(mode, None)
+
+    def reset(self):
+        """Unsets every non-list mode, lists are kept.
+        """
+        self.flags.clear()
+        self.params.clear()
+
+    def __contains__(self, mode):
+        return mode in self.flags or mode in self.params
+
+    def __str__(self):
+        return ''.join(sorted(self.flags.union(self.params)))
+
+
 class Channel(object):
     """Represents a channel we are in.
+    users maps nicks to their status, see PrefixTable.
     """
 
-    def __init__(self, name):
+    __slots__ = ('name', 'users', 'topic', 'modes', 'creationdate',
+                 'prefixes')
+
+    def __init__(self, name, casemapping=DEFAULT_CASEMAPPING, prefixes=None):
         self.name = name
-        self.users = {}
+        self.users = IRCDict(casemapping)
+        self.prefixes = prefixes if prefixes is not None else PrefixTable()
         self.topic = Topic()
-        # TODO: needs a better way to store modes,
-        # what if the channel has a key/limit?
-        self.modes = ''
+        self.modes = ChannelModes(casemapping)
+        self.creationdate = None
 
     def renameuser(self, oldnick, newnick):
         """Called when a user changes nick.
@@ -20,26 +311,68 @@ class Channel(object):
         del self.users[oldnick]
         self.users[newnick] = modes
 
+    def status(self, nick):
+        """Returns the status bits of nick, 0 if not on the channel.
+        """
+        return self.users.get(nick, 0)
+
+    def has_prefix(self, nick, mode):
+        """True if nick has the prefix mode (o, v...) in this channel.
+        """
+        return bool(self.users.get(nick, 0) & self.prefixes.bit(mode))
+
+    def prefix(self, nick):
+        """Returns the symbol shown in front of nick, e.g. @, or ''.
+        """
+        return self.prefixes.highest(self.users.get(nick, 0))
+
+    def is_op(self, nick):
+        """True if nick is a channel operator or higher (like ~ and &).
+        """
+        bit = self.prefixes.bit('o')
+        return bool(bit) and self.users.get(nick, 0) >= bit
+
+    def is_voiced(self, nick):
+        """True if nick is voiced or has any higher prefix.
+        """
+        bit = self.prefixes.bit('v')
+        return bool(bit) and self.users.get(nick, 0) >= bit
+
+    @property
+    def key(self):
+        return self.modes.params.get('k')
+
+    @property
+    def limit(self):
+        limit = self.modes.params.get('l')
+        return int(limit) if limit is not None else None
+
+    def is_banned(self, user):
+        """True if user (a User or nick!user@host) matches a ban and no ban
+        exception (+e).
+        """
+        lists = self.modes.lists
+        bans = lists.get('b')
+        if bans is None or not bans.matches(user):
+            return False
+        excepts = lists.get('e')
+        return excepts is None or not excepts.matches(user)
+
     def __str__(self):
         return '{0} [+{1}]'.format(self.name, self.modes)
 
     def __contains__(self, item):
         if isinstance(item, User):
-            if item.nick in self.users:
-                return True
-            return False
-
-        for user in self.users.keys():
-            if user.lower() == item.lower():
-                return True
-
-        return False
+            item = item.nick
+        return item in self.users
 
 
 class Topic(object):
     """Represents a channel topic (text, set_by, date).
     """
 
+    __slots__ = ('text', 'set_by', 'date')
+
     def __init__(self, text=None, set_by=None, date=None):
         self.text = text
         self.set_by = set_by
@@ -1,8 +1,13 @@
 import logging
 import socket
+import threading
 
 from pyrclib.linereceiver import LineReceiver
 from pyrclib.linesender import LineSender
+from pyrclib.message import parse, split_params
+from pyrclib.ratelimit import FixedDelay
+from pyrclib.sendqueue import URGENT
+from pyrclib.traffic import TrafficRecorder
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +21,26 @@ class IRCConnection(object):
         self.user = user
         self.realname = realname
         self.delay = 0
+        # Rate limiter for queued lines, see pyrclib.ratelimit.
+        # If None, a FixedDelay of self.delay milliseconds is used.
+        self.limiter = None
+        # Size of the buffer used for each recv_into() call
+        self.recv_bufsize = 16384
         self.is_connected = False
         self.server = None
         self.receiver = None
         self.sender = None
+        # Last lines received and sent, see pyrclib.traffic
+        self.traffic = TrafficRecorder()
+        # Optional Metrics (or ScopedMetrics) object counting traffic
+        self.metrics = None
+        # Optional object with a call_later(delay, callback, *args) method
+        self.scheduler = None
+        # IRCv3 capabilities to request while registering, if the server
+        # supports them, and the ones it enabled.
+        self.wanted_caps = ()
+        self.caps = set()
+        self._cap_ls = set()
 
     def connect(self, address, port=6667, password=None, useSSL=False):
         """Connect to the specified IRC server.
@@ -48,49 +69,105 @@ class IRCConnection(object):
                 raise SSLNotAvailableException()
             s = ssl.wrap_socket(s)
 
-        fo = s.makefile('rb')
-        self.receiver = LineReceiver(self, fo)
+        self.receiver = LineReceiver(self, s, self.recv_bufsize)
         logger.debug('Initialized line receiver')
 
         # Manually handle connection to the server
-        self.sender = LineSender(self, s, fo, self.delay)
+        self.sender = LineSender(self, s, self._make_limiter())
         logger.debug('Initialized line sender')
 
-        if password:
-            self.sender.raw_line('PASS {0}'.format(password))
-
-        self.sender.raw_line('NICK {0}'.format(self.nick))
-        self.sender.raw_line(
-            'USER {0} * * :{1}'.format(self.user, self.realname))
+        self._register(password)
 
         while True:
-            line = fo.readline()
-            if not line:
+            line = self.receiver._read()
+            if line is None:
                 break
 
-            line = line.decode()
-            if line[-2:] == '\r\n':
-                line = line[:-2]
-
-            logger.info('<<< %s', line)
-            if line.startswith('PING') or line.startswith('PONG'):
-                self.sender.raw_line('PONG ' + line.split(' ')[1])
-                continue
-
-            srv, code, me, msg = line.split(' ', 3)
-            if code == '001':
-                self.is_connected = True
+            if self._handshake_line(line):
                 break  # Successful connection
-            elif code == '433':
-                # TODO: change to altnick
-                self.nick += '_'
-                self.sender.raw_line('NICK {0}'.format(self.nick))
 
         self.receiver.start()
         self.sender.start()
         logger.debug('Start receiver and sender threads')
         self.on_connect()
 
+    def _make_limiter(self):
+        if self.limiter is None:
+            return FixedDelay(self.delay)
+        return self.limiter
+
+    def _register(self, password=None):
+        """Send the CAP/PASS/NICK/USER registration lines.
+        """
+        self.caps = set()
+        self._cap_ls = set()
+        if self.wanted_caps:
+            # The server waits for CAP END before completing registration
+            self.sender.raw_line('CAP LS 302')
+
+        if password:
+            self.sender.raw_line('PASS {0}'.format(password))
+
+        self.sender.raw_line('NICK {0}'.format(self.nick))
+        self.sender.raw_line(
+            'USER {0} * * :{1}'.format(self.user, self.realname))
+
+    def _handshake_line(self, line):
+        """Handle a line received while registering with the server.
+        Returns True once the server accepted our registration (001).
+        """
+        self.traffic.received((line,))
+        prefix, code, rest = parse(line)[:3]
+        if code == 'PING' or code == 'PONG':
+            self.sender.raw_line('PONG ' + split_params(rest)[0])
+            return False
+
+        if code == 'CAP':
+            self._handshake_cap(split_params(rest))
+            return False
+
+        if code == '001':
+            self.is_connected = True
+            return True
+        elif code == '433':
+            # TODO: change to altnick
+            self.nick += '_'
+            self.sender.raw_line('NICK {0}'.format(self.nick))
+
+        return False
+
+    def _handshake_cap(self, params):
+        """Handle a CAP reply while registering: request the wanted
+        capabilities among the ones listed by the server, then end the
+        negotiation.
+        """
+        if len(params) < 3:
+            return
+
+        subcommand = params[1].upper()
+        caps = params[-1].split()
+        if subcommand == 'LS':
+            self._cap_ls.update(cap.partition('=')[0] for cap in caps)
+            if len(params) > 3 and params[2] == '*':
+                return  # The list continues on the next line
+
+            wanted = [cap for cap in self.wanted_caps if cap in self._cap_ls]
+            if wanted:
+                self.sender.raw_line('CAP REQ :{0}'.format(' '.join(wanted)))
+            else:
+                self.sender.raw_line('CAP END')
+        elif subcommand == 'ACK':
+            for cap in caps:
+                if cap[0] == '-':
+                    self.caps.discard(cap[1:])
+                else:
+                    self.caps.add(cap.lstrip('~='))
+            logger.info('Enabled capabilities: %s',
+                        ' '.join(sorted(self.caps)))
+            self.sender.raw_line('CAP END')
+        elif subcommand == 'NAK':
+            self.sender.raw_line('CAP END')
+
     def disconnect(self, quitmsg=None):
         """Disconnect from the server with an optional quit message.
         The on_disconnect event will be called when done.
@@ -98,6 +175,24 @@ class IRCConnection(object):
         self.sender.raw_line('QUIT :{0}'.format(quitmsg if quitmsg else ''))
         self.receiver.disconnect()
 
+    def call_later(self, delay, callback, *args):
+        """Calls callback(*args) after delay seconds, returns an object with
+        a cancel() method.
+        """
+        if self.scheduler is not None:
+            return self.scheduler.call_later(delay, callback, *args)
+
+        timer = threading.Timer(delay, callback, args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def call_from_thread(self, callback, *args):
+        """Calls callback(*args) from any thread, where the connection
+        expects it (right away, for the threaded connection).
+        """
+        callback(*args)
+
     def on_disconnect(self):
         """Overridden by IRCBot/client.
         """
@@ -108,12 +203,26 @@ class IRCConnection(object):
         """
         pass
 
+    def lines_received(self, lines):
+        """Called with every batch of lines (bytes, without CR/LF) received
+        from the server, calls line_received for each of them.
+        """
+        for line in lines:
+            try:
+                self.line_received(parse(line))
+            except Exception:
+                logger.exception('Unhandled exception in line receiver')
+
     def line_received(self, line):
-        """Called on every line received from the server.
+        """Called on every line received from the server, as a tuple returned
+        by parse() or as a raw line to parse.
         Overridden in IRCBot to call events.
         """
-        if line.startswith('PING '):
-            self.sender.raw_line('PONG ' + self.nick)
+        if line.__class__ is not tuple:
+            line = parse(line)
+
+        if line[1] == 'PING':
+            self.sender.add('PONG ' + self.nick, URGENT)
 
 
 class ConnectException(BaseException):
@@ -1,13 +1,118 @@
+import logging
+from operator import itemgetter
+from sys import intern
+
+from pyrclib.message import AT, BANG, decode, parse, parse_tags, split_params
 from pyrclib.user import User
 
+logger = logging.getLogger(__name__)
 
-class EventDispatcher(object):
+# Handlers with a lower priority run first. The built-in handlers keeping
+# track of users, channels and modes run before any other.
+STATE_PRIORITY = 0
+DEFAULT_PRIORITY = 10
+
+# Lines held back for a single batch, more and they are handled one by one
+MAX_BATCH_LINES = 10000
+
+
+def noop(func):
+    """Marks a default event method that does nothing: the dispatcher
+    doesn't call it unless it's overridden.
     """
+    func.noop = True
+    return func
+
+
+def handler(command, priority=DEFAULT_PRIORITY, process=False):
+    """Decorator registering a method of an IRCBot subclass as a handler of
+    a command sent by a user, like 'PRIVMSG', called with (sender, *params),
+    or of a numeric like '352', called with its params but our nick.
+    A method can be decorated more than once.
+
+    With process=True the handler is meant for CPU bound work and is run on
+    the bot process pool, if any (see IRCBot.use_processes). It must be a
+    staticmethod (placed above the handler decorator) or a module level
+    function, it gets a UserSnapshot instead of the sender and it returns
+    None, a line or a list of lines to send to the server.
+    """
+    def decorate(func):
+        func.__dict__.setdefault('handles', []).append(
+            (command, priority, process))
+        return func
+    return decorate
+
+
+def _is_noop(callback):
+    return getattr(callback, 'noop', False)
+
+
+def _chain(callbacks):
+    """Returns a callable calling each of callbacks in turn. An exception
+    raised by one of them is logged, and doesn't stop the others.
+    """
+    if len(callbacks) == 1:
+        callback = callbacks[0]
+
+        def call_one(*args):
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Unhandled exception in %r', callback)
+        return call_one
+
+    def call(*args):
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Unhandled exception in %r', callback)
+    return call
+
+
+class Batch(object):
+    """Lines of an IRCv3 BATCH, held back until the batch ends.
+    """
+
+    __slots__ = ('ref', 'type', 'params', 'lines')
+
+    def __init__(self, ref, type, params):
+        self.ref = ref
+        self.type = type
+        self.params = params
+        self.lines = []
+
+
+class EventDispatcher(object):
+    """Calls the handlers of each line received.
+    Handlers are looked up in flat tables built by build() when the bot is
+    created: the built-in ones (usermap, rawsmap), the methods decorated with
+    handler() and the callbacks passed to subscribe(). Default event methods
+    that do nothing are left out, and commands without any handler are
+    skipped without even splitting their parameters.
+    Replacing an event method of the bot instance rebuilds them, see
+    IRCBot.__setattr__.
     """
 
     def __init__(self, bot):
         self.bot = bot
+        # Raw tags of the line being dispatched, see tags()
+        self.raw_tags = None
+        self._tags = None
+        # Open batches by reference tag
+        self.batches = {}
+        # Callbacks added with subscribe(), as
+        # (command, callback, priority, process)
+        self.subscribers = []
+
+        self.build()
+
+    def build(self):
+        """Builds the dispatch tables, from the current event methods of the
+        bot.
+        """
         self.usermap = {
+            'AWAY': self.bot._pre_away,
             'INVITE': self.bot.on_invite,
             'JOIN': self.bot._pre_join,
             'KICK': self.bot._pre_kick,
@@ -45,13 +150,141 @@ class EventDispatcher(object):
             '331': self.bot.raw_331,
             '332': self.bot.raw_332,
             '333': self.bot.raw_333,
+            '346': self.bot.raw_346,
+            '348': self.bot.raw_348,
             '352': self.bot.raw_352,
             '353': self.bot.raw_353,
+            '354': self.bot.raw_354,
+            '367': self.bot.raw_367,
+            '396': self.bot.raw_396,
         }
 
-        self.modesmap = {
+        bot = self.bot
+        for name, key in (('on_privmsg', self._target_key),
+                          ('on_private_message', self._sender_key),
+                          ('on_channel_message', self._target_key),
+                          ('on_action', self._target_key),
+                          ('on_notice', self._target_key)):
+            callback = getattr(bot, name)
+            setattr(self, '_' + name,
+                    None if _is_noop(callback) else self._defer(callback, key))
+        self._ctcp = dict((command, self._defer(callback, self._sender_key))
+                          for command, callback in self.ctcpmap.items()
+                          if not _is_noop(callback))
+        self._ctcpreply = dict((command,
+                                self._defer(callback, self._sender_key))
+                               for command, callback in
+                               self.ctcpreplymap.items()
+                               if not _is_noop(callback))
 
-        }
+        # (command, callback, priority), the built-in handlers first
+        handlers = []
+        for command, callback in self.usermap.items():
+            if callback == self._parse_privmsg:
+                if not (self._ctcp or self._on_privmsg or self._on_action or
+                        self._on_private_message or
+                        self._on_channel_message):
+                    continue
+            elif callback == self._parse_notice:
+                if not (self._ctcpreply or self._on_notice):
+                    continue
+            elif not callback.__name__.startswith('_'):
+                # A public event (on_invite) rather than state tracking
+                callback = self._defer(callback, self._params_key)
+            handlers.append((command, callback, STATE_PRIORITY))
+        for command, callback in self.rawsmap.items():
+            handlers.append((command, callback, STATE_PRIORITY))
+
+        added = []
+        cls = bot.__class__
+        for name in dir(cls):
+            func = getattr(cls, name, None)
+            for command, priority, process in getattr(func, 'handles', ()):
+                added.append((command, func if process else getattr(bot, name),
+                              priority, process))
+        added.extend(self.subscribers)
+        for command, callback, priority, process in added:
+            if process:
+                callback = self._offload(callback)
+            key = self._numeric_key if command.isdigit() else self._params_key
+            handlers.append((command, self._defer(callback, key), priority))
+
+        user, raw = {}, {}
+        for command, callback, priority in handlers:
+            if _is_noop(callback):
+                continue
+            table = raw if command.isdigit() else user
+            table.setdefault(command, []).append((priority, callback))
+
+        # sorted() is stable: same priority handlers keep the order above
+        self.user_table = dict(
+            (command, _chain([c for p, c in sorted(e, key=itemgetter(0))]))
+            for command, e in user.items())
+        self.raw_table = dict(
+            (command, _chain([c for p, c in sorted(e, key=itemgetter(0))]))
+            for command, e in raw.items())
+        self.user_default = None if _is_noop(bot.on_unknown) else \
+            bot.on_unknown
+        self.raw_default = None if _is_noop(bot.raw_unknown) else \
+            bot.raw_unknown
+
+    def subscribe(self, command, callback, priority=DEFAULT_PRIORITY,
+                  process=False):
+        """Adds a handler for command, see handler().
+        """
+        self.subscribers.append((command, callback, priority, process))
+        self.build()
+
+    def unsubscribe(self, command, callback):
+        """Removes a handler added with subscribe().
+        """
+        self.subscribers = [s for s in self.subscribers
+                            if s[0] != command or s[1] != callback]
+        self.build()
+
+    def _defer(self, callback, key):
+        """Returns callback as is, or a callable running it on the bot
+        workers (see IRCBot.use_workers) with key(*args) as key.
+        """
+        if self.bot.workers is None or _is_noop(callback):
+            return callback
+
+        emit = self.bot._emit
+
+        def call(*args):
+            emit(key(*args), callback, *args)
+        return call
+
+    def _offload(self, func):
+        """Returns a callable running func on the bot process pool with
+        picklable arguments, or right away if there's no pool. The lines it
+        returns are sent.
+        """
+        bot = self.bot
+
+        def call(*args):
+            args = [a.snapshot() if a.__class__ is User else a for a in args]
+            processes = bot.processes
+            if processes is None:
+                bot._send_lines(func(*args))
+            else:
+                processes.submit(func, *args).add_done_callback(
+                    bot._offload_done)
+        return call
+
+    def _sender_key(self, sender, *args):
+        return sender.nick
+
+    def _target_key(self, sender, target, *args):
+        return sender.nick if self.bot._is_me(target) else target
+
+    def _params_key(self, sender, *params):
+        if params and params[0] in self.bot.channels:
+            return params[0]
+        return sender.nick
+
+    def _numeric_key(self, *params):
+        return None
 
     def _parse_privmsg(self, sender, target, message):
         """Not all PRIVMSGs will trigger the on_privmsg event,
@@ -61,20 +294,23 @@ class EventDispatcher(object):
         if message.startswith(chr(1)) and message.endswith(chr(1)):
             message = message[1:-1]
             if message.startswith('ACTION'):
-                self.bot.on_action(sender, target, message.split(' ', 1)[1])
+                if self._on_action is not None:
+                    self._on_action(sender, target, message.split(' ', 1)[1])
             else:
                 if ' ' in message:
                     command, arg = message.split(' ', 1)
                 else:
                     command, arg = message, ''
-                if command in self.ctcpmap:
-                    self.ctcpmap[command](sender, target, arg)
+                if command in self._ctcp:
+                    self._ctcp[command](sender, target, arg)
         else:
-            self.bot.on_privmsg(sender, target, message)  # DISABLE in 0.3.0
-            if target == self.bot.nick:
-                self.bot.on_private_message(sender, message)
-            else:
-                self.bot.on_channel_message(sender, target, message)
+            if self._on_privmsg is not None:
+                self._on_privmsg(sender, target, message)  # DISABLE in 0.3.0
+            if self.bot._is_me(target):
+                if self._on_private_message is not None:
+                    self._on_private_message(sender, message)
+            elif self._on_channel_message is not None:
+                self._on_channel_message(sender, target, message)
 
     def _parse_notice(self, sender, target, message):
         """Not all NOTICEs will trigger the on_notice event,
@@ -86,22 +322,21 @@ class EventDispatcher(object):
                 command, arg = message.split(' ', 1)
             else:
                 command, arg = message, ''
-            if command in self.ctcpreplymap:
-                self.ctcpreplymap[command](sender, target, arg)
-        else:
-            self.bot.on_notice(sender, target, message)
+            if command in self._ctcpreply:
+                self._ctcpreply[command](sender, target, arg)
+        elif self._on_notice is not None:
+            self._on_notice(sender, target, message)
 
     def _parse_mode(self, user, channel, modes, *params):
         """Parse a modes string and call the appropriate event.
         """
-        if channel == self.bot.nick:
+        if self.bot._is_me(channel):
             return  # TODO: We should also keep track of our user modes!
 
-        modes_param = self.bot.protocol['modes_param']
-        modes_setparam = self.bot.protocol['modes_setparam']
-        modes_target = self.bot.protocol['modes_target']
-        prefixes = dict(self.bot.protocol['prefixes'])
+        chanmodes = self.bot.chanmodes
+        prefixes = self.bot.prefixes.by_mode
         params = list(params)
+        adding = True
 
         for m in modes:
             if m == '+':
@@ -109,14 +344,14 @@ class EventDispatcher(object):
             elif m == '-':
                 adding = False
             else:
-                if m in modes_param or m in prefixes or \
-                        (m in modes_setparam and adding):
+                if m in prefixes or m in chanmodes.param or \
+                        (adding and m in chanmodes.setparam):
                     target = params.pop(0)
-                elif m in modes_target:
+                elif m in chanmodes.lists:
                     target = params.pop(0)
-                    n, u, h = \
-                        [target.split('!')[0]] + target.split('!')[1].split('@')
-                    target = User(n, u, h)
+                    if '!' in target and '@' in target:
+                        target = User.from_mask(target)
+                    # else: an extended ban, like $a:account, left as is
                 else:
                     target = None
 
@@ -132,41 +367,110 @@ class EventDispatcher(object):
     def _parsemsg(self, s):
         """Breaks a message from an IRC server into its prefix, command, and
         arguments.
-        From twisted.words.protocols.irc:
-        http://twistedmatrix.com/documents/current/api/twisted.words.protocols.irc.html
         """
-        prefix = ''
-        if s[0] == ':':
-            prefix, s = s[1:].split(' ', 1)
-        if s.find(' :') != -1:
-            s, trailing = s.split(' :', 1)
-            args = s.split()
-            args.append(trailing)
+        prefix, command, rest = parse(s)[:3]
+        return decode(prefix), command, split_params(rest)
+
+    def tags(self):
+        """Returns the IRCv3 tags of the line being dispatched as a dict,
+        decoded the first time they are asked for.
+        """
+        if self._tags is None:
+            self._tags = parse_tags(self.raw_tags) if self.raw_tags else {}
+        return self._tags
+
+    def _dispatch_tagged(self, line):
+        raw_tags = line[3]
+        # Nested batches are started (and ended) with lines tagged with the
+        # outer batch, those are never held back.
+        if b'batch=' in raw_tags and line[1] != 'BATCH':
+            ref = parse_tags(raw_tags).get('batch')
+            batch = self.batches.get(ref)
+            if batch is not None:
+                if len(batch.lines) < MAX_BATCH_LINES:
+                    batch.lines.append(line)
+                    return
+                # Too big, give up waiting for its end
+                logger.warning('Batch %s too long, handling its lines', ref)
+                del self.batches[ref]
+                for held in batch.lines:
+                    self._dispatch_tagged(held)
+
+        self.raw_tags, self._tags = raw_tags, None
+        try:
+            self.dispatch(line[:3])
+        finally:
+            self.raw_tags, self._tags = None, None
+
+    def _parse_batch(self, ref, *params):
+        """BATCH +ref type params... starts a batch, BATCH -ref ends it.
+        """
+        if ref[0] == '+':
+            if params:
+                self.batches[ref[1:]] = Batch(ref[1:], params[0], params[1:])
+            return
+
+        batch = self.batches.pop(ref[1:], None)
+        if batch is None:
+            return
+
+        if batch.type == 'netsplit':
+            quits = []
+            for line in batch.lines:
+                if line[1] == 'QUIT' and BANG in line[0]:
+                    quits.append((self._sender(line[0]),) +
+                                 tuple(split_params(line[2])))
+            self.bot._pre_netsplit(batch.params, quits)
+        elif batch.type == 'netjoin':
+            joins = []
+            for line in batch.lines:
+                if line[1] == 'JOIN' and BANG in line[0]:
+                    joins.append((self._sender(line[0]),) +
+                                 tuple(split_params(line[2])))
+            self.bot._pre_netjoin(batch.params, joins)
         else:
-            args = s.split()
-        command = args.pop(0)
-        return prefix, command, args
+            self.bot.on_batch(batch.type, batch.params, batch.lines)
+
+    def _sender(self, prefix):
+        """Returns the User for the nick!user@host prefix of a line.
+        """
+        nick, h = decode(prefix).split('!', 1)
+        sender = self.bot.users.get(nick)
+        if sender is None:
+            ident, host = h.split('@', 1)
+            sender = User(nick, intern(ident), intern(host))
+        return sender
 
     def dispatch(self, line):
         """This method calls the appropriate event for this line.
+        line can be a tuple returned by parse() or a raw line to parse.
         """
-        prefix, command, args = self._parsemsg(line)
-        if '!' in prefix and '@' in prefix:
-            nick, h = prefix.split('!', 1)
+        if line.__class__ is not tuple:
+            line = parse(line)
 
-            if nick in self.bot.users:
-                sender = self.bot.users[nick]
-            else:
+        if len(line) == 4:
+            return self._dispatch_tagged(line)
+
+        prefix, command, rest = line
+        if BANG in prefix and AT in prefix:
+            callback = self.user_table.get(command, self.user_default)
+            if callback is None:
+                return  # Nobody is interested
+
+            nick, h = decode(prefix).split('!', 1)
+
+            sender = self.bot.users.get(nick)
+            if sender is None:
                 ident, host = h.split('@', 1)
-                sender = User(nick, ident, host)
+                sender = User(nick, intern(ident), intern(host))
 
-            if command in self.usermap:
-                self.usermap[command](sender, *args)
-            else:
-                self.bot.on_unknown(sender, *args)
+            callback(sender, *split_params(rest))
         else:
             # command = raw numeric
-            if command in self.rawsmap:
-                self.rawsmap[command](*args[1:])
-            else:
-                self.bot.raw_unknown(command, *args)
+            callback = self.raw_table.get(command)
+            if callback is not None:
+                callback(*split_params(rest)[1:])
+            elif command == 'BATCH':
+                self._parse_batch(*split_params(rest))
+            elif self.raw_default is not None:
+                self.raw_default(command, *split_params(rest))
@@ -0,0 +1,291 @@
+"""A local IRC server stand-in, to test and benchmark bots without network
+access:
+
+    server = FakeServer()
+    server.add_channel('#chan', synthetic_members(1000))
+    server.start()
+    bot.limiter = FixedDelay(0)
+    bot.connect('127.0.0.1', server.port)
+    bot.join('#chan')
+    server.wait_for('WHO')
+    server.sync()
+    assert len(bot.channels['#chan'].users) == 1001
+
+Server traffic recorded with TrafficRecorder.start_writer can be sent again
+with replay(load_traffic(path)), as fast as possible or with its original
+timing.
+"""
+import socket
+import threading
+import time
+
+from pyrclib.linereceiver import LineBuffer
+from pyrclib.message import decode, parse, split_params
+
+DEFAULT_ISUPPORT = ('PREFIX=(ov)@+ CHANTYPES=# CHANMODES=beI,k,l,imnpst '
+                    'MODES=4 NETWORK=FakeNet CASEMAPPING=rfc1459 WHOX')
+
+
+def synthetic_members(count, start=0, host='users.fake'):
+    """Returns count masks (nick!ident@host) of made up users, every tenth
+    one voiced.
+    """
+    return ['{0}user{1}!ident{1}@{2}'.format('+' if i % 10 == 0 else '', i,
+                                             host)
+            for i in range(start, start + count)]
+
+
+def load_traffic(path):
+    """Reads the lines received from a server in a file written by
+    TrafficRecorder.start_writer, as a list of (timestamp, line).
+    """
+    entries = []
+    with open(path, 'rb') as f:
+        for record in f:
+            when, direction, line = record.rstrip(b'\r\n').split(b' ', 2)
+            if direction == b'<':
+                entries.append((float(when), line))
+    return entries
+
+
+def _split_prefixes(member):
+    """'@+nick!ident@host' -> ('@+', 'nick!ident@host')
+    """
+    mask = member.lstrip('~&@%+')
+    return member[:len(member) - len(mask)], mask
+
+
+class FakeServer(object):
+    """Listens on localhost and handles a single client at a time.
+    Registration (CAP, NICK, USER) gets a 001 and the isupport tokens in a
+    005, JOIN of the channels set with add_channel() their names (353, 366),
+    MODE and WHO (or WHOX) requests get their replies. Every line received is
+    kept in received, once handled.
+    """
+
+    def __init__(self, name='irc.fake', isupport=DEFAULT_ISUPPORT,
+                 caps=('multi-prefix',)):
+        self.name = name
+        self.isupport = isupport
+        self.caps = caps
+        # name -> list of members, as [prefixes]nick!ident@host
+        self.channels = {}
+        self.received = []
+        self.nick = '*'
+        self.enabled_caps = set()
+        # Registration waits for CAP END once the client sent a CAP command
+        self._negotiating = False
+        self._user = False
+        self._registered = False
+
+        self._cond = threading.Condition()
+        self._pongs = 0
+        self._client = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self._thread = None
+
+    def add_channel(self, channel, members=()):
+        self.channels[channel] = list(members)
+
+    def start(self):
+        """Starts accepting clients in a background thread.
+        """
+        self._thread = threading.Thread(target=self._serve,
+                                        name='pyrclib-fakeserver')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._sock.close()
+        client = self._client
+        if client is not None:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+
+    def send(self, *lines):
+        """Sends lines (str or bytes, without CR/LF) to the client.
+        """
+        self._client.sendall(b''.join(
+            (line if isinstance(line, bytes) else line.encode()) + b'\r\n'
+            for line in lines))
+
+    def replay(self, entries, timing=False, speed=1.0):
+        """Sends (timestamp, line) entries, as returned by load_traffic. All
+        at once, or waiting between them as long as when they were recorded
+        (divided by speed) if timing is True.
+        """
+        if not timing:
+            self.send(*[line for when, line in entries])
+            return
+
+        previous = None
+        for when, line in entries:
+            if previous is not None and when > previous:
+                time.sleep((when - previous) / speed)
+            previous = when
+            self.send(line)
+
+    def wait_for(self, command, count=1, timeout=5):
+        """Waits until count lines with command were received and answered.
+        """
+        def received():
+            return sum(1 for line in self.received
+                       if line.split(' ', 1)[0].upper() == command) >= count
+
+        with self._cond:
+            if not self._cond.wait_for(received, timeout):
+                raise AssertionError('{0} not received'.format(command))
+
+    def sync(self, timeout=5):
+        """Sends a PING and waits for the PONG: the client handled every line
+        sent before it.
+        """
+        with self._cond:
+            pongs = self._pongs
+        self.send('PING :{0}'.format(self.name))
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pongs > pongs, timeout):
+                raise AssertionError('No PONG received')
+
+    def _serve(self):
+        while True:
+            try:
+                client, address = self._sock.accept()
+            except OSError:
+                return  # Closed
+            self._client = client
+            self.nick = '*'
+            self.enabled_caps = set()
+            self._negotiating = False
+            self._user = False
+            self._registered = False
+            buffer = LineBuffer()
+            while True:
+                try:
+                    data = client.recv(16384)
+                except OSError:
+                    data = b''
+                if not data:
+                    break
+                for line in buffer.feed(data):
+                    self._handle(line)
+            client.close()
+
+    def _handle(self, line):
+        prefix, command, rest = parse(line)[:3]
+        params = split_params(rest)
+        handler = getattr(self, '_on_' + command, None)
+        if handler is not None:
+            handler(*params)
+
+        with self._cond:
+            self.received.append(decode(line))
+            if command == 'PONG':
+                self._pongs += 1
+            self._cond.notify_all()
+
+    def _numeric(self, numeric, *params):
+        return ':{0} {1} {2} {3}'.format(self.name, numeric, self.nick,
+                                         ' '.join(params))
+
+    def _on_CAP(self, subcommand, *params):
+        subcommand = subcommand.upper()
+        if not self._registered:
+            self._negotiating = subcommand != 'END'
+        if subcommand == 'END':
+            self._welcome()
+        elif subcommand == 'LS':
+            self.send(':{0} CAP * LS :{1}'.format(self.name,
+                                                  ' '.join(self.caps)))
+        elif subcommand == 'REQ':
+            wanted = params[-1].split()
+            if all(cap in self.caps for cap in wanted):
+                self.enabled_caps.update(wanted)
+                self.send(':{0} CAP * ACK :{1}'.format(self.name, params[-1]))
+            else:
+                self.send(':{0} CAP * NAK :{1}'.format(self.name, params[-1]))
+
+    def _on_NICK(self, nick, *params):
+        if self.nick != '*':
+            self.send(':{0}!fake@fake.host NICK {1}'.format(self.nick, nick))
+        self.nick = nick
+
+    def _on_USER(self, *params):
+        self._user = True
+        self._welcome()
+
+    def _welcome(self):
+        if self._registered or self._negotiating or not self._user or \
+                self.nick == '*':
+            return
+        self._registered = True
+        self.send(self._numeric('001', ':Welcome to the fake network'),
+                  self._numeric('005', self.isupport,
+                                ':are supported by this server'))
+
+    def _on_PING(self, token, *params):
+        self.send(':{0} PONG {0} :{1}'.format(self.name, token))
+
+    def _on_JOIN(self, channels, *params):
+        for channel in channels.split(','):
+            members = self.channels.setdefault(channel, [])
+            self.send(':{0}!fake@fake.host JOIN {1}'.format(self.nick,
+                                                            channel))
+            self._names(channel, ['@{0}!fake@fake.host'.format(self.nick)] +
+                        members)
+
+    def _names(self, channel, members):
+        full = 'userhost-in-names' in self.enabled_caps
+        multi = 'multi-prefix' in self.enabled_caps
+        names = []
+        for member in members:
+            prefixes, name = _split_prefixes(member)
+            if not full:
+                name = name.split('!', 1)[0]
+            names.append((prefixes if multi else prefixes[:1]) + name)
+
+        start = self._numeric('353', '=', channel, ':')
+        lines = []
+        line = []
+        length = len(start)
+        for name in names:
+            if line and length + len(name) + 1 > 510:
+                lines.append(start + ' '.join(line))
+                line = []
+                length = len(start)
+            line.append(name)
+            length += len(name) + 1
+        lines.append(start + ' '.join(line))
+        lines.append(self._numeric('366', channel, ':End of /NAMES list.'))
+        self.send(*lines)
+
+    def _on_MODE(self, target, *params):
+        if target in self.channels and not params:
+            self.send(self._numeric('324', target, '+nt'))
+
+    def _on_WHO(self, mask, fields=None, *params):
+        lines = []
+        for channel in mask.split(','):
+            for member in self.channels.get(channel, ()):
+                prefixes, usermask = _split_prefixes(member)
+                nick, sep, userhost = usermask.partition('!')
+                ident, sep, host = userhost.partition('@')
+                status = 'H' + prefixes
+                if fields is None:
+                    lines.append(self._numeric(
+                        '352', channel, ident, host, self.name, nick, status,
+                        ':0 Real Name'))
+                else:
+                    token = fields.partition(',')[2]
+                    lines.append(self._numeric(
+                        '354', token, channel, ident, host, nick, status,
+                        ':Real Name'))
+        lines.append(self._numeric('315', mask, ':End of /WHO list.'))
+        self.send(*lines)
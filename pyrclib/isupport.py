@@ -0,0 +1,193 @@
+"""Parsing of RPL_ISUPPORT (numeric 005), the list of features and limits
+of the IRC server.
+
+Referenced document: http://www.irc.org/tech_docs/005.html
+"""
+import re
+
+PREFIX_RE = re.compile(r'\((\w*)\)(\S*)')
+
+
+def flag(value):
+    return True
+
+
+def integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def string(value):
+    return value
+
+
+def prefix(value):
+    """(ov)@+ -> [('o', '@'), ('v', '+')]
+    """
+    match = PREFIX_RE.match(value)
+    if match is None:
+        return []
+    modes, symbols = match.groups()
+    return list(zip(modes, symbols))
+
+
+def chanmodes(value):
+    """b,k,l,imnpst -> ['b', 'k', 'l', 'imnpst'], always 4 classes.
+    """
+    classes = value.split(',')[:4]
+    return classes + [''] * (4 - len(classes))
+
+
+def targmax(value):
+    """PRIVMSG:4,NOTICE:4,WHO: -> {'PRIVMSG': 4, 'NOTICE': 4, 'WHO': None}
+    None meaning no limit.
+    """
+    limits = {}
+    for item in value.split(','):
+        command, sep, limit = item.partition(':')
+        if command:
+            limits[command.upper()] = integer(limit) if limit else None
+    return limits
+
+
+# Token -> (key in IRCBot.protocol, parser). A tuple of keys means the parser
+# returns one value for each of them.
+TOKENS = {
+    # A list of channel modes a person can get and the respective prefix a
+    # channel or nickname will get in case the person has it.
+    # The order of the modes goes from most powerful to least powerful.
+    # Those prefixes are shown in the output of the WHOIS, WHO and NAMES
+    # command.
+    'PREFIX': ('prefixes', prefix),
+    # The supported channel prefixes.
+    'CHANTYPES': ('chantypes', string),
+    # This is a list of channel modes according to 4 types.
+    #  modes_target
+    #    Mode that adds or removes a nick or address to a list.
+    #    Always has a parameter.
+    #  modes_param
+    #    Mode that changes a setting and always has a parameter.
+    #  modes_setparam
+    #    Mode that changes a setting and only has a parameter when set.
+    #  modes_noparam
+    #    Mode that changes a setting and never has a parameter.
+    'CHANMODES': (('modes_target', 'modes_param', 'modes_setparam',
+                   'modes_noparam'), chanmodes),
+    # Maximum number of channel modes with parameter allowed per MODE
+    # command, None (no value) for no limit.
+    'MODES': ('maxmodes', integer),
+    # Maximum nickname length.
+    'NICKLEN': ('maxnicklength', integer),
+    # The IRC network name.
+    'NETWORK': ('network', string),
+    # The server support ban exceptions (e mode).
+    # See RFC 2811 for more information.
+    'EXCEPTS': ('supports_excepts', flag),
+    # The server support invite exceptions (+I mode).
+    # See RFC 2811 for more information.
+    'INVEX': ('supports_invex', flag),
+    # The server supports messaging channel operators
+    'WALLCHOPS': ('wallchops', flag),
+    # Notice to +#channel goes to all voiced persons.
+    'WALLVOICES': ('wallvoices', flag),
+    # The server supports messaging channel member who have a certain status
+    # or higher. The status is one of the letters from PREFIX.
+    'STATUSMSG': ('statusmsg', string),
+    # Case mapping used for nick- and channel name comparing.
+    'CASEMAPPING': ('casemapping', string),
+    # The server supports extentions for the LIST command.
+    # The tokens specify which extention are supported.
+    'ELIST': ('elist', string),
+    # Maximum topic length.
+    'TOPICLEN': ('topiclen', integer),
+    # Maximum kick comment length.
+    'KICKLEN': ('kicklen', integer),
+    # Maximum channel name length.
+    'CHANNELLEN': ('channellen', integer),
+    # The server support the SILENCE command.
+    # The number is the maximum number of allowed entries in the list.
+    'SILENCE': ('max_silencelist', integer),
+    # Server supports RFC 2812 features.
+    'RFC2812': ('rfc2812', flag),
+    # Server gives extra penalty to some commands instead of the normal
+    # 2 seconds per message and 1 second for every 120 bytes in a message.
+    'PENALTY': ('penalty', flag),
+    # Forced nick changes: The server may change the nickname without the
+    # client sending a NICK message.
+    'FNC': ('fnc', flag),
+    # The LIST is sent in multiple iterations so send queue won't fill and
+    # kill the client connection.
+    'SAFELIST': ('safelist', flag),
+    # The max length of an away message.
+    'AWAYLEN': ('awaylen', integer),
+    # The USERIP command exists.
+    'USERIP': ('userip', flag),
+    # The CPRIVMSG command exists, used for mass messaging people in
+    # specified channel (CPRIVMSG channel nick,nick2,... :text)
+    'CPRIVMSG': ('cprivmsg', flag),
+    # The CNOTICE command exists, just like CPRIVMSG.
+    'CNOTICE': ('cnotice', flag),
+    # Maximum length of nicks the server will send to the client?
+    'MAXNICKLEN': ('maxnicklen', integer),
+    # Maximum targets allowed for PRIVMSG and NOTICE commands, None (no
+    # value) for no limit.
+    'MAXTARGETS': ('maxtargets', integer),
+    # Maximum targets allowed for each command accepting comma-separated
+    # lists, if the command is listed.
+    'TARGMAX': ('targmax', targmax),
+    # The KNOCK command exists.
+    'KNOCK': ('knock', flag),
+    # The WHO command uses WHOX protocol.
+    'WHOX': ('whox', flag),
+    # The server supports server side ignores via the +g user mode.
+    'CALLERID': ('callerid', flag),
+}
+
+
+def parse(params):
+    """Parses the tokens of a 005 reply (without the nick and the trailing
+    "are supported by this server").
+    Returns a list of (token, raw value, key, value) tuples. key and value
+    are None for unknown tokens, raw value is None for negated (-TOKEN)
+    tokens, which the server no longer supports.
+    """
+    parsed = []
+    for param in params:
+        token, sep, raw = param.partition('=')
+        if token[:1] == '-':
+            token = token[1:]
+            raw = None
+
+        entry = TOKENS.get(token)
+        if entry is None:
+            parsed.append((token, raw, None, None))
+        else:
+            key, parser = entry
+            parsed.append((token, raw, key,
+                           parser(raw) if raw is not None else None))
+
+    return parsed
+
+
+class ModeClasses(object):
+    """The channel modes of each CHANMODES class as sets, to look up a mode
+    letter without scanning strings.
+    """
+
+    __slots__ = ('lists', 'param', 'setparam', 'noparam')
+
+    def __init__(self, value='beI,k,l,imnpst'):
+        self.update(chanmodes(value))
+
+    def update(self, classes):
+        self.lists, self.param, self.setparam, self.noparam = \
+            [frozenset(c) for c in classes]
+
+    def takes_param(self, mode, adding):
+        """True if mode has a parameter when set (adding is True) or unset.
+        Prefix modes (o, v...) are not taken into account.
+        """
+        return mode in self.lists or mode in self.param or \
+            (adding and mode in self.setparam)
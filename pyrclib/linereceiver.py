@@ -1,50 +1,116 @@
 import logging
+import socket
+from collections import deque
 
 from pyrclib.linehandler import LineHandler
 
 logger = logging.getLogger(__name__)
 
 
+class LineBuffer(object):
+    """Splits received data into lines, keeping incomplete ones until the
+    rest of the line is received.
+    """
+
+    def __init__(self):
+        self._partial = b''
+
+    def feed(self, data):
+        """Returns the list of complete lines in data, without CR/LF.
+        data can be any bytes-like object.
+        """
+        if self._partial:
+            data = self._partial + data
+        else:
+            data = bytes(data)
+
+        lines = data.splitlines()
+        if data.endswith(b'\n'):
+            self._partial = b''
+        elif lines:
+            self._partial = lines.pop()
+
+        return lines
+
+
 class LineReceiver(LineHandler):
-    def __init__(self, bot, fo):
-        LineHandler.__init__(self, bot, fo)
+    """This thread handles incoming messages.
+    It reads as much data as available from the socket in a single
+    recv_into() call on a reusable buffer of bufsize bytes, and hands every
+    complete line to the bot in one batch.
+    """
 
-    def _read(self):
-        """Read data from socket, stripping CR/LF
+    def __init__(self, bot, sock, bufsize=16384):
+        LineHandler.__init__(self, bot)
+        self._socket = sock
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._linebuffer = LineBuffer()
+        self._lines = deque()
+        self._disconnected = False
+
+    def _recv(self):
+        """Read from socket until at least a complete line is received.
+        Returns the list of lines, or None if the connection was closed.
         """
+        while True:
+            try:
+                n = self._socket.recv_into(self._buf)
+            except OSError:
+                return None
 
-        line = self._fo.readline()
-        if not line:
-            return None
+            if not n:
+                return None
 
-        try:  # Try decoding the string as UTF-8, if it fails, use latin-1
-            line = line.decode()
-        except UnicodeDecodeError:
-            line = line.decode('latin-1')
+            lines = self._linebuffer.feed(self._view[:n])
+            if lines:
+                return lines
 
-        if line[-2:] == self._CRLF:
-            line = line[:-2]
+    def _read(self):
+        """Read a single line of bytes from socket, without CR/LF.
+        Used while registering, lines received after it are kept for run().
+        """
+        if not self._lines:
+            lines = self._recv()
+            if lines is None:
+                return None
+            self._lines.extend(lines)
 
-        return line
+        return self._lines.popleft()
 
     def disconnect(self):
-        if hasattr(self, '_socket'):
-            self._socket.close()
-        self._bot.sender.stop()
+        with self._cond:
+            if self._disconnected:
+                return
+            self._disconnected = True
+
         self._bot.is_connected = False
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Already disconnected
+        self._socket.close()
+        self._bot.sender.stop()
         self._bot.on_disconnect()
         logger.info('Disconnected from %s', self._bot.server)
 
     def run(self):
+        if self._lines:
+            self._handle(list(self._lines))
+            self._lines.clear()
+
         while self._bot.is_connected:
-            line = self._read()
-            if not line:
+            lines = self._recv()
+            if lines is None:
                 # Connection was dropped, disconnect
-                self.disconnect()
+                if self._bot.is_connected:
+                    self.disconnect()
                 break
 
-            try:
-                logger.info('<<< %s', line)
-                self._bot.line_received(line)
-            except Exception as exc:
-                logger.exception('Unhandled exception in line receiver')
+            self._handle(lines)
+
+    def _handle(self, lines):
+        if self._bot.metrics is not None:
+            self._bot.metrics.incr('lines_received', len(lines))
+        self._bot.traffic.received(lines)
+        self._bot.lines_received(lines)
@@ -1,7 +1,8 @@
 import logging
-import time
-from collections import deque
+import threading
+
 from pyrclib.linehandler import LineHandler
+from pyrclib.sendqueue import NORMAL, SendQueue
 
 logger = logging.getLogger(__name__)
 
@@ -10,36 +11,66 @@ class LineSender(LineHandler):
     """This thread handles outgoing messages.
     It will sleep until a new element is added to the queue and then wake up
     to send it.
-    It adds a configurable delay between each line sent, to avoid getting
-    disconnected from the server for excess flood.
+    Lines are sent as fast as the rate limiter (see pyrclib.ratelimit)
+    allows, to avoid getting disconnected from the server for excess flood,
+    highest priority first (see pyrclib.sendqueue).
     """
 
-    def __init__(self, bot, socket, fo, delay):
-        LineHandler.__init__(self, bot, fo)
+    def __init__(self, bot, socket, limiter):
+        LineHandler.__init__(self, bot)
         self._socket = socket
-        self.delay = delay
-        self.queue = deque()
+        self.limiter = limiter
+        self.queue = SendQueue()
         self.alive = True
+        self._write_lock = threading.Lock()
 
     def raw_line(self, line):
-        self._socket.sendall((line + self._CRLF).encode())
-        logger.info('>>> %s', line)
+        """Writes line right away, bypassing the queue.
+        Only used for registration and QUIT, use add() otherwise.
+        """
+        with self._write_lock:
+            self._socket.sendall((line + self._CRLF).encode())
+            self.limiter.sent(line)
+        self._bot.traffic.sent(line)
+        if self._bot.metrics is not None:
+            self._bot.metrics.incr('lines_sent')
 
     def run(self):
         while self.alive:
-            msg = self.pop()
-            if msg:
-                self.raw_line(msg)
-                time.sleep(self.delay / 1000)
-            else:
-                with self._cond:
-                    self._cond.wait()
-
-    def add(self, msg):
+            with self._cond:
+                if not self.queue:
+                    if self.alive:
+                        self._cond.wait()
+                    continue
+
+                wait = self.limiter.delay_for(self.queue.peek())
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                msg = self.queue.pop()
+
+            self.raw_line(msg)
+
+    def add(self, msg, priority=NORMAL):
+        """Queues a line with the given priority.
+        """
+        with self._cond:
+            if self.queue.push(msg, priority):
+                self._cond.notify()
+
+    def add_many(self, msgs, priority=NORMAL):
+        """Queues several lines with the given priority at once.
+        """
         with self._cond:
-            self.queue.append(msg)
+            for msg in msgs:
+                self.queue.push(msg, priority)
             self._cond.notify()
 
+    def set_casemapping(self, casemapping):
+        with self._cond:
+            self.queue.set_casemapping(casemapping)
+
     def is_empty(self):
         if self.queue:
             return False
@@ -47,12 +78,8 @@ class LineSender(LineHandler):
             return True
 
     def pop(self):
-        if self.queue:
-            msg = self.queue.popleft()
-        else:
-            msg = None
-
-        return msg
+        with self._cond:
+            return self.queue.pop()
 
     def stop(self):
         with self._cond:
@@ -0,0 +1,127 @@
+import re
+
+# Byte values, testing "int in bytes" is much faster than "bytes in bytes"
+BANG = ord('!')
+AT = ord('@')
+
+
+def decode(data):
+    """Decodes bytes received from the server as UTF-8, falling back to
+    latin-1 if that fails.
+    """
+    try:
+        return data.decode()
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def parse(line):
+    """Breaks a line from an IRC server into a (prefix, command, rest) tuple.
+    Only the command is decoded, prefix (without the leading ':') and rest
+    are left as bytes: use decode() and split_params() on them when, and
+    only if, they are needed.
+    Lines with IRCv3 tags give a (prefix, command, rest, tags) tuple, tags
+    being the raw bytes without the leading '@', see parse_tags().
+    line can be bytes, bytearray, memoryview or str, without the CR/LF.
+    """
+    if line.__class__ is not bytes:
+        if isinstance(line, str):
+            line = line.encode()
+        else:
+            line = bytes(line)
+
+    if line.startswith(b'@'):
+        tags, sep, line = line.partition(b' ')
+        return parse(line.lstrip(b' ')) + (tags[1:],)
+
+    if line.startswith(b':'):
+        try:
+            prefix, command, rest = line.split(b' ', 2)
+        except ValueError:
+            prefix, sep, command = line.partition(b' ')
+            rest = b''
+        return prefix[1:], command.decode('latin-1'), rest
+
+    command, sep, rest = line.partition(b' ')
+    return b'', command.decode('latin-1'), rest
+
+
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+_TAG_ESCAPE_RE = re.compile(r'\\(.?)')
+
+
+def _unescape_tag(match):
+    c = match.group(1)
+    return _TAG_ESCAPES.get(c, c)
+
+
+def parse_tags(tags):
+    """Decodes the raw tags of a line (see parse) into a dict, valueless
+    tags having an empty string as value.
+    """
+    result = {}
+    for tag in decode(tags).split(';'):
+        key, sep, value = tag.partition('=')
+        if '\\' in value:
+            value = _TAG_ESCAPE_RE.sub(_unescape_tag, value)
+        if key:
+            result[key] = value
+    return result
+
+
+def split_params(rest):
+    """Decodes and splits the parameters part of a parsed line, the trailing
+    parameter included.
+    """
+    try:
+        rest = rest.decode()
+    except UnicodeDecodeError:
+        rest = rest.decode('latin-1')
+
+    if rest[:1] == ':':
+        return [rest[1:]]
+
+    middle, sep, trailing = rest.partition(' :')
+    params = middle.split()
+    if sep:
+        params.append(trailing)
+    return params
+
+
+def is_user(prefix):
+    """True if the prefix of a parsed line is a full nick!user@host mask.
+    """
+    return BANG in prefix and AT in prefix
+
+
+def split_text(text, limit):
+    """Splits text in chunks of at most limit bytes once encoded as UTF-8,
+    never in the middle of a character and preferably between words.
+    limit must be at least 4, the longest UTF-8 character.
+    """
+    if limit < 4:
+        raise ValueError('Cannot split text in chunks of {0} bytes'.format(
+            limit))
+    data = text.encode()
+    if len(data) <= limit:
+        return [text]
+
+    chunks = []
+    while len(data) > limit:
+        cut = data.rfind(b' ', 0, limit + 1)
+        if cut >= limit // 2:
+            chunks.append(data[:cut].decode())
+            data = data[cut + 1:]
+            continue
+
+        # No space in a sensible place, cut at a character boundary:
+        # UTF-8 continuation bytes look like 10xxxxxx.
+        cut = limit
+        while cut > 0 and data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        chunks.append(data[:cut].decode())
+        data = data[cut:]
+
+    if data:
+        chunks.append(data.decode())
+    return chunks
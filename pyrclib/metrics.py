@@ -0,0 +1,53 @@
+import threading
+
+
+class Metrics(object):
+    """Thread safe counters and gauges that can be shared between many
+    connections.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+
+    def incr(self, name, value=1):
+        """Increments the counter name by value.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """Sets the gauge name to value.
+        """
+        self.gauges[name] = value
+
+    def scope(self, prefix):
+        """Returns a view of these metrics for a single connection: counters
+        are updated both with and without the prefix, gauges only with it.
+        """
+        return ScopedMetrics(self, prefix)
+
+    def snapshot(self):
+        """Returns a copy of every counter and gauge.
+        """
+        with self._lock:
+            snapshot = dict(self.counters)
+        snapshot.update(self.gauges)
+        return snapshot
+
+
+class ScopedMetrics(object):
+    """Metrics of a single connection, see Metrics.scope.
+    """
+
+    def __init__(self, metrics, prefix):
+        self._metrics = metrics
+        self.prefix = prefix
+
+    def incr(self, name, value=1):
+        self._metrics.incr(name, value)
+        self._metrics.incr('{0}.{1}'.format(self.prefix, name), value)
+
+    def gauge(self, name, value):
+        self._metrics.gauge('{0}.{1}'.format(self.prefix, name), value)
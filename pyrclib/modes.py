@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class ModeBatcher(object):
+    """Collects channel mode changes and packs them into as few MODE lines
+    as the server allows: at most maxmodes modes with a parameter (MODES
+    in RPL_ISUPPORT, None for no limit) and maxlen bytes per line.
+    Changes are sent in the order they were added. A change to a mode (and
+    parameter) that is already pending replaces it, so the last one wins:
+    +o a, -o a, +o a is sent as +o a.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pending = OrderedDict()
+
+    def add(self, channel, mode, arg=None):
+        """Adds a change like ('+o', 'nick') or ('-m', None) for channel.
+        Returns True if it's the first pending change for this channel.
+        """
+        key = (mode[1], arg)
+        with self._lock:
+            # (mode, arg) -> sign, in the order they were added
+            changes = self.pending.get(channel)
+            if changes is None:
+                self.pending[channel] = OrderedDict([(key, mode[0])])
+                return True
+            changes.pop(key, None)
+            changes[key] = mode[0]
+            return False
+
+    def pop_lines(self, channel, maxmodes=3, maxlen=400):
+        """Removes the pending changes for channel and returns them as a
+        list of MODE lines.
+        """
+        with self._lock:
+            changes = self.pending.pop(channel, {})
+
+        lines = []
+        start = 'MODE {0} '.format(channel)
+        modes, args, sign, nargs = '', [], None, 0
+        for (m, arg), s in changes.items():
+            if modes:
+                length = len(start) + len(modes) + 2 + \
+                    sum(len(a) + 1 for a in args) + \
+                    (len(arg) + 1 if arg is not None else 0)
+                if (arg is not None and maxmodes is not None and
+                        nargs >= maxmodes) or length > maxlen:
+                    lines.append(start + ' '.join([modes] + args))
+                    modes, args, sign, nargs = '', [], None, 0
+
+            if s != sign:
+                modes += s
+                sign = s
+            modes += m
+            if arg is not None:
+                args.append(arg)
+                nargs += 1
+
+        if modes:
+            lines.append(start + ' '.join([modes] + args))
+
+        return lines
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+
+from pyrclib.connection import ConnectException
+from pyrclib.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler(object):
+    """Timers shared by every bot in a BotPool, backed by the event loop.
+    Pending timers are cancelled when the pool shuts down.
+    """
+
+    def __init__(self):
+        self._handles = set()
+
+    def call_later(self, delay, callback, *args):
+        """Calls callback(*args) after delay seconds.
+        """
+        handle = None
+
+        def run():
+            self._handles.discard(handle)
+            callback(*args)
+
+        handle = asyncio.get_event_loop().call_later(delay, run)
+        self._handles.add(handle)
+        return handle
+
+    def call_every(self, interval, callback, *args):
+        """Calls callback(*args) every interval seconds until the returned
+        object is cancelled.
+        """
+        return _PeriodicCall(self, interval, callback, args)
+
+    def cancel_all(self):
+        for handle in list(self._handles):
+            handle.cancel()
+        self._handles.clear()
+
+
+class _PeriodicCall(object):
+
+    def __init__(self, scheduler, interval, callback, args):
+        self._scheduler = scheduler
+        self._interval = interval
+        self._callback = callback
+        self._args = args
+        self._handle = scheduler.call_later(interval, self._run)
+
+    def _run(self):
+        self._handle = self._scheduler.call_later(self._interval, self._run)
+        self._callback(*self._args)
+
+    def cancel(self):
+        self._handle.cancel()
+
+
+class _Network(object):
+    """A bot in a pool and the server it must stay connected to.
+    """
+
+    def __init__(self, name, bot, address, port, password, useSSL, channels):
+        self.name = name
+        self.bot = bot
+        self.address = address
+        self.port = port
+        self.password = password
+        self.useSSL = useSSL
+        self.channels = list(channels)
+        self.task = None
+
+
+class BotPool(object):
+    """Starts, supervises and shuts down many AsyncIRCBot connections, to the
+    same or different networks, from a single event loop.
+    Every bot gets the pool scheduler and a scoped view of the pool metrics:
+
+        pool = BotPool()
+        pool.add('rizon', MyBot('nick', 'user', 'realname'),
+                 'irc.rizon.net', channels=['#mychannel'])
+        pool.add('libera', MyBot('nick', 'user', 'realname'),
+                 'irc.libera.chat', 6697, useSSL=True)
+        pool.run()
+
+    Dropped connections are reconnected with an exponential backoff, between
+    reconnect_delay and max_reconnect_delay seconds, and rejoin their
+    channels.
+    A bot being stopped gets up to stop_timeout seconds to send its QUIT and
+    close its connection before its coroutines are cancelled.
+    """
+
+    def __init__(self, reconnect_delay=5, max_reconnect_delay=300,
+                 stop_timeout=5):
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.stop_timeout = stop_timeout
+        self.metrics = Metrics()
+        self.scheduler = Scheduler()
+        self.networks = {}
+        self.running = False
+
+    def add(self, name, bot, address, port=6667, password=None,
+            useSSL=False, channels=()):
+        """Adds a bot to the pool, it is connected right away if the pool is
+        already running.
+        """
+        if name in self.networks:
+            raise KeyError('Network {0} already in the pool'.format(name))
+
+        bot.scheduler = self.scheduler
+        bot.metrics = self.metrics.scope(name)
+        network = _Network(name, bot, address, port, password, useSSL,
+                           channels)
+        self.networks[name] = network
+        if self.running:
+            network.task = asyncio.ensure_future(self._supervise(network))
+
+        return bot
+
+    async def remove(self, name, quitmsg=None):
+        """Disconnects a bot and removes it from the pool.
+        """
+        network = self.networks.pop(name)
+        await self._stop(network, quitmsg)
+
+    async def start(self):
+        """Connects every bot in the pool, returns immediately.
+        """
+        self.running = True
+        for network in self.networks.values():
+            if network.task is None:
+                network.task = asyncio.ensure_future(self._supervise(network))
+
+    async def shutdown(self, quitmsg=None):
+        """Disconnects every bot and waits until they are done.
+        """
+        self.running = False
+        self.scheduler.cancel_all()
+        await asyncio.gather(*[self._stop(network, quitmsg)
+                               for network in self.networks.values()])
+
+    async def serve(self):
+        """Starts the pool and waits until it is shut down.
+        """
+        await self.start()
+        while self.running:
+            tasks = [n.task for n in self.networks.values()
+                     if n.task is not None and not n.task.done()]
+            if not tasks:
+                break
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+    def run(self):
+        """Runs the pool on a new event loop until it is shut down or
+        interrupted.
+        """
+        async def main():
+            try:
+                await self.serve()
+            finally:
+                await self.shutdown()
+
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
+
+    async def _stop(self, network, quitmsg):
+        if network.bot.is_connected:
+            network.bot.disconnect(quitmsg)
+            await network.bot.wait_closed(self.stop_timeout)
+        if network.task is not None:
+            network.task.cancel()
+            try:
+                await network.task
+            except asyncio.CancelledError:
+                pass
+            network.task = None
+
+    async def _supervise(self, network):
+        """Keeps a bot connected until the pool is shut down.
+        """
+        bot = network.bot
+        delay = self.reconnect_delay
+        while self.running:
+            rejoin = set(network.channels) | set(bot.channels)
+            bot._reset_state()
+            try:
+                await bot.connect(network.address, network.port,
+                                  network.password, network.useSSL)
+            except (OSError, ConnectException) as exc:
+                logger.warning('Could not connect %s to %s: %s',
+                               network.name, network.address, exc)
+                self.metrics.incr('connect_failures')
+            except Exception:
+                logger.exception('Error connecting %s to %s', network.name,
+                                 network.address)
+                self.metrics.incr('connect_failures')
+                _abort(bot)
+            else:
+                self.metrics.incr('connects')
+                delay = self.reconnect_delay
+                try:
+                    for channel in rejoin:
+                        bot.join(channel)
+                    await bot.wait_closed()
+                except Exception:
+                    # Most likely raised by an event of the bot, reconnect
+                    # anyway
+                    logger.exception('Error in %s', network.name)
+                    _abort(bot)
+                self.metrics.incr('disconnects')
+
+            if not self.running:
+                break
+
+            logger.info('Reconnecting %s in %s seconds', network.name, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+
+def _abort(bot):
+    """Drops the connection of a bot whose coroutines may have failed.
+    """
+    for task in bot._tasks:
+        task.cancel()
+    bot.is_connected = False
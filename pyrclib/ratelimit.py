@@ -0,0 +1,65 @@
+import time
+
+
+class FixedDelay(object):
+    """Rate limiter waiting the same delay (in milliseconds) between two
+    lines, whatever their length.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._last = None
+
+    def delay_for(self, line, now=None):
+        """Returns how many seconds to wait before line can be sent.
+        """
+        if self._last is None:
+            return 0
+        if now is None:
+            now = time.monotonic()
+        return max(0, self._last + self.delay / 1000 - now)
+
+    def sent(self, line, now=None):
+        """Charges the limiter for a line that was just sent.
+        """
+        self._last = time.monotonic() if now is None else now
+
+
+class PenaltyLimiter(object):
+    """Rate limiter modelled on the flood control of the ircd: every line
+    moves a penalty clock forward by base seconds plus one second every
+    bytes_per_second bytes, and the server stops reading (and eventually
+    kills the client for Excess Flood) when that clock runs more than window
+    seconds ahead of the current time.
+
+    Lines are sent as soon as they fit in the window, so an idle bot can
+    send a burst of several lines right away and is throttled to the
+    sustainable rate only after that.
+    """
+
+    def __init__(self, window=10, base=2, bytes_per_second=120):
+        self.window = window
+        self.base = base
+        self.bytes_per_second = bytes_per_second
+        self._clock = 0
+
+    def penalty(self, line):
+        """Returns the penalty, in seconds, the server gives to line.
+        """
+        # +2 for the CR/LF
+        return self.base + (len(line.encode()) + 2) / self.bytes_per_second
+
+    def delay_for(self, line, now=None):
+        """Returns how many seconds to wait before line can be sent.
+        """
+        if now is None:
+            now = time.monotonic()
+        clock = max(self._clock, now) + self.penalty(line)
+        return max(0, clock - now - self.window)
+
+    def sent(self, line, now=None):
+        """Charges the limiter for a line that was just sent.
+        """
+        if now is None:
+            now = time.monotonic()
+        self._clock = max(self._clock, now) + self.penalty(line)
@@ -0,0 +1,245 @@
+import logging
+from collections import OrderedDict, deque
+
+from pyrclib.casemap import CASEMAPPINGS, DEFAULT_CASEMAPPING
+
+logger = logging.getLogger(__name__)
+
+# Priorities of the outgoing lanes, lower is sent first.
+URGENT = 0   # PONG and QUIT, never wait behind anything else
+CONTROL = 1  # JOIN, PART, MODE, KICK, WHO... channel management
+NORMAL = 2   # PRIVMSG and NOTICE
+BULK = 3     # Background requests (WHO...), sent when nothing else is queued
+
+# What to do with a line pushed into a full lane.
+DROP_NEWEST = 'drop-newest'  # discard the new line
+DROP_OLDEST = 'drop-oldest'  # discard the oldest queued line
+# Discard a line identical to the last one queued, then behave as
+# DROP_NEWEST. Only the last line is compared: JOIN #a, PART #a, JOIN #a
+# must all be sent.
+MERGE = 'merge'
+
+
+class Lane(object):
+    """A FIFO of outgoing lines with a maximum depth (None for unbounded)
+    and a policy for lines that don't fit.
+    """
+
+    def __init__(self, maxlen=None, policy=DROP_NEWEST):
+        self.maxlen = maxlen
+        self.policy = policy
+        self.queue = deque()
+        self.dropped = 0
+
+    def push(self, line):
+        """Appends line, returns False if it was dropped or merged.
+        """
+        queue = self.queue
+        if self.policy == MERGE and queue and queue[-1] == line:
+            return False
+
+        if self.maxlen is not None and len(self.queue) >= self.maxlen:
+            self.dropped += 1
+            if self.policy == DROP_OLDEST:
+                self.queue.popleft()
+            else:
+                logger.warning('Send queue full, dropping: %s', line)
+                return False
+
+        self.queue.append(line)
+        return True
+
+    def peek(self):
+        return self.queue[0]
+
+    def pop(self):
+        return self.queue.popleft()
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class FairLane(object):
+    """A lane that keeps a FIFO per message target (the first parameter of
+    the line, like the channel or nick of a PRIVMSG) and serves them with
+    deficit round robin: every target gets to send up to quantum bytes per
+    round, so a big backlog to one channel doesn't delay the others.
+    Targets are compared according to the server casemapping, and lines cost
+    their encoded length, like for the rate limiter.
+    """
+
+    def __init__(self, maxlen=None, policy=DROP_NEWEST, quantum=512,
+                 casemapping=DEFAULT_CASEMAPPING):
+        self.maxlen = maxlen
+        self.policy = policy
+        self.quantum = quantum
+        self._table = CASEMAPPINGS.get(casemapping,
+                                       CASEMAPPINGS[DEFAULT_CASEMAPPING])
+        self.queues = OrderedDict()
+        self.dropped = 0
+        self._deficits = {}
+        self._credited = False
+        self._len = 0
+
+    def target(self, line):
+        """Returns the target a line is queued under.
+        """
+        parts = line.split(' ', 2)
+        if len(parts) < 2:
+            return ''
+        return parts[1].encode().translate(self._table).decode()
+
+    def set_casemapping(self, casemapping):
+        """Changes the casemapping, merging the queues of targets that are
+        now the same.
+        """
+        table = CASEMAPPINGS.get(casemapping,
+                                 CASEMAPPINGS[DEFAULT_CASEMAPPING])
+        if table is self._table:
+            return
+
+        self._table = table
+        queues, deficits = self.queues, self._deficits
+        self.queues = OrderedDict()
+        self._deficits = {}
+        self._credited = False
+        for target, queue in queues.items():
+            key = target.encode().translate(table).decode()
+            if key in self.queues:
+                self.queues[key].extend(queue)
+            else:
+                self.queues[key] = queue
+                self._deficits[key] = deficits[target]
+
+    def push(self, line):
+        """Appends line to the queue of its target, returns False if it was
+        dropped or merged.
+        """
+        target = self.target(line)
+        queue = self.queues.get(target)
+        if self.policy == MERGE and queue and queue[-1] == line:
+            return False
+
+        if self.maxlen is not None and self._len >= self.maxlen:
+            self.dropped += 1
+            if self.policy != DROP_OLDEST:
+                logger.warning('Send queue full, dropping: %s', line)
+                return False
+            # Make room at the expense of the longest backlog
+            longest = max(self.queues, key=lambda t: len(self.queues[t]))
+            self.queues[longest].popleft()
+            self._len -= 1
+            if not self.queues[longest]:
+                self._remove(longest)
+            queue = self.queues.get(target)
+
+        if queue is None:
+            queue = self.queues[target] = deque()
+            self._deficits[target] = 0
+        queue.append(line)
+        self._len += 1
+        return True
+
+    def _remove(self, target):
+        if next(iter(self.queues)) == target:
+            self._credited = False
+        del self.queues[target]
+        del self._deficits[target]
+
+    def _select(self):
+        """Returns the target whose turn it is to send.
+        """
+        while True:
+            target = next(iter(self.queues))
+            if self._deficits[target] >= \
+                    len(self.queues[target][0].encode()):
+                return target
+
+            if not self._credited:
+                self._deficits[target] += self.quantum
+                self._credited = True
+            else:
+                # Out of credit for this round, wait for the next one
+                self.queues.move_to_end(target)
+                self._credited = False
+
+    def peek(self):
+        return self.queues[self._select()][0]
+
+    def pop(self):
+        target = self._select()
+        queue = self.queues[target]
+        line = queue.popleft()
+        self._len -= 1
+        if queue:
+            self._deficits[target] -= len(line.encode())
+        else:
+            self._remove(target)
+        return line
+
+    def depths(self):
+        """Returns the number of queued lines for each target.
+        """
+        return dict((t, len(q)) for t, q in self.queues.items())
+
+    def __len__(self):
+        return self._len
+
+
+class SendQueue(object):
+    """Outgoing lines split in priority lanes: a line is sent only when
+    every lane with a higher priority is empty, so keepalives and channel
+    management never wait behind a backlog of messages. Messages are shared
+    fairly between their targets, see FairLane.
+    Not thread safe, senders guard it with their own lock.
+    """
+
+    def __init__(self):
+        self.lanes = [
+            Lane(64, MERGE),         # URGENT
+            Lane(512, MERGE),        # CONTROL
+            FairLane(4096, DROP_NEWEST),  # NORMAL
+            Lane(1024, MERGE),       # BULK
+        ]
+
+    def set_casemapping(self, casemapping):
+        """Compare message targets according to casemapping, see FairLane.
+        """
+        self.lanes[NORMAL].set_casemapping(casemapping)
+
+    def push(self, line, priority=NORMAL):
+        """Queues line in the lane of the given priority, returns False if
+        the lane dropped it.
+        """
+        return self.lanes[priority].push(line)
+
+    def _first(self):
+        for lane in self.lanes:
+            if lane:
+                return lane
+        return None
+
+    def peek(self):
+        """Returns the next line to send, without removing it, or None.
+        """
+        lane = self._first()
+        return lane.peek() if lane is not None else None
+
+    def pop(self):
+        """Removes and returns the next line to send, or None.
+        """
+        lane = self._first()
+        return lane.pop() if lane is not None else None
+
+    def depths(self):
+        """Returns the number of queued lines in each lane.
+        """
+        return [len(lane) for lane in self.lanes]
+
+    def target_depths(self):
+        """Returns the number of queued messages for each target.
+        """
+        return self.lanes[NORMAL].depths()
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
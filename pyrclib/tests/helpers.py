@@ -0,0 +1,18 @@
+class FakeSender(object):
+    """Stands in for the LineSender of a bot, keeping the lines queued.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, line, priority=None):
+        self.lines.append(line)
+
+    def add_many(self, lines, priority=None):
+        self.lines.extend(lines)
+
+    def raw_line(self, line):
+        self.lines.append(line)
+
+    def set_casemapping(self, casemapping):
+        pass
@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+
+from pyrclib.asyncbot import AsyncIRCBot
+
+
+class AsyncBotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.received = []
+
+    async def _handle_client(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode().rstrip('\r\n')
+            self.received.append(line)
+            if line.startswith('USER'):
+                writer.write(b':srv 001 pybot :Welcome\r\n'
+                             b':srv 005 pybot PREFIX=(ov)@+ CHANTYPES=# '
+                             b'CHANMODES=b,k,l,imnpst :are supported\r\n')
+            elif line.startswith('JOIN'):
+                writer.write(b':pybot!bot@host JOIN #test\r\n'
+                             b':srv 353 pybot = #test :pybot @martin +foo\r\n'
+                             b':srv 366 pybot #test :End of /NAMES list.\r\n')
+            elif line.startswith('QUIT'):
+                break
+        writer.close()
+
+    async def _run_bot(self):
+        server = await asyncio.start_server(self._handle_client,
+                                            '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        bot = AsyncIRCBot('pybot', 'bot', 'Test Bot')
+        await bot.connect('127.0.0.1', port)
+        self.assertTrue(bot.is_connected)
+        bot.join('#test')
+        for i in range(100):
+            if 'martin' in bot.users:
+                break
+            await asyncio.sleep(0.01)
+        bot.disconnect('bye')
+        await bot.wait_closed()
+        server.close()
+        await server.wait_closed()
+        return bot
+
+    def test_connect_and_track_state(self):
+        bot = asyncio.run(self._run_bot())
+        self.assertFalse(bot.is_connected)
+        self.assertIn('NICK pybot', self.received)
+        self.assertIn('QUIT :bye', self.received)
+        self.assertEqual(bot.channels['#test'].prefix('martin'), '@')
+        self.assertEqual(bot.channels['#test'].prefix('foo'), '+')
@@ -0,0 +1,446 @@
+import unittest
+from unittest import mock
+
+from pyrclib.bot import IRCBot
+from pyrclib.ratelimit import FixedDelay, PenaltyLimiter
+from pyrclib.tests.helpers import FakeSender
+from pyrclib.who import WhoSync
+
+
+class BotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = IRCBot('pybot', 'bot', 'Test Bot')
+        self.bot.sender = FakeSender()
+        self.bot.line_received(
+            ':srv 005 pybot PREFIX=(ov)@+ CHANTYPES=# CHANMODES=b,k,l,imnpst '
+            'MODES=4 :are supported')
+        self.bot.line_received(':pybot!bot@my.host JOIN #chan')
+        self.bot.line_received(':srv 353 pybot = #chan :@pybot @martin foo')
+        self.bot.sender.lines = []
+
+    def test_limiter(self):
+        self.assertIsInstance(self.bot._make_limiter(), PenaltyLimiter)
+        self.bot.delay = 500
+        limiter = self.bot._make_limiter()
+        self.assertIsInstance(limiter, FixedDelay)
+        self.assertEqual(limiter.delay, 500)
+        self.bot.limiter = PenaltyLimiter()
+        self.assertIs(self.bot._make_limiter(), self.bot.limiter)
+
+    def test_broadcast_groups_targets(self):
+        self.bot.line_received(':srv 005 pybot MAXTARGETS=3 :are supported')
+        self.bot.broadcast(['#a', '#b', 'nick1', 'nick2', '#c'], 'news')
+        self.assertEqual(self.bot.sender.lines,
+                         ['PRIVMSG #a,#b,nick1 :news',
+                          'PRIVMSG nick2,#c :news'])
+
+    def test_broadcast_targmax(self):
+        self.bot.line_received(':srv 005 pybot TARGMAX=PRIVMSG:2,NOTICE: '
+                               ':are supported')
+        self.bot.broadcast(['#a', '#b', 'nick1'], 'news')
+        self.bot.broadcast(['#a', '#b', 'nick1'], 'news', notice=True)
+        self.assertEqual(self.bot.sender.lines,
+                         ['PRIVMSG #a,#b :news', 'PRIVMSG nick1 :news',
+                          'NOTICE #a,#b,nick1 :news'])
+
+    def test_broadcast_no_maxtargets(self):
+        self.bot.line_received(':srv 005 pybot MAXTARGETS :are supported')
+        self.bot.broadcast(['#a', '#b', 'nick1'], 'news')
+        self.assertEqual(self.bot.sender.lines, ['PRIVMSG #a,#b,nick1 :news'])
+
+    def test_flush_modes_no_maxmodes(self):
+        self.bot.line_received(':srv 005 pybot MODES :are supported')
+        for nick in ('martin', 'foo'):
+            self.bot.mode_batcher.add('#chan', '+o', nick)
+        self.bot.flush_modes('#chan')
+        self.assertEqual(self.bot.sender.lines, ['MODE #chan +oo martin foo'])
+
+    def test_broadcast_uses_cprivmsg(self):
+        self.bot.line_received(
+            ':srv 005 pybot MAXTARGETS=4 CNOTICE :are supported')
+        self.bot.broadcast(['#a', 'martin', 'stranger'], 'news', notice=True)
+        self.assertEqual(self.bot.sender.lines,
+                         ['NOTICE #a,martin,stranger :news'])
+        self.bot.sender.lines = []
+        self.bot.broadcast(['#a', 'martin', 'stranger'], 'news', notice=True,
+                           cmsg=True)
+        self.assertEqual(self.bot.sender.lines,
+                         ['CNOTICE martin #chan :news',
+                          'NOTICE #a,stranger :news'])
+
+    def test_broadcast_long_message(self):
+        self.bot.line_received(':srv 005 pybot MAXTARGETS=20 :are supported')
+        targets = ['#ch\u00e0nnel{0}'.format(i) for i in range(20)]
+        words = ' '.join('w\u00f6rd{0}'.format(i) for i in range(100))
+        self.bot.broadcast(targets, words)
+        prefix = len(':pybot!bot@my.host ')
+        lines = self.bot.sender.lines
+        sent = {}
+        for line in lines:
+            self.assertLessEqual(prefix + len(line.encode()), 510)
+            head, text = line.split(' :', 1)
+            for target in head.split(' ')[1].split(','):
+                sent.setdefault(target, []).append(text)
+        self.assertEqual(sorted(sent), sorted(targets))
+        for texts in sent.values():
+            self.assertEqual(' '.join(texts), words)
+        self.assertLess(len(lines), 20)
+
+    def test_privmsg_splits_long_messages(self):
+        words = ' '.join('word{0}'.format(i) for i in range(200))
+        self.bot.privmsg('#chan', words)
+        lines = self.bot.sender.lines
+        self.assertEqual(len(lines), 4)
+        prefix = len(':pybot!bot@my.host ')
+        for line in lines:
+            self.assertTrue(line.startswith('PRIVMSG #chan :word'))
+            self.assertLessEqual(prefix + len(line.encode()), 510)
+        self.assertEqual(' '.join(l.split(':', 1)[1] for l in lines), words)
+
+    def test_action_split_keeps_ctcp_framing(self):
+        words = ' '.join('word{0}'.format(i) for i in range(200))
+        self.bot.privmsg('#chan', '\x01ACTION ' + words + '\x01')
+        lines = self.bot.sender.lines
+        self.assertGreater(len(lines), 1)
+        prefix = len(':pybot!bot@my.host ')
+        for line in lines:
+            self.assertTrue(line.startswith('PRIVMSG #chan :\x01ACTION word'))
+            self.assertTrue(line.endswith('\x01'))
+            self.assertLessEqual(prefix + len(line.encode()), 510)
+        self.assertEqual(' '.join(l.split(' ', 3)[3][:-1] for l in lines),
+                         words)
+
+    def test_membership_index(self):
+        self.bot.line_received(':pybot!bot@my.host JOIN #other')
+        self.bot.line_received(':srv 353 pybot = #other :@pybot martin')
+        self.assertEqual(set(self.bot.user_channels['martin']),
+                         {'#chan', '#other'})
+
+        self.bot.line_received(':martin!m@host NICK marty')
+        self.assertNotIn('martin', self.bot.user_channels)
+        self.assertEqual(
+            sorted(c.name for c in self.bot.get_comchans('marty')),
+            ['#chan', '#other'])
+        self.assertIn('marty', self.bot.channels['#chan'].users)
+
+        self.bot.line_received(':marty!m@host PART #other')
+        self.assertEqual(self.bot.user_channels['marty'], ('#chan',))
+        self.bot.line_received(':pybot!bot@my.host KICK #chan foo :bye')
+        self.assertNotIn('foo', self.bot.users)
+        self.bot.line_received(':marty!m@host QUIT :gone')
+        self.assertNotIn('marty', self.bot.users)
+        self.assertNotIn('marty', self.bot.user_channels)
+
+    def test_membership_index_many_channels(self):
+        for i in range(20):
+            self.bot.line_received(':pybot!bot@my.host JOIN #c{0}'.format(i))
+        self.assertEqual(len(self.bot.user_channels['pybot']), 21)
+        for i in range(20):
+            self.bot.line_received(':pybot!bot@my.host PART #c{0}'.format(i))
+        self.assertEqual(self.bot.user_channels['pybot'], ('#chan',))
+
+    def test_user_leaving_many_channels(self):
+        for i in range(10):
+            self.bot.line_received(':pybot!bot@my.host JOIN #c{0}'.format(i))
+            self.bot.line_received(':bar!b@host JOIN #c{0}'.format(i))
+        self.assertEqual(len(self.bot.get_comchans('bar')), 10)
+        for i in range(10):
+            self.bot.line_received(':bar!b@host PART #c{0}'.format(i))
+        self.assertNotIn('bar', self.bot.users)
+        self.assertNotIn('bar', self.bot.user_channels)
+
+    def test_names_keeps_known_users(self):
+        self.bot.line_received(':srv 352 pybot #chan ~m host.net srv martin '
+                               'H :0 Martin')
+        user = self.bot.users['martin']
+        self.bot.line_received(':srv 353 pybot = #chan :@pybot @martin foo')
+        self.assertIs(self.bot.users['martin'], user)
+        self.assertEqual((user.ident, user.host, user.realname),
+                         ('~m', 'host.net', 'Martin'))
+
+    def test_who_reply_for_unknown_nick(self):
+        self.bot.line_received(':srv 352 pybot #chan ~s host.net srv stranger '
+                               'H :0 Stranger')
+        self.assertNotIn('stranger', self.bot.users)
+
+    def test_leaving_channel_forgets_users(self):
+        self.bot.line_received(':martin!m@host KICK #chan pybot :out')
+        self.assertNotIn('#chan', self.bot.channels)
+        self.assertNotIn('martin', self.bot.users)
+        self.assertNotIn('foo', self.bot.users)
+        self.assertIn('pybot', self.bot.users)
+
+    def test_casemapping(self):
+        self.assertIn('#CHAN', self.bot.channels)
+        self.assertIn('MARTIN', self.bot.channels['#Chan'])
+        self.bot.line_received(':Martin!m@host PART #Chan')
+        self.assertNotIn('martin', self.bot.users)
+
+        self.bot.line_received(':Nick[a]!n@host JOIN #chan')
+        self.assertIn('nick{a}', self.bot.users)
+        self.assertEqual(list(self.bot.channels['#chan'].users)[-1], 'Nick[a]')
+
+    def test_casemapping_change_rekeys_bans(self):
+        chan = self.bot.channels['#chan']
+        self.bot.line_received(':martin!m@host MODE #chan +b bad[x]!*@*')
+        self.assertTrue(chan.is_banned('BAD{X}!u@host'))
+        self.bot.line_received(':srv 005 pybot CASEMAPPING=ascii :are '
+                               'supported')
+        self.assertFalse(chan.is_banned('BAD{X}!u@host'))
+        self.assertTrue(chan.is_banned('BAD[X]!u@host'))
+        self.assertIn('Bad[x]!*@*', chan.modes.masks('b'))
+        self.assertNotIn('bad{x}!*@*', chan.modes.masks('b'))
+
+    def test_prefix_status(self):
+        chan = self.bot.channels['#chan']
+        self.assertTrue(chan.is_op('martin'))
+        self.assertFalse(chan.is_voiced('foo'))
+        self.bot.line_received(':martin!m@host MODE #chan +vv-o foo martin '
+                               'martin')
+        self.assertTrue(chan.is_voiced('foo'))
+        self.assertFalse(chan.is_op('martin'))
+        self.assertEqual(chan.prefix('martin'), '+')
+        self.assertEqual(str(chan.modes), '')
+
+    def test_multiple_prefixes(self):
+        self.bot.line_received(':srv 005 pybot PREFIX=(qaohv)~&@%+ :are '
+                               'supported')
+        self.bot.line_received(':srv 353 pybot = #chan :~@admin %half')
+        chan = self.bot.channels['#chan']
+        self.assertEqual(chan.prefix('admin'), '~')
+        self.assertEqual(self.bot.prefixes.to_symbols(chan.status('admin')),
+                         '~@')
+        self.assertTrue(chan.is_op('admin'))
+        self.assertFalse(chan.is_op('half'))
+        self.assertTrue(chan.has_prefix('half', 'h'))
+
+    def test_prefix_change_keeps_status(self):
+        self.bot.line_received(':martin!m@host MODE #chan +v foo')
+        self.bot.line_received(':srv 005 pybot PREFIX=(qaohv)~&@%+ :are '
+                               'supported')
+        chan = self.bot.channels['#chan']
+        self.assertTrue(chan.is_op('martin'))
+        self.assertEqual(chan.prefix('martin'), '@')
+        self.assertEqual(chan.prefix('foo'), '+')
+        self.assertFalse(chan.has_prefix('foo', 'h'))
+        self.bot.line_received(':srv 005 pybot PREFIX=(ov)@+ :are supported')
+        self.assertEqual(chan.prefix('martin'), '@')
+        self.assertTrue(chan.is_voiced('foo'))
+
+    def test_channel_modes(self):
+        self.bot.line_received(':srv 324 pybot #chan +ntkl secret 20')
+        chan = self.bot.channels['#chan']
+        self.assertEqual(str(chan.modes), 'klnt')
+        self.assertEqual(chan.key, 'secret')
+        self.assertEqual(chan.limit, 20)
+
+        self.bot.line_received(':martin!m@host MODE #chan -k+b secret '
+                               '*!*@*.Bad.org')
+        self.assertIsNone(chan.key)
+        self.assertIn('*!*@*.bad.org', chan.modes.masks('b'))
+        self.assertTrue(chan.is_banned('Evil!x@host.bad.org'))
+        self.assertFalse(chan.is_banned('good!x@good.org'))
+
+        self.bot.line_received(':srv 348 pybot #chan *!x@* martin 1400000000')
+        self.assertFalse(chan.is_banned('Evil!x@host.bad.org'))
+        self.assertEqual(self.bot.banned_in('evil!y@host.bad.org'), ['#chan'])
+
+        self.bot.line_received(':martin!m@host MODE #chan -b *!*@*.bad.org')
+        self.assertEqual(self.bot.banned_in('evil!y@host.bad.org'), [])
+
+    def test_isupport(self):
+        self.bot.line_received(':srv 005 pybot NETWORK=Test WHOX FOO=bar '
+                               ':are supported')
+        self.assertEqual(self.bot.network, 'Test')
+        self.assertTrue(self.bot.protocol['whox'])
+        self.assertEqual(self.bot.isupport['FOO'], 'bar')
+        self.assertEqual(self.bot.protocol['maxmodes'], 4)
+
+        self.bot.line_received(':srv 005 pybot -WHOX -FOO :are supported')
+        self.assertNotIn('whox', self.bot.protocol)
+        self.assertNotIn('FOO', self.bot.isupport)
+
+    def test_whox_sync(self):
+        self.bot.line_received(':srv 005 pybot WHOX TARGMAX=WHO:4 :are '
+                               'supported')
+        self.bot.who.clear()
+        self.bot.request_who('#a')
+        self.bot.request_who('#b')
+        self.assertEqual(self.bot.sender.lines, ['WHO #a %tcuhnfr,152',
+                                                 'WHO #b %tcuhnfr,152'])
+        self.bot.line_received(':srv 354 pybot 152 #chan ~m some.host martin '
+                               'H@ :Martin S')
+        martin = self.bot.users['martin']
+        self.assertEqual((martin.ident, martin.host, martin.realname),
+                         ('~m', 'some.host', 'Martin S'))
+
+    def test_who_timeout(self):
+        timers = []
+
+        class Scheduler(object):
+            def call_later(self, delay, callback, *args):
+                timers.append((delay, callback))
+                return self
+
+            def cancel(self):
+                pass
+
+        self.bot._reset_state()  # Cancels the timer of the WHO #chan
+        self.bot.scheduler = Scheduler()
+        self.bot.who = WhoSync(window=1, timeout=60)
+        self.bot.request_who('#a')
+        self.bot.request_who('#b')
+        self.assertEqual(self.bot.sender.lines, ['WHO #a'])
+        self.assertEqual(timers[0][0], 60)
+        # No reply
+        self.bot.who.timeout = 0
+        delay, callback = timers.pop()
+        callback()
+        self.assertEqual(self.bot.sender.lines, ['WHO #a', 'WHO #b'])
+        self.assertEqual(len(timers), 1)
+
+    def test_who_reply(self):
+        self.bot.line_received(':srv 352 pybot #chan ~f host srv foo H '
+                               ':0 Foo Bar')
+        self.assertEqual(self.bot.users['foo'].realname, 'Foo Bar')
+        self.bot.line_received(':srv 352 pybot #chan ~f host srv foo H :0')
+        self.assertEqual(self.bot.users['foo'].realname, '')
+
+    def test_lazy_user_info(self):
+        self.bot.user_info = 'lazy'
+        self.bot.line_received(':pybot!bot@my.host JOIN #lazy')
+        self.assertEqual(self.bot.sender.lines, ['MODE #lazy'])
+        self.bot.line_received(':srv 353 pybot = #lazy :@pybot newbie')
+        newbie = self.bot.users['newbie']
+        self.assertIsNone(newbie.host)
+        self.assertIsNone(newbie.host)  # Requested only once
+        self.assertEqual(self.bot.sender.lines, ['MODE #lazy', 'WHO newbie'])
+        self.bot.line_received(':srv 352 pybot * ~n nb.host srv newbie H '
+                               ':0 New')
+        self.bot.line_received(':srv 315 pybot newbie :End of /WHO list.')
+        self.assertEqual(newbie.host, 'nb.host')
+
+    def test_user_cache(self):
+        self.bot.line_received(':srv 352 pybot #chan ~f foo.host srv foo H '
+                               ':0 Foo')
+        self.bot.line_received(':foo!~f@foo.host PART #chan')
+        self.assertNotIn('foo', self.bot.users)
+        self.bot.line_received(':srv 353 pybot = #chan :foo')
+        foo = self.bot.users['foo']
+        self.assertEqual((foo.ident, foo.host, foo.realname),
+                         ('~f', 'foo.host', 'Foo'))
+
+    def test_cap_negotiation(self):
+        self.bot._register()
+        self.assertEqual(self.bot.sender.lines[0], 'CAP LS 302')
+        self.bot.sender.lines = []
+        self.bot._handshake_line(b':srv CAP * LS * :multi-prefix sasl=PLAIN')
+        self.assertEqual(self.bot.sender.lines, [])
+        self.bot._handshake_line(b':srv CAP * LS :away-notify foo')
+        self.assertEqual(self.bot.sender.lines,
+                         ['CAP REQ :multi-prefix away-notify'])
+        self.bot._handshake_line(b':srv CAP * ACK :multi-prefix away-notify')
+        self.assertEqual(self.bot.caps, {'multi-prefix', 'away-notify'})
+        self.assertEqual(self.bot.sender.lines[-1], 'CAP END')
+
+    def test_cap_fast_paths(self):
+        self.bot.caps = {'userhost-in-names', 'extended-join', 'away-notify'}
+        self.bot.line_received(':pybot!bot@my.host JOIN #new * :Test Bot')
+        self.assertEqual(self.bot.sender.lines, ['MODE #new'])
+        self.bot.line_received(':srv 353 pybot = #new :@pybot!bot@my.host '
+                               '+Bob!~b@bob.host')
+        bob = self.bot.users['bob']
+        self.assertEqual((bob.ident, bob.host), ('~b', 'bob.host'))
+        self.assertTrue(self.bot.channels['#new'].is_voiced('bob'))
+
+        self.bot.line_received(':Alice!~a@a.host JOIN #new alice :Alice A')
+        alice = self.bot.users['alice']
+        self.assertEqual((alice.account, alice.realname), ('alice', 'Alice A'))
+
+        self.bot.line_received(':Alice!~a@a.host AWAY :lunch')
+        self.assertEqual(alice.away, 'lunch')
+        self.bot.line_received(':Alice!~a@a.host AWAY')
+        self.assertIsNone(alice.away)
+
+    def test_instance_override(self):
+        invites = []
+        self.bot.on_invite = lambda sender, target, channel: invites.append(
+            channel)
+        self.bot.raw_unknown = lambda *args: invites.append(args[0])
+        self.bot.line_received(':martin!m@host INVITE pybot #other')
+        self.bot.line_received(':srv 999 pybot :whatever')
+        self.assertEqual(invites, ['#other', '999'])
+
+    def test_handler_exception_logged(self):
+        def broken(sender, channel, message):
+            raise ValueError()
+
+        self.bot.on_channel_message = broken
+        with self.assertLogs('pyrclib.events', 'ERROR'):
+            self.bot.line_received(':martin!m@host PRIVMSG #chan :hi')
+        # State is still tracked
+        self.bot.line_received(':martin!m@host PART #chan')
+        self.assertNotIn('martin', self.bot.channels['#chan'].users)
+
+    def test_tagged_line(self):
+        tags = []
+        self.bot.on_channel_message = \
+            lambda sender, channel, msg: tags.append(self.bot.tags())
+        self.bot.line_received('@msgid=42 :martin!m@host PRIVMSG #chan :hi')
+        self.assertEqual(tags, [{'msgid': '42'}])
+        self.assertEqual(self.bot.tags(), {})
+
+    def test_netsplit_batch(self):
+        events = []
+        self.bot.on_quit = lambda *args: events.append('quit')
+        self.bot.on_netsplit = lambda servers, users: events.append(
+            (servers, sorted(u.nick for u in users)))
+        self.bot.on_netjoin = lambda servers, joins: events.append(
+            (servers, [(u.nick, c) for u, c in joins]))
+
+        self.bot.line_received(':srv BATCH +ab netsplit hub.net leaf.net')
+        self.bot.line_received('@batch=ab :martin!m@host QUIT :hub leaf')
+        self.bot.line_received('@batch=ab :foo!f@host QUIT :hub leaf')
+        self.assertIn('martin', self.bot.users)
+        self.bot.line_received(':srv BATCH -ab')
+        self.assertEqual(events, [(('hub.net', 'leaf.net'),
+                                   ['foo', 'martin'])])
+        self.assertNotIn('martin', self.bot.users)
+        self.assertEqual(list(self.bot.channels['#chan'].users), ['pybot'])
+
+        self.bot.line_received(':srv BATCH +cd netjoin hub.net leaf.net')
+        self.bot.line_received('@batch=cd :martin!m@host JOIN #chan')
+        self.bot.line_received(':srv BATCH -cd')
+        self.assertEqual(events[-1], (('hub.net', 'leaf.net'),
+                                      [('martin', '#chan')]))
+        self.assertIn('martin', self.bot.channels['#chan'].users)
+
+    def test_nested_batch(self):
+        batches = []
+        self.bot.on_batch = lambda type, params, lines: batches.append(
+            (type, len(lines)))
+        self.bot.line_received(':srv BATCH +outer chathistory #chan')
+        self.bot.line_received('@batch=outer :srv BATCH +inner netsplit a b')
+        self.bot.line_received('@batch=inner :martin!m@host QUIT :a b')
+        self.bot.line_received('@batch=outer :srv BATCH -inner')
+        self.assertNotIn('martin', self.bot.users)
+        self.bot.line_received(':srv BATCH -outer')
+        self.assertEqual(batches, [('chathistory', 0)])
+
+    def test_batch_limits(self):
+        self.bot.line_received(':srv BATCH +ab netsplit hub.net leaf.net')
+        self.bot.line_received('@batch=ab :martin!m@host QUIT :hub leaf')
+        self.bot._reset_state()
+        self.assertFalse(self.bot.dispatcher.batches)
+
+        self.bot.line_received(':pybot!bot@my.host JOIN #chan')
+        self.bot.line_received(':martin!m@host JOIN #chan')
+        self.bot.line_received(':srv BATCH +cd unknown')
+        with mock.patch('pyrclib.events.MAX_BATCH_LINES', 2):
+            for i in range(3):
+                self.bot.line_received(
+                    '@batch=cd :martin!m@host PRIVMSG #chan :{0}'.format(i))
+            self.bot.line_received('@batch=cd :martin!m@host PART #chan')
+        self.assertFalse(self.bot.dispatcher.batches)
+        self.assertNotIn('martin', self.bot.channels['#chan'].users)
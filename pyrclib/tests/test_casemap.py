@@ -0,0 +1,28 @@
+import unittest
+
+from pyrclib.casemap import IRCDict, irc_lower
+
+
+class CasemapTests(unittest.TestCase):
+
+    def test_irc_lower(self):
+        self.assertEqual(irc_lower('Nick[\\]~'), 'nick{|}^')
+        self.assertEqual(irc_lower('Nick[\\]~', 'strict-rfc1459'), 'nick{|}~')
+        self.assertEqual(irc_lower('Nick[\\]~', 'ascii'), 'nick[\\]~')
+
+    def test_ircdict(self):
+        d = IRCDict()
+        d['Foo[1]'] = 1
+        self.assertEqual(d['foo{1}'], 1)
+        self.assertIn('FOO[1]', d)
+        self.assertEqual(list(d), ['Foo[1]'])
+        self.assertEqual(d.pop('fOO{1}'), 1)
+        self.assertEqual(len(d), 0)
+        self.assertIsNone(d.pop('foo', None))
+
+    def test_set_casemapping(self):
+        d = IRCDict(data={'A[': 1})
+        d.set_casemapping('ascii')
+        self.assertIn('a[', d)
+        self.assertNotIn('a{', d)
+        self.assertEqual(list(d), ['A['])
@@ -3,6 +3,7 @@ import unittest
 from unittest.mock import Mock
 
 from pyrclib.connection import IRCConnection
+from pyrclib.fakeserver import FakeServer
 
 
 class ConnectionTests(unittest.TestCase):
@@ -25,7 +26,10 @@ class ConnectionTests(unittest.TestCase):
         self.conn.sender = Mock()
         self.conn.on_connect = Mock()
         self.conn.on_disconnect = Mock()
-        self.conn.connect('irc.rizon.net', port=6667)
+        server = FakeServer()
+        server.start()
+        self.addCleanup(server.close)
+        self.conn.connect('127.0.0.1', port=server.port)
         self.assertTrue(self.conn.on_connect.called)
         self.assertTrue(self.conn.is_connected)
         self.conn.disconnect()
@@ -0,0 +1,98 @@
+import time
+import unittest
+
+from pyrclib.bot import IRCBot
+from pyrclib.events import handler
+from pyrclib.tests.helpers import FakeSender
+
+
+def shout(sender, target, message):
+    return 'PRIVMSG {0} :{1} said {2}'.format(target, sender.nick,
+                                              message.upper())
+
+
+class HandlerBot(IRCBot):
+
+    def __init__(self):
+        IRCBot.__init__(self, 'pybot', 'bot', 'Test Bot')
+        self.calls = []
+
+    @handler('PRIVMSG')
+    def log_privmsg(self, sender, target, message):
+        self.calls.append(('log', message))
+
+    @handler('PRIVMSG', priority=5)
+    @handler('NOTICE', priority=5)
+    def first(self, sender, target, message):
+        self.calls.append(('first', message))
+
+    @staticmethod
+    @handler('PRIVMSG', process=True)
+    def count(sender, target, message):
+        return ['PRIVMSG {0} :{1}'.format(target, len(message))]
+
+    @handler('396')
+    def host_changed(self, host, msg):
+        self.calls.append(('396', host))
+
+
+class RegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = HandlerBot()
+        self.bot.sender = FakeSender()
+
+    def test_noop_handlers_skipped(self):
+        bot = IRCBot('pybot', 'bot', 'Test Bot')
+        table = bot.dispatcher.user_table
+        self.assertNotIn('INVITE', table)
+        self.assertNotIn('NOTICE', table)
+        self.assertIn('PRIVMSG', table)  # CTCP replies
+        self.assertIn('JOIN', table)
+        self.assertIsNone(bot.dispatcher.user_default)
+        self.assertIsNone(bot.dispatcher.raw_default)
+        # Handled without errors
+        bot.line_received(':martin!m@host INVITE pybot #chan')
+        bot.line_received(':srv 999 pybot :unknown')
+
+    def test_decorated_handlers(self):
+        self.bot.line_received(':martin!m@host PRIVMSG #chan :hi')
+        self.bot.line_received(':martin!m@host NOTICE #chan :hey')
+        self.bot.line_received(':srv 396 pybot new.host :is now your host')
+        self.assertEqual(self.bot.calls, [('first', 'hi'), ('log', 'hi'),
+                                          ('first', 'hey'),
+                                          ('396', 'new.host')])
+
+    def test_subscribe(self):
+        calls = []
+
+        def failing(sender, *params):
+            raise ValueError()
+
+        self.bot.subscribe('INVITE', failing, priority=1)
+        self.bot.subscribe('INVITE', lambda sender, target, channel:
+                           calls.append((sender.nick, channel)))
+        self.bot.line_received(':martin!m@host INVITE pybot #chan')
+        self.assertEqual(calls, [('martin', '#chan')])
+
+        self.bot.unsubscribe('INVITE', failing)
+        self.assertEqual(len(self.bot.dispatcher.subscribers), 1)
+
+    def test_process_handlers(self):
+        self.bot.subscribe('PRIVMSG', shout, process=True)
+        self.bot.line_received(':martin!m@host PRIVMSG #chan :hi')
+        self.assertEqual(self.bot.sender.lines,
+                         ['PRIVMSG #chan :2', 'PRIVMSG #chan :martin said HI'])
+
+        self.bot.use_processes(1)
+        try:
+            self.bot.line_received(':martin!m@host PRIVMSG #chan :hey')
+            for i in range(500):
+                if len(self.bot.sender.lines) == 4:
+                    break
+                time.sleep(0.01)
+        finally:
+            self.bot.processes.shutdown()
+        self.assertEqual(sorted(self.bot.sender.lines[2:]),
+                         ['PRIVMSG #chan :3',
+                          'PRIVMSG #chan :martin said HEY'])
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+from pyrclib.bot import IRCBot
+from pyrclib.fakeserver import FakeServer, load_traffic, synthetic_members
+from pyrclib.ratelimit import FixedDelay
+
+
+class FakeServerTests(unittest.TestCase):
+
+    def connect(self, server):
+        server.start()
+        self.addCleanup(server.close)
+        bot = IRCBot('pybot', 'bot', 'Test Bot')
+        bot.limiter = FixedDelay(0)
+        bot.connect('127.0.0.1', server.port)
+        self.addCleanup(bot.disconnect)
+        return bot
+
+    def test_join(self):
+        server = FakeServer()
+        server.add_channel('#chan', synthetic_members(2000))
+        bot = self.connect(server)
+        bot.join('#chan')
+        server.wait_for('WHO')
+        server.sync()
+
+        chan = bot.channels['#chan']
+        self.assertEqual(len(chan.users), 2001)
+        self.assertTrue(chan.is_op('pybot'))
+        self.assertTrue(chan.is_voiced('user10'))
+        self.assertFalse(chan.is_voiced('user11'))
+        self.assertEqual(str(chan), '#chan [+nt]')
+        user = bot.users['user1999']
+        self.assertEqual((user.ident, user.host, user.realname),
+                         ('ident1999', 'users.fake', 'Real Name'))
+        self.assertFalse(bot.who.inflight)
+
+    def test_join_many(self):
+        server = FakeServer()
+        channels = ['#chan{0}'.format(i) for i in range(6)]
+        for i, channel in enumerate(channels):
+            server.add_channel(channel, synthetic_members(50, i * 50))
+        bot = self.connect(server)
+        ended = []
+        done = bot.who.done
+        bot.who.done = lambda mask: ended.append(mask) or done(mask)
+        for channel in channels:
+            bot.join(channel)
+        server.wait_for('WHO', len(channels))
+        server.sync()
+
+        self.assertEqual(ended, channels)
+        self.assertFalse(bot.who.inflight)
+        self.assertFalse(bot.who.pending)
+        self.assertEqual(bot.users['user299'].ident, 'ident299')
+        self.assertEqual(len(bot.channels['#chan5'].users), 51)
+
+    def test_userhost_in_names(self):
+        server = FakeServer(caps=('multi-prefix', 'userhost-in-names'))
+        server.add_channel('#chan', ['@+martin!m@host'])
+        bot = self.connect(server)
+        bot.join('#chan')
+        server.wait_for('MODE')
+        server.sync()
+
+        self.assertEqual(bot.caps, {'multi-prefix', 'userhost-in-names'})
+        self.assertEqual(bot.channels['#chan'].prefix('martin'), '@')
+        self.assertTrue(bot.channels['#chan'].is_voiced('martin'))
+        self.assertEqual(bot.users['martin'].host, 'host')
+        self.assertNotIn('WHO', [line.split()[0] for line in server.received])
+
+    def test_replay(self):
+        server = FakeServer()
+        server.add_channel('#chan', ['martin!m@host'])
+        bot = self.connect(server)
+        bot.join('#chan')
+        server.wait_for('WHO')
+        server.sync()
+
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'1.0 < :foo!f@host JOIN #chan\n'
+                    b'1.0 > PRIVMSG #chan :ignored\n'
+                    b'1.01 < :martin!m@host NICK martin_\n'
+                    b'1.02 < :foo!f@host PART #chan\n')
+        try:
+            entries = load_traffic(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(len(entries), 3)
+
+        server.replay(entries, timing=True, speed=10)
+        server.replay(entries[:1])
+        server.sync()
+        users = bot.channels['#chan'].users
+        self.assertEqual(sorted(users), ['foo', 'martin_', 'pybot'])
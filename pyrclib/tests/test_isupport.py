@@ -0,0 +1,29 @@
+import unittest
+
+from pyrclib import isupport
+
+
+class ISupportTests(unittest.TestCase):
+
+    def test_parse(self):
+        parsed = isupport.parse(['PREFIX=(qov)~@+', 'CHANMODES=b,k', 'EXCEPTS',
+                                 'MODES=x', 'FOO=bar', '-WHOX'])
+        self.assertEqual(parsed, [
+            ('PREFIX', '(qov)~@+', 'prefixes',
+             [('q', '~'), ('o', '@'), ('v', '+')]),
+            ('CHANMODES', 'b,k',
+             ('modes_target', 'modes_param', 'modes_setparam',
+              'modes_noparam'), ['b', 'k', '', '']),
+            ('EXCEPTS', '', 'supports_excepts', True),
+            ('MODES', 'x', 'maxmodes', None),
+            ('FOO', 'bar', None, None),
+            ('WHOX', None, 'whox', None),
+        ])
+
+    def test_mode_classes(self):
+        classes = isupport.ModeClasses('beI,k,l,imnpst')
+        self.assertTrue(classes.takes_param('b', False))
+        self.assertTrue(classes.takes_param('k', False))
+        self.assertTrue(classes.takes_param('l', True))
+        self.assertFalse(classes.takes_param('l', False))
+        self.assertFalse(classes.takes_param('n', True))
@@ -0,0 +1,94 @@
+import unittest
+
+from pyrclib.linereceiver import LineBuffer
+from pyrclib.message import is_user, parse, parse_tags, split_params, \
+    split_text
+
+
+class MessageTests(unittest.TestCase):
+
+    def test_parse_user_message(self):
+        prefix, command, rest = parse(
+            b':martin!~abc@my.host PRIVMSG #chan :hi there ')
+        self.assertEqual(prefix, b'martin!~abc@my.host')
+        self.assertEqual(command, 'PRIVMSG')
+        self.assertTrue(is_user(prefix))
+        self.assertEqual(split_params(rest), ['#chan', 'hi there '])
+
+    def test_parse_numeric(self):
+        prefix, command, rest = parse(
+            b':srv.net 005 nick PREFIX=(ov)@+ MODES=4 :are supported')
+        self.assertEqual(command, '005')
+        self.assertFalse(is_user(prefix))
+        self.assertEqual(split_params(rest),
+                         ['nick', 'PREFIX=(ov)@+', 'MODES=4', 'are supported'])
+
+    def test_parse_without_prefix(self):
+        prefix, command, rest = parse(b'PING :irc.rizon.net')
+        self.assertEqual(prefix, b'')
+        self.assertEqual(command, 'PING')
+        self.assertEqual(split_params(rest), ['irc.rizon.net'])
+
+    def test_parse_without_params(self):
+        prefix, command, rest = parse(memoryview(b':nick!u@h QUIT'))
+        self.assertEqual(command, 'QUIT')
+        self.assertEqual(split_params(rest), [])
+
+    def test_parse_empty_trailing(self):
+        prefix, command, rest = parse(':nick!u@h PART #chan :')
+        self.assertEqual(split_params(rest), ['#chan', ''])
+
+    def test_decode_fallback(self):
+        prefix, command, rest = parse(b':nick!u@h PRIVMSG #chan :caf\xe9')
+        self.assertEqual(split_params(rest)[1], 'caf\xe9')
+        prefix, command, rest = parse(b':nick!u@h PRIVMSG #chan :caf\xc3\xa9')
+        self.assertEqual(split_params(rest)[1], 'caf\xe9')
+
+
+class LineBufferTests(unittest.TestCase):
+
+    def test_split_lines_across_reads(self):
+        buf = LineBuffer()
+        self.assertEqual(buf.feed(b'PING :a\r\n:srv 001 nick :Wel'),
+                         [b'PING :a'])
+        self.assertEqual(buf.feed(memoryview(b'come\r')), [])
+        self.assertEqual(buf.feed(b'\n:srv 002 nick :Host\nPING :b\r\n'),
+                         [b':srv 001 nick :Welcome', b':srv 002 nick :Host',
+                          b'PING :b'])
+
+
+class SplitTextTests(unittest.TestCase):
+
+    def test_short_text(self):
+        self.assertEqual(split_text('hello world', 20), ['hello world'])
+
+    def test_split_on_words(self):
+        self.assertEqual(split_text('aaaa bbbb cccc dddd', 10),
+                         ['aaaa bbbb', 'cccc dddd'])
+
+    def test_split_multibyte(self):
+        text = 'è' * 10  # 2 bytes each
+        chunks = split_text(text, 5)
+        self.assertEqual(chunks, ['èè'] * 5)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.encode()), 5)
+
+
+class TagsTests(unittest.TestCase):
+
+    def test_parse_tagged(self):
+        line = parse(b'@time=2020-01-01T00:00:00Z;msgid=a\\sb;flag '
+                     b':nick!u@h PRIVMSG #chan :hi')
+        self.assertEqual(line[:3], (b'nick!u@h', 'PRIVMSG', b'#chan :hi'))
+        self.assertEqual(parse_tags(line[3]),
+                         {'time': '2020-01-01T00:00:00Z', 'msgid': 'a b',
+                          'flag': ''})
+
+    def test_unescape(self):
+        self.assertEqual(parse_tags(b'a=x\\:y\\\\z\\')['a'], 'x;y\\z')
+
+    def test_split_text_tiny_limit(self):
+        self.assertEqual(split_text('\u00e9\u00e9\u00e9', 4),
+                         ['\u00e9\u00e9', '\u00e9'])
+        self.assertRaises(ValueError, split_text, '\u00e9\u00e9\u00e9', 1)
+        self.assertRaises(ValueError, split_text, 'abc', 0)
@@ -0,0 +1,45 @@
+import unittest
+
+from pyrclib.modes import ModeBatcher
+
+
+class ModeBatcherTests(unittest.TestCase):
+
+    def test_pack_up_to_maxmodes(self):
+        batcher = ModeBatcher()
+        self.assertTrue(batcher.add('#chan', '+o', 'a'))
+        for nick in 'bcde':
+            self.assertFalse(batcher.add('#chan', '+o', nick))
+        batcher.add('#chan', '-v', 'f')
+        batcher.add('#chan', '+m')
+        self.assertEqual(batcher.pop_lines('#chan', 4),
+                         ['MODE #chan +oooo a b c d',
+                          'MODE #chan +o-v+m e f'])
+        self.assertEqual(batcher.pop_lines('#chan', 4), [])
+
+    def test_no_maxmodes(self):
+        batcher = ModeBatcher()
+        for nick in 'abcde':
+            batcher.add('#chan', '+o', nick)
+        self.assertEqual(batcher.pop_lines('#chan', None),
+                         ['MODE #chan +ooooo a b c d e'])
+
+    def test_duplicates_and_line_length(self):
+        batcher = ModeBatcher()
+        batcher.add('#chan', '+b', 'x' * 30)
+        batcher.add('#chan', '+b', 'x' * 30)
+        batcher.add('#chan', '+b', 'y' * 30)
+        self.assertEqual(batcher.pop_lines('#chan', 6, maxlen=60),
+                         ['MODE #chan +b ' + 'x' * 30,
+                          'MODE #chan +b ' + 'y' * 30])
+
+    def test_last_change_wins(self):
+        batcher = ModeBatcher()
+        batcher.add('#chan', '+o', 'a')
+        batcher.add('#chan', '-o', 'a')
+        batcher.add('#chan', '+v', 'b')
+        batcher.add('#chan', '+o', 'a')
+        batcher.add('#chan', '+m')
+        batcher.add('#chan', '-m')
+        self.assertEqual(batcher.pop_lines('#chan', 4),
+                         ['MODE #chan +vo-m b a'])
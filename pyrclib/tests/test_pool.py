@@ -0,0 +1,128 @@
+import asyncio
+import unittest
+
+from pyrclib.asyncbot import AsyncIRCBot
+from pyrclib.pool import BotPool
+
+
+async def handle_client(reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.startswith(b'USER'):
+            writer.write(b':srv 001 pybot :Welcome\r\n')
+        elif line.startswith(b'JOIN'):
+            chan = line.split()[1]
+            writer.write(b':pybot!bot@host JOIN ' + chan + b'\r\n')
+        elif line.startswith(b'QUIT'):
+            break
+    writer.close()
+
+
+async def ignore_quit(reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.startswith(b'USER'):
+            writer.write(b':srv 001 pybot :Welcome\r\n')
+    writer.close()
+
+
+async def drop_after_welcome(reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.startswith(b'USER'):
+            writer.write(b':srv 001 pybot :Welcome\r\n')
+            await writer.drain()
+            break
+    writer.close()
+
+
+class FailingBot(AsyncIRCBot):
+
+    failures = 0
+
+    def on_disconnect(self):
+        if not self.failures:
+            self.failures += 1
+            raise RuntimeError('boom')
+
+
+class BotPoolTests(unittest.TestCase):
+
+    async def _run_pool(self):
+        server = await asyncio.start_server(handle_client, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = BotPool()
+        for name in ('net1', 'net2', 'net3'):
+            bot = AsyncIRCBot('pybot', 'bot', 'Test Bot')
+            pool.add(name, bot, '127.0.0.1', port, channels=['#' + name])
+
+        await pool.start()
+        for i in range(100):
+            if all(n.bot.channels for n in pool.networks.values()):
+                break
+            await asyncio.sleep(0.01)
+        await pool.shutdown('bye')
+        server.close()
+        await server.wait_closed()
+        return pool
+
+    def test_start_and_shutdown(self):
+        pool = asyncio.run(self._run_pool())
+        self.assertEqual(pool.metrics.counters['connects'], 3)
+        for name, network in pool.networks.items():
+            self.assertFalse(network.bot.is_connected)
+            self.assertTrue(network.bot.sender._writer.is_closing())
+            self.assertTrue(all(task.done() for task in network.bot._tasks))
+            self.assertIn('#' + name, network.bot.channels)
+            self.assertGreater(
+                pool.metrics.counters[name + '.lines_received'], 0)
+
+    async def _shutdown_ignored_quit(self):
+        server = await asyncio.start_server(ignore_quit, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = BotPool()
+        bot = pool.add('net', AsyncIRCBot('pybot', 'bot', 'Test Bot'),
+                       '127.0.0.1', port)
+        await pool.start()
+        for i in range(100):
+            if bot.is_connected:
+                break
+            await asyncio.sleep(0.01)
+        await pool.shutdown('bye')
+        server.close()
+        await server.wait_closed()
+        return bot
+
+    def test_shutdown_closes_connection(self):
+        bot = asyncio.run(self._shutdown_ignored_quit())
+        self.assertTrue(bot.sender._writer.is_closing())
+
+    async def _reconnect_after_error(self):
+        server = await asyncio.start_server(drop_after_welcome, '127.0.0.1',
+                                            0)
+        port = server.sockets[0].getsockname()[1]
+        pool = BotPool(reconnect_delay=0.01)
+        pool.add('net', FailingBot('pybot', 'bot', 'Test Bot'), '127.0.0.1',
+                 port)
+        serving = asyncio.ensure_future(pool.serve())
+        for i in range(200):
+            if pool.metrics.counters.get('connects', 0) >= 2:
+                break
+            await asyncio.sleep(0.01)
+        await pool.shutdown()
+        await serving
+        server.close()
+        await server.wait_closed()
+        return pool
+
+    def test_reconnect_after_error(self):
+        with self.assertLogs('pyrclib.pool', 'ERROR'):
+            pool = asyncio.run(self._reconnect_after_error())
+        self.assertEqual(pool.networks['net'].bot.failures, 1)
+        self.assertGreaterEqual(pool.metrics.counters['connects'], 2)
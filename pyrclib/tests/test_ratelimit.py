@@ -0,0 +1,36 @@
+import unittest
+
+from pyrclib.ratelimit import FixedDelay, PenaltyLimiter
+
+
+class RateLimitTests(unittest.TestCase):
+
+    def test_penalty_burst_then_throttle(self):
+        limiter = PenaltyLimiter(window=10, base=2, bytes_per_second=120)
+        line = 'PRIVMSG #chan :hi'  # 2 + 19 / 120 seconds each
+        now = 1000.0
+        for i in range(4):
+            self.assertEqual(limiter.delay_for(line, now), 0)
+            limiter.sent(line, now)
+
+        # The fifth line would push the clock past the 10 seconds window
+        wait = limiter.delay_for(line, now)
+        self.assertAlmostEqual(wait, 5 * (2 + 19 / 120) - 10)
+        self.assertEqual(limiter.delay_for(line, now + wait), 0)
+
+    def test_penalty_long_lines(self):
+        limiter = PenaltyLimiter(window=10, base=2, bytes_per_second=120)
+        self.assertAlmostEqual(limiter.penalty('x' * 478), 6)
+
+    def test_penalty_idle_resets(self):
+        limiter = PenaltyLimiter()
+        for i in range(5):
+            limiter.sent('PRIVMSG #chan :hi', 0)
+        self.assertEqual(limiter.delay_for('PRIVMSG #chan :hi', 60), 0)
+
+    def test_fixed_delay(self):
+        limiter = FixedDelay(1000)
+        self.assertEqual(limiter.delay_for('PONG x', 5), 0)
+        limiter.sent('PONG x', 5)
+        self.assertAlmostEqual(limiter.delay_for('PONG x', 5.25), 0.75)
+        self.assertEqual(limiter.delay_for('PONG x', 6), 0)
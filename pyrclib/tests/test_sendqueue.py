@@ -0,0 +1,101 @@
+import unittest
+
+from pyrclib.sendqueue import BULK, CONTROL, DROP_OLDEST, NORMAL, URGENT, \
+    FairLane, Lane, SendQueue
+
+
+class SendQueueTests(unittest.TestCase):
+
+    def test_priority_order(self):
+        queue = SendQueue()
+        queue.push('PRIVMSG #a :1')
+        queue.push('PRIVMSG #a :2', NORMAL)
+        queue.push('MODE #a +o nick', CONTROL)
+        queue.push('PONG nick', URGENT)
+        self.assertEqual(queue.depths(), [1, 1, 2, 0])
+        self.assertEqual(queue.peek(), 'PONG nick')
+        self.assertEqual([queue.pop() for i in range(4)],
+                         ['PONG nick', 'MODE #a +o nick', 'PRIVMSG #a :1',
+                          'PRIVMSG #a :2'])
+        self.assertIsNone(queue.pop())
+
+    def test_bulk_lane_last(self):
+        queue = SendQueue()
+        queue.push('WHO #big', BULK)
+        queue.push('PRIVMSG #a :hi')
+        self.assertEqual(queue.pop(), 'PRIVMSG #a :hi')
+        self.assertEqual(queue.pop(), 'WHO #big')
+
+    def test_merge_duplicates(self):
+        queue = SendQueue()
+        self.assertTrue(queue.push('PONG nick', URGENT))
+        self.assertFalse(queue.push('PONG nick', URGENT))
+        self.assertEqual(len(queue), 1)
+
+    def test_merge_keeps_order_changes(self):
+        queue = SendQueue()
+        for line in ('JOIN #a', 'PART #a', 'JOIN #a', 'JOIN #a'):
+            queue.push(line, CONTROL)
+        self.assertEqual([queue.pop() for i in range(len(queue))],
+                         ['JOIN #a', 'PART #a', 'JOIN #a'])
+
+    def test_lane_limits(self):
+        lane = Lane(2)
+        self.assertTrue(lane.push('a'))
+        self.assertTrue(lane.push('b'))
+        self.assertFalse(lane.push('c'))
+        self.assertEqual(list(lane.queue), ['a', 'b'])
+
+        lane = Lane(2, DROP_OLDEST)
+        for line in 'abc':
+            lane.push(line)
+        self.assertEqual(list(lane.queue), ['b', 'c'])
+        self.assertEqual(lane.dropped, 1)
+
+    def test_fair_between_targets(self):
+        lane = FairLane(quantum=25)
+        for i in range(5):
+            lane.push('PRIVMSG #big :line {0}'.format(i))
+        lane.push('PRIVMSG #small :hello')
+        lane.push('PRIVMSG nick :hi')
+        self.assertEqual(lane.depths(), {'#big': 5, '#small': 1, 'nick': 1})
+
+        sent = [lane.pop() for i in range(7)]
+        self.assertEqual(sent[:4], ['PRIVMSG #big :line 0',
+                                    'PRIVMSG #small :hello',
+                                    'PRIVMSG nick :hi',
+                                    'PRIVMSG #big :line 1'])
+        self.assertEqual(len(lane), 0)
+        self.assertEqual(lane.depths(), {})
+
+    def test_fair_drop_oldest_from_longest(self):
+        lane = FairLane(3, DROP_OLDEST)
+        lane.push('PRIVMSG #big :1')
+        lane.push('PRIVMSG #big :2')
+        lane.push('PRIVMSG #small :1')
+        lane.push('PRIVMSG #small :2')
+        self.assertEqual(lane.depths(), {'#big': 1, '#small': 2})
+
+    def test_fair_targets_casemapping(self):
+        lane = FairLane()
+        lane.push('PRIVMSG #Foo[ :1')
+        lane.push('PRIVMSG #foo{ :2')
+        self.assertEqual(lane.depths(), {'#foo{': 2})
+
+        lane = FairLane(casemapping='ascii')
+        lane.push('PRIVMSG #Foo[ :1')
+        lane.push('PRIVMSG #foo{ :2')
+        self.assertEqual(lane.depths(), {'#foo[': 1, '#foo{': 1})
+        lane.set_casemapping('rfc1459')
+        self.assertEqual(lane.depths(), {'#foo{': 2})
+        self.assertEqual([lane.pop(), lane.pop()],
+                         ['PRIVMSG #Foo[ :1', 'PRIVMSG #foo{ :2'])
+
+    def test_fair_cost_in_bytes(self):
+        lane = FairLane(quantum=20)
+        # 20 characters, but 28 bytes: #a is out of credit in the first
+        # round
+        lane.push('PRIVMSG #a :' + '\u00e9' * 8)
+        lane.push('PRIVMSG #a :' + '\u00e9' * 8)
+        lane.push('PRIVMSG #b :hi')
+        self.assertEqual([lane.pop() for i in range(3)][0], 'PRIVMSG #b :hi')
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+from pyrclib.traffic import TrafficRecorder
+
+
+class TrafficRecorderTests(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        traffic = TrafficRecorder(size=3)
+        traffic.received([b':srv 001 pybot :Welcome', b'PING :srv'])
+        traffic.sent('PONG :srv')
+        traffic.sent('JOIN #chan')
+        lines = traffic.dump()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith(' < PING :srv'))
+        self.assertTrue(lines[2].endswith(' > JOIN #chan'))
+
+        traffic.enabled = False
+        traffic.sent('PART #chan')
+        self.assertEqual(len(traffic.lines), 3)
+        self.assertEqual(traffic.lines[-1][2], 'JOIN #chan')
+
+    def test_writer(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            traffic = TrafficRecorder()
+            traffic.sent('NICK before')  # Not written
+            traffic.start_writer(path, interval=60)
+            traffic.received([b'caf\xc3\xa9', b'\xff'])
+            traffic.sent('NICK after')
+            traffic.stop_writer()
+            with open(path, 'rb') as f:
+                written = [line.split(b' ', 1)[1] for line in f]
+        finally:
+            os.remove(path)
+
+        self.assertEqual(written, [b'< caf\xc3\xa9\n', b'< \xff\n',
+                                   b'> NICK after\n'])
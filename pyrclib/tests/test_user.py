@@ -1,3 +1,4 @@
+import pickle
 import unittest
 
 from pyrclib.user import User
@@ -11,3 +12,22 @@ class UserTests(unittest.TestCase):
         self.assertEqual(user.nick, 'py-ctcp')
         self.assertEqual(user.ident, 'ctcp')
         self.assertEqual(user.host, 'ctcp-scanner.rizon.net')
+
+    def test_snapshot(self):
+        user = User('martin', 'm', 'host')
+        calls = []
+        user.resolver = calls.append
+        user.account = 'martin'
+        snapshot = pickle.loads(pickle.dumps(user.snapshot()))
+        self.assertEqual(snapshot, ('martin', 'm', 'host', None, 'martin',
+                                    None))
+        self.assertEqual(calls, [])
+
+    def test_str_doesnt_resolve(self):
+        user = User('martin')
+        calls = []
+        user.resolver = calls.append
+        self.assertEqual(str(user), 'martin!*@*')
+        self.assertEqual(calls, [])
+        user.ident, user.host = 'm', 'host'
+        self.assertEqual(str(user), 'martin!m@host')
@@ -0,0 +1,29 @@
+import unittest
+
+from pyrclib.userinfo import UserInfoCache
+
+
+class UserInfoCacheTests(unittest.TestCase):
+
+    def test_ttl(self):
+        cache = UserInfoCache(ttl=10)
+        cache.put('nick', 'ident', 'host', 'Real Name', now=0)
+        self.assertEqual(cache.get('nick', now=5),
+                         ('ident', 'host', 'Real Name'))
+        self.assertIsNone(cache.get('nick', now=10))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        cache = UserInfoCache(maxsize=2)
+        cache.put('a', 'a', 'host', now=0)
+        cache.put('b', 'b', 'host', now=0)
+        cache.get('a', now=1)
+        cache.put('c', 'c', 'host', now=1)
+        self.assertIsNone(cache.get('b', now=1))
+        self.assertEqual(cache.get('a', now=1), ('a', 'host', None))
+
+    def test_keep_realname(self):
+        cache = UserInfoCache()
+        cache.put('a', 'a', 'host', 'Real', now=0)
+        cache.put('a', 'a', 'newhost', now=0)
+        self.assertEqual(cache.get('a', now=0), ('a', 'newhost', 'Real'))
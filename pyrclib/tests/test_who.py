@@ -0,0 +1,61 @@
+import time
+import unittest
+
+from pyrclib.who import WhoSync
+
+
+class WhoSyncTests(unittest.TestCase):
+
+    def test_window(self):
+        who = WhoSync(window=2)
+        for chan in ('#a', '#b', '#c'):
+            who.add(chan)
+        self.assertEqual(who.pop_lines(), ['WHO #a', 'WHO #b'])
+        self.assertEqual(who.pop_lines(), [])
+        self.assertTrue(who.done('#A'))
+        self.assertEqual(who.pop_lines(), ['WHO #c'])
+        self.assertTrue(who.done('#b'))
+        self.assertTrue(who.done('#c'))
+        self.assertFalse(who.done('somenick'))
+
+    def test_dedup(self):
+        who = WhoSync(window=1)
+        who.add('#a')
+        who.add('#A')
+        who.add('#b')
+        self.assertEqual(len(who.pending), 2)
+        self.assertEqual(who.pop_lines(), ['WHO #a'])
+        who.add('#a')  # Sent, can be queued again
+        self.assertEqual(list(who.pending), ['#b', '#a'])
+
+    def test_unmatched_end_frees_slot(self):
+        who = WhoSync(window=2)
+        for chan in ('#a', '#b', '#c', '#d'):
+            who.add(chan)
+        self.assertEqual(who.pop_lines(True, 2), ['WHO #a,#b %tcuhnfr,152',
+                                                  'WHO #c,#d %tcuhnfr,152'])
+        # Only one of the targets sent back
+        self.assertTrue(who.done('#c'))
+        self.assertEqual(list(who.inflight), ['#a,#b'])
+        # Not ours, the oldest request is given up
+        self.assertTrue(who.done('*'))
+        self.assertFalse(who.inflight)
+
+    def test_timeout(self):
+        who = WhoSync(window=1, timeout=0.01)
+        who.add('#a')
+        who.add('#b')
+        self.assertEqual(who.pop_lines(), ['WHO #a'])
+        self.assertEqual(who.pop_lines(), [])
+        time.sleep(0.02)
+        self.assertEqual(who.pop_lines(), ['WHO #b'])
+
+    def test_whox_targets(self):
+        who = WhoSync(window=1, token='7')
+        for chan in ('#a', '#b', '#c'):
+            who.add(chan)
+        self.assertEqual(who.pop_lines(True, 2),
+                         ['WHO #a,#b %tcuhnfr,7'])
+        self.assertTrue(who.done('#a,#b'))
+        self.assertEqual(who.pop_lines(True, 2, maxlen=20),
+                         ['WHO #c %tcuhnfr,7'])
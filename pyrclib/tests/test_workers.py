@@ -0,0 +1,75 @@
+import threading
+import unittest
+
+from pyrclib.bot import IRCBot
+from pyrclib.metrics import Metrics
+from pyrclib.tests.helpers import FakeSender
+from pyrclib.workers import OrderedWorkers
+
+
+class OrderedWorkersTests(unittest.TestCase):
+
+    def test_order_by_key(self):
+        workers = OrderedWorkers(threads=3)
+        results = {}
+        for i in range(200):
+            key = '#chan{0}'.format(i % 5)
+            workers.submit(key, results.setdefault(key, []).append, i)
+        workers.stop()
+
+        for key, values in results.items():
+            self.assertEqual(values, sorted(values))
+        self.assertEqual(sum(len(v) for v in results.values()), 200)
+        self.assertEqual(len(workers), 0)
+
+    def test_exception_doesnt_stop_worker(self):
+        workers = OrderedWorkers(threads=1)
+        done = []
+        workers.submit('a', lambda: 1 / 0)
+        workers.submit('a', done.append, 1)
+        workers.stop()
+        self.assertEqual(done, [1])
+
+    def test_backpressure(self):
+        workers = OrderedWorkers(threads=1, maxsize=1)
+        release = threading.Event()
+        workers.submit('a', release.wait)
+        workers.submit('a', len, '')  # Queued while the first one runs
+        t = threading.Thread(target=workers.submit, args=('a', len, ''))
+        t.start()
+        t.join(0.05)
+        self.assertTrue(t.is_alive())
+        release.set()
+        t.join()
+        workers.stop()
+
+
+class BotWorkersTests(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = IRCBot('pybot', 'bot', 'Test Bot')
+        self.bot.sender = FakeSender()
+        self.bot.metrics = Metrics()
+        self.bot.line_received(':pybot!bot@my.host JOIN #chan')
+
+    def test_slow_handler(self):
+        release = threading.Event()
+        messages = []
+
+        def on_channel_message(sender, channel, message):
+            release.wait()
+            messages.append(message)
+
+        self.bot.on_channel_message = on_channel_message
+        self.bot.use_workers(threads=2)
+        self.bot.line_received(':martin!m@host JOIN #chan')
+        self.bot.line_received(':martin!m@host PRIVMSG #chan :one')
+        self.bot.line_received(':martin!m@host PRIVMSG #CHAN :two')
+        self.bot.line_received(':martin!m@host PART #chan')
+        # State is tracked while the handler is still waiting
+        self.assertNotIn('martin', self.bot.channels['#chan'].users)
+        self.assertGreater(self.bot.metrics.gauges['worker_queue'], 0)
+
+        release.set()
+        self.bot.workers.stop()
+        self.assertEqual(messages, ['one', 'two'])
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+RECEIVED = b'<'
+SENT = b'>'
+
+
+class TrafficRecorder(object):
+    """Keeps the last size lines received from and sent to the server, to
+    look at them when something goes wrong, instead of logging every line.
+    Recording a line only appends it to a ring buffer as it is, bytes when
+    received and str when sent: nothing is formatted or written to disk
+    while handling the traffic.
+    start_writer() appends the recorded lines to a file from a background
+    thread, one per line as "<timestamp> <direction> <line>", direction being
+    < for received lines and > for sent ones.
+    Set enabled to False to stop recording at any time.
+    """
+
+    def __init__(self, size=1000):
+        self.enabled = True
+        # (time, direction, line), oldest first
+        self.lines = deque(maxlen=size)
+        # Lines not written to the file yet, if there's a writer
+        self._pending = None
+        self._writer = None
+        self._stop = threading.Event()
+
+    def received(self, lines):
+        """Records a list of received lines (bytes, without CR/LF).
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        entries = [(now, RECEIVED, line) for line in lines]
+        self.lines.extend(entries)
+        if self._pending is not None:
+            self._pending.extend(entries)
+
+    def sent(self, line):
+        """Records a sent line (str, without CR/LF).
+        """
+        if not self.enabled:
+            return
+        entry = (time.time(), SENT, line)
+        self.lines.append(entry)
+        if self._pending is not None:
+            self._pending.append(entry)
+
+    def dump(self):
+        """Returns the recorded lines as text, oldest first.
+        """
+        return [_format(entry).decode(errors='replace').rstrip('\n')
+                for entry in list(self.lines)]
+
+    def start_writer(self, path, interval=1.0, maxpending=100000):
+        """Appends every line recorded from now on to the file at path, every
+        interval seconds. If the writer falls more than maxpending lines
+        behind, the oldest ones are not written.
+        """
+        self.stop_writer()
+        self._pending = deque(maxlen=maxpending)
+        self._stop.clear()
+        self._writer = threading.Thread(target=self._write,
+                                        args=(path, interval),
+                                        name='pyrclib-traffic')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def stop_writer(self):
+        """Writes the pending lines and stops the writer thread.
+        """
+        if self._writer is None:
+            return
+        self._stop.set()
+        self._writer.join()
+        self._writer = None
+        self._pending = None
+
+    def _write(self, path, interval):
+        pending = self._pending
+        with open(path, 'ab') as f:
+            while True:
+                stopping = self._stop.wait(interval)
+                try:
+                    while pending:
+                        f.write(_format(pending.popleft()))
+                    f.flush()
+                except OSError:
+                    logger.exception('Cannot write traffic to %s', path)
+                if stopping:
+                    break
+
+
+def _format(entry):
+    when, direction, line = entry
+    if not isinstance(line, bytes):
+        line = line.encode()
+    return b'%.3f %s %s\n' % (when, direction, line)
@@ -1,12 +1,74 @@
+import sys
+from collections import namedtuple
+
+# A picklable copy of a User, see User.snapshot
+UserSnapshot = namedtuple('UserSnapshot', ('nick', 'ident', 'host',
+                                           'realname', 'account', 'away'))
+
+
 class User(object):
     """Represents a user on IRC.
+    ident, host and realname are None until known. If a resolver is set,
+    reading one of them while it's None calls resolver(user) once, so that
+    it can be requested from the server: the value is only available once
+    the reply is received.
+    account is the services account the user is logged in as, if known
+    (extended-join). away is the away message, '' if away for an unknown
+    reason and None if not away (away-notify and WHO replies).
     """
 
+    __slots__ = ('nick', '_ident', '_host', '_realname', 'resolver',
+                 'account', 'away')
+
     def __init__(self, nick, ident=None, host=None, realname=None):
         self.nick = nick
-        self.ident = ident
-        self.host = host
-        self.realname = realname
+        self._ident = ident
+        self._host = host
+        self._realname = realname
+        self.resolver = None
+        self.account = None
+        self.away = None
+
+    def _resolve(self):
+        resolver, self.resolver = self.resolver, None
+        resolver(self)
+
+    @property
+    def ident(self):
+        if self._ident is None and self.resolver is not None:
+            self._resolve()
+        return self._ident
+
+    @ident.setter
+    def ident(self, value):
+        self._ident = value
+
+    @property
+    def host(self):
+        if self._host is None and self.resolver is not None:
+            self._resolve()
+        return self._host
+
+    @host.setter
+    def host(self, value):
+        self._host = value
+
+    @property
+    def realname(self):
+        if self._realname is None and self.resolver is not None:
+            self._resolve()
+        return self._realname
+
+    @realname.setter
+    def realname(self, value):
+        self._realname = value
+
+    def snapshot(self):
+        """Returns a UserSnapshot of this user, which can be sent to another
+        process. Unknown details are not requested to the server.
+        """
+        return UserSnapshot(self.nick, self._ident, self._host,
+                            self._realname, self.account, self.away)
 
     @classmethod
     def from_mask(cls, mask):
@@ -15,7 +77,9 @@ class User(object):
         nick, h = mask.split('!', 1)
         ident, host = h.split('@', 1)
 
-        return cls(nick, ident, host)
+        return cls(nick, sys.intern(ident), sys.intern(host))
 
     def __str__(self):
-        return '{}!{}@{}'.format(self.nick, self.ident, self.host)
+        # Doesn't resolve: what isn't known yet is shown as *
+        return '{}!{}@{}'.format(self.nick, self._ident or '*',
+                                 self._host or '*')
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserInfoCache(object):
+    """Remembers the ident, host and realname of users for ttl seconds, up
+    to maxsize users (least recently used are forgotten first), so that
+    they don't need to be requested again when a user we lost track of
+    shows up in a NAMES reply.
+    Keys should be normalized nicks, see IRCDict.normalize.
+    """
+
+    def __init__(self, maxsize=4096, ttl=3600):
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # nick -> (expiry time, ident, host, realname)
+        self._entries = OrderedDict()
+
+    def get(self, nick, now=None):
+        """Returns (ident, host, realname) or None if unknown or expired.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(nick)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[nick]
+                return None
+            self._entries.move_to_end(nick)
+            return entry[1:]
+
+    def put(self, nick, ident, host, realname=None, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            entries = self._entries
+            old = entries.pop(nick, None)
+            if realname is None and old is not None:
+                realname = old[3]  # JOIN lines don't have the realname
+            entries[nick] = (now + self.ttl, ident, host, realname)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+    def pop(self, nick):
+        with self._lock:
+            self._entries.pop(nick, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Fields requested with WHOX: query type (token), channel, user (ident),
+# host, nick, flags and realname. Replies (354) list them in this order.
+WHOX_FIELDS = 'tcuhnfr'
+
+
+class WhoSync(object):
+    """Queues the WHO requests used to learn the ident, host and realname of
+    the users in our channels.
+    Up to window requests are sent without waiting for the end of the
+    previous ones, each of them for as many targets as the server allows in
+    a comma-separated list. On servers supporting WHOX only the fields we
+    need are requested, tagged with token so that replies to WHOX requests
+    made by the bot's own code can be told apart.
+    A request still unanswered after timeout seconds is forgotten the next
+    time pop_lines() is called (the bot calls it from a timer too), so that a
+    lost or mangled end of WHO (315) can't stop the queue.
+    """
+
+    def __init__(self, window=3, token='152', timeout=60):
+        self._lock = threading.Lock()
+        self.window = window
+        self.token = token
+        self.timeout = timeout
+        self.pending = deque()
+        # The lowercase targets in pending
+        self._queued = set()
+        # lowercase mask sent -> (number of targets, time sent), oldest first
+        self.inflight = OrderedDict()
+
+    def add(self, target):
+        """Queues a WHO for target, unless it's already queued.
+        """
+        key = target.lower()
+        with self._lock:
+            if key not in self._queued:
+                self._queued.add(key)
+                self.pending.append(target)
+
+    def pop_lines(self, whox=False, maxtargets=1, maxlen=510):
+        """Returns the WHO lines that can be sent now, marking them as sent.
+        """
+        suffix = ' %{0},{1}'.format(WHOX_FIELDS, self.token) if whox else ''
+        budget = maxlen - len('WHO ') - len(suffix)
+
+        lines = []
+        now = time.monotonic()
+        with self._lock:
+            inflight = self.inflight
+            while inflight and \
+                    now - next(iter(inflight.values()))[1] >= self.timeout:
+                inflight.popitem(last=False)
+
+            while self.pending and len(inflight) < self.window:
+                targets = [self.pending.popleft()]
+                length = len(targets[0])
+                while self.pending and len(targets) < maxtargets and \
+                        length + 1 + len(self.pending[0]) <= budget:
+                    target = self.pending.popleft()
+                    targets.append(target)
+                    length += 1 + len(target)
+
+                mask = ','.join(targets)
+                self._queued.difference_update(t.lower() for t in targets)
+                inflight[mask.lower()] = (len(targets), now)
+                lines.append('WHO {0}{1}'.format(mask, suffix))
+
+        return lines
+
+    def done(self, mask):
+        """Called at the end of a WHO reply (315) for mask.
+        Some servers don't send back the mask as it was sent (only one of the
+        targets, or a mangled one): if it matches no request, the oldest one
+        is considered done.
+        Returns False if there was no request waiting for an answer.
+        """
+        key = mask.lower()
+        with self._lock:
+            inflight = self.inflight
+            if inflight.pop(key, None) is not None:
+                return True
+            for sent in inflight:
+                if key in sent.split(','):
+                    del inflight[sent]
+                    return True
+            if inflight:
+                inflight.popitem(last=False)
+                return True
+            return False
+
+    def clear(self):
+        with self._lock:
+            self.pending.clear()
+            self._queued.clear()
+            self.inflight.clear()
@@ -0,0 +1,58 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class OrderedWorkers(object):
+    """Runs callbacks on a fixed number of threads, keeping the order of the
+    callbacks submitted with the same key: a key (e.g. a channel name) is
+    always handled by the same thread.
+    Each thread has a queue of at most maxsize callbacks. When it's full
+    submit() blocks, slowing down the caller instead of letting the queue
+    grow without limit.
+    """
+
+    def __init__(self, threads=4, maxsize=1000):
+        self._queues = [queue.Queue(maxsize) for i in range(threads)]
+        self._threads = []
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,),
+                                      name='pyrclib-worker-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, callback, *args):
+        """Queues callback(*args) on the thread handling key.
+        """
+        queues = self._queues
+        queues[hash(key) % len(queues)].put((callback, args))
+
+    def stop(self, wait=True):
+        """Stops the threads once the callbacks already queued are done.
+        """
+        for q in self._queues:
+            q.put(None)
+        if wait:
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+    def __len__(self):
+        """Number of callbacks waiting to be run.
+        """
+        return sum(q.qsize() for q in self._queues)
+
+    def _run(self, q):
+        while True:
+            task = q.get()
+            if task is None:
+                break
+
+            callback, args = task
+            try:
+                callback(*args)
+            except Exception:
+                logger.exception('Unhandled exception in %r', callback)